@@ -0,0 +1,199 @@
+"""
+Precomputed inputs of the clustering dashboards.
+
+The build step reads the clustering outputs of one day type once and writes a
+bundle directory with the tables as parquet, the Plotly figures as JSON and the
+station map asset. The Panel apps load a bundle once per server process through
+`pn.state.as_cached`, so a new session only binds views to already built figures.
+
+Usage:
+    python dashboard_bundle.py rel_avail_weekdays rel_avail_weekend
+"""
+import sys
+import json
+import hashlib
+import argparse
+from pathlib import Path
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+
+__here__ = Path(__file__).parent
+sys.path.append(str((__here__ / "../..").resolve()))
+from analysis.paris.profile_matrix import ProfileMatrix
+from analysis.paris.station_map import build_station_map
+
+BUNDLE_DIR = "bundle"
+
+# clustering outputs the bundle is built from, a newer one makes the bundle stale
+INPUTS = ['wcss_results.csv', 'cluster_sizes.csv', 'station_clusters_with_info.csv', 'profile_matrix', 'cluster_profiles.csv']
+
+TABLES = ['wcss_results', 'cluster_sizes', 'cluster_profiles', 'stations']
+
+# consistent color palette
+PALETTE = px.colors.qualitative.Plotly
+
+
+def _read_inputs(src_dir):
+    src_dir = Path(src_dir)
+    stations = pd.read_csv(src_dir / 'station_clusters_with_info.csv')
+
+    if (src_dir / 'profile_matrix').exists():
+        cluster_profiles = ProfileMatrix.load(src_dir / 'profile_matrix')\
+            .group_mean(stations.set_index('station_id')['cluster'])
+    else:
+        # outputs written before the profile matrix existed
+        cluster_profiles = pd.read_csv(src_dir / 'cluster_profiles.csv', index_col=0)
+        cluster_profiles.columns = [int(col.replace('hour_', '')) for col in cluster_profiles.columns]
+
+    return {
+        'wcss_results': pd.read_csv(src_dir / 'wcss_results.csv'),
+        'cluster_sizes': pd.read_csv(src_dir / 'cluster_sizes.csv', index_col=0),
+        'cluster_profiles': cluster_profiles,
+        'stations': stations,
+    }
+
+
+def build_figures(tables, palette=PALETTE):
+    """
+    The dashboard Plotly figures.
+
+    Returns:
+        dict: `elbow`, `time_course`, `heatmap` and `tsne` figures.
+    """
+    wcss_results, cluster_profiles, stations = tables['wcss_results'], tables['cluster_profiles'], tables['stations']
+
+    elbow_fig = px.line(x=wcss_results['n_clusters'], y=wcss_results['wcss'], title='Elbow Method',
+                        labels={'x': 'Number of clusters', 'y': 'WCSS'})
+
+    hours = [str(col) for col in cluster_profiles.columns]
+    time_course_fig = go.Figure()
+    # every figure and the station map pick the color of a cluster by its id
+    for cluster_id, profile in cluster_profiles.iterrows():
+        time_course_fig.add_trace(go.Scatter(
+            x=hours, y=profile.to_numpy(), mode='lines', name=f'Cluster {cluster_id}',
+            marker_color=palette[int(cluster_id) % len(palette)], showlegend=False
+        ))
+    time_course_fig.update_layout(title='Cluster Profiles (Average Availability per Hour)', xaxis_title='Hour',
+                                  yaxis_title='Average Relative Availability')
+
+    heatmap_fig = px.imshow(cluster_profiles.set_axis(hours, axis=1),
+                            labels=dict(x="Hour", y="Cluster", color="Average Availability"),
+                            color_continuous_scale="YlGnBu", title="Heatmap of Average Availability by Cluster")
+
+    tsne_fig = go.Figure()
+    for cluster_id, cluster_data in stations.groupby('cluster'):
+        tsne_fig.add_trace(go.Scatter(
+            x=cluster_data['tsne_1'], y=cluster_data['tsne_2'], mode='markers',
+            marker_color=palette[int(cluster_id) % len(palette)], name=f'Cluster {cluster_id}', showlegend=False
+        ))
+    tsne_fig.update_layout(title='t-SNE Visualization of Clusters', xaxis_title='t-SNE Dimension 1',
+                           yaxis_title='t-SNE Dimension 2')
+
+    return {'elbow': elbow_fig, 'time_course': time_course_fig, 'heatmap': heatmap_fig, 'tsne': tsne_fig}
+
+
+def build_bundle(src_dir, out_dir=None, palette=PALETTE):
+    """
+    Writes the dashboard bundle of one day type.
+
+    Args:
+        src_dir: Directory of the clustering outputs, e.g. rel_avail_weekdays.
+        out_dir: Bundle directory, defaults to `src_dir`/bundle.
+        palette: List of cluster colors.
+
+    Returns:
+        Path: The bundle directory.
+    """
+    src_dir = Path(src_dir)
+    out_dir = Path(out_dir) if out_dir else src_dir / BUNDLE_DIR
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    tables = _read_inputs(src_dir)
+    cluster_profiles = tables['cluster_profiles']
+    tables['cluster_profiles'] = cluster_profiles.set_axis([str(col) for col in cluster_profiles.columns], axis=1)
+    for name in TABLES:
+        tables[name].to_parquet(out_dir / f"{name}.parquet")
+    tables['cluster_profiles'] = cluster_profiles
+
+    figures = {name: json.loads(fig.to_json()) for name, fig in build_figures(tables, palette).items()}
+    (out_dir / 'figures.json').write_text(json.dumps(figures))
+
+    build_station_map(tables['stations'], palette, out_dir / 'station_map.html')
+
+    return out_dir
+
+
+def input_versions(src_dir):
+    """
+    Modification times in ns of the existing clustering outputs, directories such as the
+    profile matrix by their newest file (overwriting a file does not touch its directory).
+    """
+    src_dir = Path(src_dir)
+    versions = {}
+    for name in INPUTS:
+        path = src_dir / name
+        if path.is_dir():
+            versions[name] = max((f.stat().st_mtime_ns for f in path.rglob('*') if f.is_file()), default=0)
+        elif path.exists():
+            versions[name] = path.stat().st_mtime_ns
+    return versions
+
+
+def is_stale(src_dir, out_dir=None):
+    """
+    True if the bundle is missing or older than one of the clustering outputs.
+    """
+    src_dir = Path(src_dir)
+    figures = (Path(out_dir) if out_dir else src_dir / BUNDLE_DIR) / 'figures.json'
+    if not figures.exists():
+        return True
+    built = figures.stat().st_mtime_ns
+    return any(version > built for version in input_versions(src_dir).values())
+
+
+def load_bundle(src_dir, out_dir=None):
+    """
+    Loads a bundle, building it first if it is stale.
+
+    Returns:
+        dict: The `TABLES` as DataFrames, `figures` as Plotly figure dicts and the `map_path`
+        of the station map asset.
+    """
+    src_dir = Path(src_dir)
+    out_dir = Path(out_dir) if out_dir else src_dir / BUNDLE_DIR
+    if is_stale(src_dir, out_dir):
+        build_bundle(src_dir, out_dir)
+
+    bundle = {name: pd.read_parquet(out_dir / f"{name}.parquet") for name in TABLES}
+    bundle['figures'] = json.loads((out_dir / 'figures.json').read_text())
+    bundle['map_path'] = out_dir / 'station_map.html'
+    return bundle
+
+
+def cached_bundle(src_dir):
+    """
+    The bundle of `src_dir`, loaded once per Panel server process and shared by all
+    sessions. New clustering outputs or a rebuilt bundle change the cache key and are picked
+    up by new sessions.
+    """
+    import panel as pn
+
+    src_dir = Path(src_dir).resolve()
+    if is_stale(src_dir):
+        build_bundle(src_dir)
+    # the key follows the clustering outputs as well as the bundle built from them
+    versions = input_versions(src_dir)
+    versions['figures.json'] = (src_dir / BUNDLE_DIR / 'figures.json').stat().st_mtime_ns
+    version = hashlib.sha256(json.dumps(versions, sort_keys=True).encode()).hexdigest()[:16]
+    return pn.state.as_cached(f"dashboard_bundle:{src_dir}:{version}", load_bundle, src_dir=src_dir)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build the dashboard bundles of clustering output directories")
+    parser.add_argument("src_dirs", nargs="+", help="Directories of the clustering outputs")
+
+    args = parser.parse_args()
+
+    for src_dir in args.src_dirs:
+        print(f"{src_dir}: {build_bundle(src_dir)}")
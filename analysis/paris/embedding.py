@@ -0,0 +1,174 @@
+"""
+Cached, incremental 2-D embedding of the station profiles.
+
+Embeddings are fitted with Barnes-Hut t-SNE from a PCA initialization and cached
+on disk keyed on a hash of the profile matrix. When a named embedding (e.g. one per
+day type) already exists, stations whose profile did not change keep their
+coordinates and new or changed stations are placed next to their nearest
+neighbours in profile space, so re-runs are near-instant and the layout stays
+stable. Above `max_new_fraction` changed stations the embedding is refitted,
+starting from the previous coordinates of the known stations.
+"""
+import os
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from sklearn.manifold import TSNE
+from sklearn.neighbors import NearestNeighbors
+
+from analysis.paris.k_selection import matrix_hash
+
+__here__ = Path(__file__).parent
+
+CACHE_DIR = Path(os.getenv("VELIB_EMBEDDING_CACHE_DIR", __here__ / ".embedding_cache"))
+
+COLUMNS = ['tsne_1', 'tsne_2']
+
+
+def fit_embedding(X, init='pca', perplexity=30, random_state=0):
+    """
+    Fits a Barnes-Hut t-SNE embedding.
+
+    Args:
+        X: Profile matrix, one row per station.
+        init: 'pca' or an array of initial coordinates, rescaled like sklearn's PCA init.
+        perplexity: t-SNE perplexity, capped below the number of rows.
+        random_state: Seed of the fit.
+
+    Returns:
+        np.ndarray: Coordinates of shape (n_stations, 2).
+    """
+    if isinstance(init, np.ndarray):
+        init = (init - init.mean(axis=0)) / np.std(init[:, 0]) * 1e-4
+
+    tsne = TSNE(
+        n_components=2, method='barnes_hut', init=init, learning_rate='auto',
+        perplexity=min(perplexity, len(X) - 1), random_state=random_state
+    )
+    return tsne.fit_transform(X)
+
+
+def place_stations(X_new, X_ref, coords_ref, n_neighbors=10):
+    """
+    Places stations into an existing embedding at the inverse-distance weighted mean of the
+    coordinates of their nearest reference stations in profile space.
+
+    Args:
+        X_new: Profiles of the stations to place.
+        X_ref: Profiles of the embedded stations.
+        coords_ref: Coordinates of the embedded stations.
+        n_neighbors: Number of reference stations per placed station.
+
+    Returns:
+        np.ndarray: Coordinates of shape (len(X_new), 2).
+    """
+    if len(X_new) == 0:
+        return np.empty((0, 2))
+
+    nn = NearestNeighbors(n_neighbors=min(n_neighbors, len(X_ref))).fit(X_ref)
+    distances, neighbors = nn.kneighbors(X_new)
+    weights = 1 / (distances + 1e-9)
+    weights /= weights.sum(axis=1, keepdims=True)
+    return (coords_ref[neighbors] * weights[:, :, None]).sum(axis=1)
+
+
+def _latest_path(cache_dir, name):
+    return Path(cache_dir) / f"latest_{name}.txt"
+
+
+def load_embedding(cache_dir, key):
+    """
+    Cached embedding `key` as a dict of `station_ids`, `values` (the embedded profiles)
+    and `coords`, or None.
+    """
+    path = Path(cache_dir) / f"{key}.npz"
+    if not path.exists():
+        return None
+    with np.load(path, allow_pickle=False) as data:
+        return {name: data[name] for name in ('station_ids', 'values', 'coords')}
+
+
+def load_latest(cache_dir, name):
+    """
+    Last embedding computed under `name`, or None.
+    """
+    latest = _latest_path(cache_dir, name)
+    if not latest.exists():
+        return None
+    return load_embedding(cache_dir, latest.read_text().strip())
+
+
+def _save(cache_dir, key, name, station_ids, X, coords):
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    tmp = cache_dir / f"{key}.tmp.npz"
+    np.savez(tmp, station_ids=station_ids, values=X, coords=coords)
+    os.replace(tmp, cache_dir / f"{key}.npz")
+    if name:
+        _latest_path(cache_dir, name).write_text(key)
+
+
+def embed_profiles(X, station_ids, name=None, max_new_fraction=0.1, n_neighbors=10, atol=1e-2,
+                   perplexity=30, random_state=0, cache_dir=CACHE_DIR):
+    """
+    2-D embedding of station profiles, reusing cached and previous embeddings.
+
+    Args:
+        X: Profile matrix, one row per station, without missing values.
+        station_ids: Station id of every row.
+        name: Name under which the embedding is updated incrementally, e.g. the day type.
+              None always fits from scratch on a cache miss.
+        max_new_fraction: Largest fraction of new or changed stations placed into the previous
+                          embedding of `name`; above it the embedding is refitted from the
+                          previous coordinates of the known stations.
+        n_neighbors: Reference stations used to place a station.
+        atol: Largest absolute difference, at every hour, under which a profile counts as
+              unchanged. The default is meant for mean relative availabilities, between 0 and 1.
+        perplexity: t-SNE perplexity.
+        random_state: Seed of the fits.
+        cache_dir: Directory of cached embeddings.
+
+    Returns:
+        pd.DataFrame: `tsne_1` and `tsne_2` indexed by station id, in the order of `station_ids`.
+    """
+    X = np.asarray(X, dtype=np.float64)
+    station_ids = np.asarray(station_ids)
+    if station_ids.dtype == object:
+        # fixed width strings hash by value and load without pickle
+        station_ids = station_ids.astype(str)
+
+    key = matrix_hash(X, station_ids=matrix_hash(station_ids), perplexity=perplexity, random_state=random_state)
+    cached = load_embedding(cache_dir, key)
+
+    if cached is not None:
+        coords = cached['coords']
+        if name:
+            _latest_path(cache_dir, name).write_text(key)
+    else:
+        previous = load_latest(cache_dir, name) if name else None
+        coords = None
+
+        if previous is not None:
+            index = pd.Index(previous['station_ids'])
+            rows = index.get_indexer(station_ids)
+            known = rows >= 0
+            unchanged = known.copy()
+            unchanged[known] = np.isclose(previous['values'][rows[known]], X[known], rtol=0, atol=atol).all(axis=1)
+
+            if unchanged.any() and (~unchanged).mean() <= max_new_fraction:
+                coords = np.empty((len(X), 2))
+                coords[unchanged] = previous['coords'][rows[unchanged]]
+                coords[~unchanged] = place_stations(X[~unchanged], X[unchanged], coords[unchanged], n_neighbors)
+            elif known.any():
+                # known stations start from their previous coordinates, even if their profile changed
+                init = np.empty((len(X), 2))
+                init[known] = previous['coords'][rows[known]]
+                init[~known] = place_stations(X[~known], X[known], init[known], n_neighbors)
+                coords = fit_embedding(X, init, perplexity, random_state)
+
+        if coords is None:
+            coords = fit_embedding(X, 'pca', perplexity, random_state)
+
+        _save(cache_dir, key, name, station_ids, X, coords)
+
+    return pd.DataFrame(coords, columns=COLUMNS, index=pd.Index(station_ids, name='station_id'))
@@ -0,0 +1,172 @@
+"""
+Selection of the number of clusters for the station profiles.
+
+Candidate k values are fitted either independently in a process pool or as a
+warm-started chain where the k+1 solution starts from the k centroids. Both
+stop once the inertia curve flattens, and results are cached on disk keyed on
+a hash of the input matrix and the sweep parameters.
+"""
+import os
+import json
+import time
+import hashlib
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from sklearn.metrics import silhouette_score
+
+__here__ = Path(__file__).parent
+
+CACHE_DIR = Path(os.getenv("VELIB_KSELECT_CACHE_DIR", __here__ / ".k_selection_cache"))
+
+# above this number of rows MiniBatchKMeans is used unless requested otherwise
+MINIBATCH_MIN_SAMPLES = 20_000
+
+# silhouette is computed on a sample of this size for large matrices
+SILHOUETTE_SAMPLE_SIZE = 5_000
+
+
+def _model(k, minibatch, init='k-means++', n_init=10, random_state=0):
+    if minibatch:
+        return MiniBatchKMeans(n_clusters=k, init=init, n_init=n_init, batch_size=4096, random_state=random_state)
+    return KMeans(n_clusters=k, init=init, max_iter=300, n_init=n_init, random_state=random_state)
+
+
+def _silhouette(X, labels, random_state=0):
+    if len(np.unique(labels)) < 2:
+        return np.nan
+    sample_size = min(len(X), SILHOUETTE_SAMPLE_SIZE)
+    return silhouette_score(X, labels, sample_size=sample_size, random_state=random_state)
+
+
+def fit_k(X, k, minibatch=False, init='k-means++', random_state=0):
+    """
+    Fits one candidate k.
+
+    Args:
+        X: Profile matrix, one row per station.
+        k: Number of clusters.
+        minibatch: Use MiniBatchKMeans.
+        init: 'k-means++' or an array of initial centroids (warm start, fitted once).
+        random_state: Seed of the fit.
+
+    Returns:
+        dict: `n_clusters`, `wcss`, `silhouette`, `seconds` and the fitted `centers`.
+    """
+    t0 = time.perf_counter()
+    n_init = 1 if isinstance(init, np.ndarray) else 10
+    model = _model(k, minibatch, init, n_init, random_state).fit(X)
+    seconds = time.perf_counter() - t0
+
+    return {
+        'n_clusters': k,
+        'wcss': model.inertia_,
+        'silhouette': _silhouette(X, model.labels_, random_state),
+        'seconds': seconds,
+        'centers': model.cluster_centers_,
+    }
+
+
+def _add_center(X, centers):
+    """
+    Initial centroids for k+1 clusters: the k centroids plus the point farthest from them.
+    """
+    distances = ((X[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2).min(axis=1)
+    return np.vstack([centers, X[np.argmax(distances)]])
+
+
+def _flattened(wcss, tol, patience):
+    """
+    True once the last `patience` drops of the inertia curve are all below `tol` times the
+    inertia of the first candidate.
+    """
+    if len(wcss) <= patience:
+        return False
+    drops = -np.diff(wcss[-(patience + 1):])
+    return bool(np.all(drops < tol * wcss[0]))
+
+
+def matrix_hash(X, **params):
+    """
+    Hash of a matrix and the parameters it is processed with, used as cache key.
+    """
+    X = np.ascontiguousarray(X)
+    h = hashlib.sha256()
+    h.update(str((X.shape, X.dtype.str)).encode())
+    h.update(X.tobytes())
+    h.update(json.dumps(params, sort_keys=True, default=str).encode())
+    return h.hexdigest()
+
+
+def select_k(X, ks=range(1, 11), workers=None, warm_start=False, minibatch=None,
+             tol=0.01, patience=2, random_state=0, cache_dir=CACHE_DIR):
+    """
+    Elbow sweep over candidate numbers of clusters.
+
+    Args:
+        X: Profile matrix, one row per station.
+        ks: Candidate numbers of clusters, in increasing order.
+        workers: Processes fitting candidates concurrently. 1 fits in this process,
+                 None uses all cores. Ignored with `warm_start`, which is sequential.
+        warm_start: Start every k from the k-1 centroids plus the worst represented point.
+        minibatch: Use MiniBatchKMeans. Defaults to True above `MINIBATCH_MIN_SAMPLES` rows.
+        tol: Relative inertia drop, as a fraction of the first inertia, below which the curve
+             counts as flat.
+        patience: Number of consecutive flat steps after which the sweep stops.
+        random_state: Seed of the fits.
+        cache_dir: Directory of cached sweeps, None disables caching.
+
+    Returns:
+        pd.DataFrame: One row per fitted k with `n_clusters`, `wcss`, `silhouette` and
+        `seconds`, the `wcss_results.csv` format plus diagnostics.
+    """
+    X = np.asarray(X, dtype=np.float64)
+    ks = list(ks)
+    minibatch = len(X) > MINIBATCH_MIN_SAMPLES if minibatch is None else minibatch
+    # the batch size decides how far past the elbow the parallel sweep goes
+    workers = 1 if warm_start else workers or os.cpu_count()
+
+    cache_path = None
+    if cache_dir is not None:
+        key = matrix_hash(X, ks=ks, workers=workers, warm_start=warm_start, minibatch=minibatch,
+                          tol=tol, patience=patience, random_state=random_state,
+                          silhouette_sample_size=SILHOUETTE_SAMPLE_SIZE)
+        cache_path = Path(cache_dir) / f"{key}.csv"
+        if cache_path.exists():
+            return pd.read_csv(cache_path)
+
+    results = []
+    if warm_start:
+        centers = None
+        for k in ks:
+            init = 'k-means++' if centers is None or len(centers) != k - 1 else _add_center(X, centers)
+            result = fit_k(X, k, minibatch, init, random_state)
+            centers = result['centers']
+            results.append(result)
+            if _flattened([r['wcss'] for r in results], tol, patience):
+                break
+    else:
+        if workers == 1:
+            for k in ks:
+                results.append(fit_k(X, k, minibatch, random_state=random_state))
+                if _flattened([r['wcss'] for r in results], tol, patience):
+                    break
+        else:
+            # candidates are fitted in batches of `workers`, the curve is checked between batches
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                for i in range(0, len(ks), workers):
+                    batch = ks[i:i + workers]
+                    results += pool.map(fit_k, [X] * len(batch), batch, [minibatch] * len(batch),
+                                        ['k-means++'] * len(batch), [random_state] * len(batch))
+                    if _flattened([r['wcss'] for r in results], tol, patience):
+                        break
+
+    sweep = pd.DataFrame([{key: r[key] for key in ('n_clusters', 'wcss', 'silhouette', 'seconds')} for r in results])
+
+    if cache_path is not None:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        sweep.to_csv(cache_path, index=False)
+
+    return sweep
@@ -0,0 +1,169 @@
+"""
+Live availability layer of the clustering dashboards.
+
+The ingestion pipeline publishes every poll as `latest.parquet` in a snapshot
+directory (`gbfs_pipeline.py --snapshot_dir`). One `SnapshotStore` per server
+process re-reads that file only when it changed, and every session holds a Bokeh
+point layer whose data source is patched in place, for the changed stations only,
+from a periodic callback.
+"""
+import os
+import threading
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import panel as pn
+from bokeh.models import ColumnDataSource
+from bokeh.palettes import RdYlGn11
+from bokeh.plotting import figure
+from bokeh.transform import linear_cmap
+
+# same as gbfs_pipeline.LATEST_SNAPSHOT, not imported to keep dlt out of the dashboards
+LATEST_SNAPSHOT = "latest.parquet"
+
+SNAPSHOT_COLUMNS = ['station_id', 'num_bikes_available', 'num_docks_available', 'time']
+
+# data source columns patched on every update
+LIVE_COLUMNS = ['bikes', 'docks', 'rel_avail']
+
+EARTH_RADIUS = 6378137
+
+
+def web_mercator(lat, lon):
+    """
+    Converts WGS84 coordinates to web mercator x and y, in meters.
+    """
+    lat, lon = np.radians(np.asarray(lat, dtype=float)), np.radians(np.asarray(lon, dtype=float))
+    return EARTH_RADIUS * lon, EARTH_RADIUS * np.log(np.tan(np.pi / 4 + lat / 2))
+
+
+class SnapshotStore:
+    """
+    Latest station status snapshot of a snapshot directory, shared by all sessions of a
+    process. The file is only read again when its modification time changes.
+    """
+
+    def __init__(self, snapshot_dir):
+        self.path = Path(snapshot_dir) / LATEST_SNAPSHOT
+        self._lock = threading.Lock()
+        self._version = None
+        self._snapshot = None
+
+    def latest(self):
+        """
+        Returns:
+            tuple: The snapshot version (None if there is no snapshot yet) and the snapshot
+            as a DataFrame indexed by station id as string.
+        """
+        try:
+            version = self.path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return None, None
+
+        if version != self._version:
+            with self._lock:
+                if version != self._version:
+                    snapshot = pd.read_parquet(self.path, columns=SNAPSHOT_COLUMNS)
+                    snapshot['station_id'] = snapshot.station_id.astype(str)
+                    self._snapshot = snapshot.drop_duplicates('station_id', keep='last').set_index('station_id')
+                    self._version = version
+        return self._version, self._snapshot
+
+
+def shared_store(snapshot_dir):
+    """
+    The `SnapshotStore` of `snapshot_dir`, created once per Panel server process.
+    """
+    snapshot_dir = str(Path(snapshot_dir).resolve())
+    return pn.state.as_cached(f"snapshot_store:{snapshot_dir}", SnapshotStore, snapshot_dir=snapshot_dir)
+
+
+class LiveAvailabilityLayer:
+    """
+    Map of the stations colored by their current relative availability.
+
+    Args:
+        stations: DataFrame with `station_id`, `lat` and `lon` of the mapped stations.
+        store: The `SnapshotStore` to follow.
+        period: Refresh period in milliseconds.
+    """
+
+    def __init__(self, stations, store, period=60_000):
+        stations = stations.dropna(subset=['lat', 'lon'])
+        self.store = store
+        self.period = period
+        self.station_ids = pd.Index(stations.station_id.astype(str))
+        self._version = None
+        self._values = {c: np.full(len(stations), np.nan) for c in LIVE_COLUMNS}
+
+        x, y = web_mercator(stations.lat, stations.lon)
+        self.source = ColumnDataSource(dict(x=x, y=y, station_id=self.station_ids.to_numpy(), **self._values))
+
+        fig = figure(
+            x_axis_type="mercator", y_axis_type="mercator", tools="pan,wheel_zoom,reset,hover",
+            tooltips=[("Station ID", "@station_id"), ("Bikes", "@bikes"), ("Docks", "@docks")],
+            title="Live relative availability", sizing_mode='stretch_both'
+        )
+        fig.add_tile("OpenStreetMap Mapnik")
+        fig.scatter('x', 'y', source=self.source, size=7, fill_alpha=0.8, line_color=None,
+                    color=linear_cmap('rel_avail', RdYlGn11[::-1], 0, 1, nan_color='lightgrey'))
+        self.pane = pn.pane.Bokeh(fig, sizing_mode='stretch_both')
+        self.status = pn.pane.Markdown("No live snapshot yet")
+
+        self.update()
+
+    def _aligned(self, snapshot):
+        snapshot = snapshot.reindex(self.station_ids)
+        bikes = snapshot.num_bikes_available.to_numpy(dtype=float)
+        docks = snapshot.num_docks_available.to_numpy(dtype=float)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            rel_avail = bikes / (bikes + docks)
+        return {'bikes': bikes, 'docks': docks, 'rel_avail': rel_avail}
+
+    def update(self):
+        """
+        Patches the stations that changed since the last update. Does nothing if the
+        snapshot did not change.
+        """
+        version, snapshot = self.store.latest()
+        if version is None or version == self._version:
+            return
+
+        values = self._aligned(snapshot)
+        changed = np.zeros(len(self.station_ids), dtype=bool)
+        for c in LIVE_COLUMNS:
+            old, new = self._values[c], values[c]
+            changed |= ~((old == new) | (np.isnan(old) & np.isnan(new)))
+
+        rows = np.flatnonzero(changed)
+        if len(rows):
+            self.source.patch({
+                c: list(zip(rows.tolist(), values[c][rows].tolist()))
+                for c in LIVE_COLUMNS
+            })
+
+        self._values, self._version = values, version
+        self.status.object = f"Snapshot of {snapshot.time.max():%Y-%m-%d %H:%M}, {len(rows)} station(s) updated"
+
+    def start(self):
+        """
+        Starts the periodic refresh of the current session.
+        """
+        return pn.state.add_periodic_callback(self.update, period=self.period)
+
+    def panel(self):
+        return pn.Column(self.status, self.pane, sizing_mode='stretch_both')
+
+
+def live_layer(stations, snapshot_dir=None, period=60_000):
+    """
+    A started `LiveAvailabilityLayer` following `snapshot_dir` (defaults to the
+    VELIB_LIVE_DIR environment variable), or None if no snapshot directory is configured.
+    """
+    snapshot_dir = snapshot_dir or os.getenv("VELIB_LIVE_DIR")
+    if not snapshot_dir:
+        return None
+
+    layer = LiveAvailabilityLayer(stations, shared_store(snapshot_dir), period)
+    layer.start()
+    return layer
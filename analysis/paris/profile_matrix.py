@@ -0,0 +1,153 @@
+"""
+Dense station x hour profile matrices.
+
+A profile matrix holds a float32 value per station and hour, an explicit mask of
+the observed cells and the station ids of its rows. It is saved as a directory of
+.npy files that can be memory-mapped, and is the artifact shared by the
+clustering, the embedding, melt_df.py and the dashboards.
+"""
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+N_HOURS = 24
+
+
+class ProfileMatrix:
+    """
+    Station x hour profiles with an observation mask.
+
+    Args:
+        values: float32 array of shape (n_stations, n_hours), NaN where not observed.
+        mask: bool array of the same shape, True where a value was observed.
+        station_ids: Station id of every row.
+        hours: Hour of every column.
+    """
+
+    FILES = ('values', 'mask', 'station_ids', 'hours')
+
+    def __init__(self, values, mask, station_ids, hours):
+        self.values = values
+        self.mask = mask
+        self.station_ids = station_ids
+        self.hours = hours
+
+    def __len__(self):
+        return len(self.station_ids)
+
+    def complete(self):
+        """
+        The stations observed at every hour.
+        """
+        rows = self.mask.all(axis=1)
+        return ProfileMatrix(self.values[rows], self.mask[rows], self.station_ids[rows], self.hours)
+
+    def select(self, station_ids):
+        """
+        The rows of `station_ids`, in that order. Unknown stations are dropped.
+        """
+        index = pd.Index(self.station_ids)
+        rows = index.get_indexer(np.asarray(station_ids))
+        rows = rows[rows >= 0]
+        return ProfileMatrix(self.values[rows], self.mask[rows], self.station_ids[rows], self.hours)
+
+    def to_frame(self, prefix=''):
+        """
+        The profiles as a DataFrame indexed by station id, with `<prefix><hour>` columns
+        (plain integer hours without prefix).
+        """
+        columns = [f"{prefix}{h}" for h in self.hours] if prefix else list(self.hours)
+        return pd.DataFrame(
+            np.asarray(self.values), columns=columns,
+            index=pd.Index(np.asarray(self.station_ids), name='station_id')
+        )
+
+    def group_mean(self, labels):
+        """
+        Mean profile per label, e.g. per cluster, ignoring unobserved cells.
+
+        Args:
+            labels: One label per row, or a pd.Series of labels indexed by station id,
+                    in which case only the labelled stations are used.
+
+        Returns:
+            pd.DataFrame: One row per label, one column per hour.
+        """
+        if isinstance(labels, pd.Series):
+            selected = self.select(labels.index)
+            return selected.group_mean(labels.reindex(np.asarray(selected.station_ids)).to_numpy())
+
+        labels = np.asarray(labels)
+        groups, inverse = np.unique(labels, return_inverse=True)
+        mask = np.asarray(self.mask)
+        sums = np.zeros((len(groups), len(self.hours)))
+        counts = np.zeros((len(groups), len(self.hours)))
+        np.add.at(sums, inverse, np.where(mask, self.values, 0))
+        np.add.at(counts, inverse, mask)
+        with np.errstate(invalid='ignore'):
+            means = sums / counts
+        return pd.DataFrame(means, index=pd.Index(groups, name='cluster'), columns=list(self.hours))
+
+    def save(self, path):
+        """
+        Saves the matrix as one .npy file per array in the directory `path`.
+        """
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        for name in self.FILES:
+            np.save(path / f"{name}.npy", _fixed_width(getattr(self, name)), allow_pickle=False)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """
+        Loads a matrix saved with `save`, memory-mapped unless `mmap` is False.
+        """
+        path = Path(path)
+        mmap_mode = 'r' if mmap else None
+        return cls(*(np.load(path / f"{name}.npy", mmap_mode=mmap_mode, allow_pickle=False) for name in cls.FILES))
+
+
+def _fixed_width(array):
+    """
+    `array` with a fixed width dtype. Object arrays, e.g. station ids read through pandas,
+    would be pickled by np.save and could not be memory-mapped: integer ids become int64,
+    anything else a unicode string array.
+    """
+    array = np.asarray(array)
+    if array.dtype != object:
+        return array
+    if all(isinstance(v, (int, np.integer)) and not isinstance(v, bool) for v in array):
+        return array.astype(np.int64)
+    return array.astype(str)
+
+
+def build_profile_matrix(station_ids, hours, values, n_hours=N_HOURS):
+    """
+    Pivots long (station, hour, value) records into a profile matrix in one vectorized pass.
+
+    Args:
+        station_ids: Station id of every record.
+        hours: Hour (0 to n_hours - 1) of every record.
+        values: Value of every record. NaN values count as unobserved.
+        n_hours: Number of columns.
+
+    Returns:
+        ProfileMatrix: One row per distinct station, sorted by station id.
+    """
+    stations, rows = np.unique(np.asarray(station_ids), return_inverse=True)
+    cols = np.asarray(hours, dtype=np.int64)
+
+    matrix = np.full((len(stations), n_hours), np.nan, dtype=np.float32)
+    matrix[rows, cols] = np.asarray(values, dtype=np.float32)
+    mask = ~np.isnan(matrix)
+
+    return ProfileMatrix(matrix, mask, stations, np.arange(n_hours))
+
+
+def melt_group_means(means):
+    """
+    Long format of `ProfileMatrix.group_mean`: one (cluster, hour, avg_rel_avail) row per
+    cell, ordered by hour and cluster.
+    """
+    return means.rename_axis(columns='hour').stack().rename('avg_rel_avail').reset_index()\
+        .sort_values(['hour', 'cluster'], kind='stable').reset_index(drop=True)
@@ -5,20 +5,24 @@ sys.path.append(
     os.path.abspath("../../")
 )
 # %%
-from helpers.cloud.aws import get_athena_conn
+from helpers.cloud.cache import QueryCache
 # %%
-conn = get_athena_conn()
+# results are cached locally, VELIB_BACKEND=duckdb reads the local mirror instead of Athena
+cache = QueryCache()
 
 # %%
 import pandas as pd
 
 # %%
-df = pd.read_sql(
-    """SELECT 
-    station_id, hour, AVG(rel_avail) as avg_rel_avail 
-    FROM paris.bike_rel_avail_weekdays
-    GROUP BY station_id,hour""",
-    conn)
+df = cache.read_sql(
+    """SELECT
+    station_id, hour, SUM(sum_rel_avail) / SUM(n_rel_avail) as avg_rel_avail
+    FROM paris.bike_avail_hourly_stats
+    WHERE day_type = 'weekday'
+    --exclude (para/o)lympic games
+    AND (snapshot_date < DATE '2024-07-15' OR snapshot_date > DATE '2024-08-31')
+    GROUP BY station_id,hour
+    HAVING SUM(n_rel_avail) > 0""")
 # %%
 station_id_vs_hour = pd.crosstab(
     df.station_id, df.hour, df.avg_rel_avail, aggfunc=lambda x: x #single value per combination
@@ -30,14 +34,12 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 import numpy as np
 
+from analysis.paris.k_selection import select_k
+
 # Determine optimal number of clusters using the Elbow Method:
-wcss = []
-for i in range(1, 11):
-    kmeans = KMeans(n_clusters=i, init='k-means++', max_iter=300, n_init=10, random_state=0)
-    kmeans.fit(station_id_vs_hour)
-    wcss.append(kmeans.inertia_)
+k_selection = select_k(station_id_vs_hour.to_numpy(), range(1, 11))
 
-plt.plot(range(1, 11), wcss)
+plt.plot(k_selection.n_clusters, k_selection.wcss)
 plt.title('Elbow Method')
 plt.xlabel('Number of clusters')
 plt.ylabel('WCSS')
@@ -84,11 +86,11 @@ print("Cluster Sizes:")
 print(station_id_vs_hour['cluster'].value_counts())
 
 # %%
-from sklearn.manifold import TSNE
+from analysis.paris.embedding import embed_profiles
 
-# Apply t-SNE
-# tsne = TSNE(n_components=2, random_state=0)
-# tsne_result = tsne.fit_transform(station_id_vs_hour.drop('cluster', axis=1))
+# Apply t-SNE (cached, only new or changed stations are placed on re-runs)
+profiles = station_id_vs_hour.drop('cluster', axis=1)
+tsne_result = embed_profiles(profiles, profiles.index, name='weekday_notebook').to_numpy()
 
 # Create a DataFrame for the t-SNE results
 tsne_df = pd.DataFrame({'tsne_1': tsne_result[:, 0], 'tsne_2': tsne_result[:, 1], 'cluster': station_id_vs_hour['cluster']})
@@ -101,8 +103,8 @@ plt.xlabel('t-SNE Dimension 1')
 plt.ylabel('t-SNE Dimension 2')
 plt.show()
 # %%
-station_info = pd.read_sql(
-    "SELECT * FROM paris.historical_stations", conn
+station_info = cache.read_sql(
+    "SELECT * FROM paris.historical_stations"
 )
 # %%
 # Merge station_id_vs_hour and station_info on station_id
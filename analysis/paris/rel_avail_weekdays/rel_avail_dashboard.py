@@ -3,111 +3,38 @@ import os
 
 import panel as pn
 pn.extension('plotly')
-import plotly.express as px
-import plotly.graph_objects as go
 
-import pandas as pd
-from sklearn.cluster import KMeans
-import numpy as np
-from sklearn.manifold import TSNE
-import folium
-import holoviews as hv
-hv.extension('plotly')
+sys.path.append(os.path.abspath("../../.."))
+from analysis.paris.dashboard_bundle import cached_bundle, BUNDLE_DIR
+from analysis.paris.live_layer import live_layer
 
-# Data Retrieval from CSV files
-cluster_profiles = pd.read_csv("cluster_profiles.csv", index_col=0)
-cluster_sizes = pd.read_csv("cluster_sizes.csv", index_col=0)
-station_clusters_with_info = pd.read_csv("station_clusters_with_info.csv")
-station_clusters = pd.read_csv("station_clusters_with_info.csv", index_col=0)
-wcss_results = pd.read_csv("wcss_results.csv")
+# Data Retrieval: tables and figures precomputed by dashboard_bundle.py, loaded once per
+# server process and shared by all sessions. Serve with
+# panel serve rel_avail_dashboard.py --static-dirs bundle=./bundle
+bundle = cached_bundle(os.path.abspath("."))
+figures = bundle['figures']
 
-# Remove "hour_" from column names in cluster_profiles
-cluster_profiles.columns = [col.replace('hour_', '') for col in cluster_profiles.columns]
-
-# Remove "hour_" from column names in station_clusters_with_info
-station_clusters_with_info.columns = [col.replace('hour_', '') for col in station_clusters_with_info.columns]
-
-# Remove "hour_" from column names in station_clusters
-station_clusters.columns = [col.replace('hour_', '') for col in station_clusters.columns]
-
-
-# Elbow Method Plot from loaded data
-elbow_fig = px.line(x=wcss_results['n_clusters'], y=wcss_results['wcss'], title='Elbow Method', labels={'x': 'Number of clusters', 'y': 'WCSS'})
-elbow_plot = pn.pane.Plotly(elbow_fig)
-
-# Consistent color palette
-palette = px.colors.qualitative.Plotly
+# Elbow Method Plot
+elbow_plot = pn.pane.Plotly(figures['elbow'])
 
 # Cluster Profiles Visualization
-time_course_fig = go.Figure()
-n_clusters = len(cluster_profiles)
-
-cluster_profiles.columns = [str(col) for col in cluster_profiles.columns]
-
-for i in range(n_clusters):
-    time_course_fig.add_trace(
-        go.Scatter(x=cluster_profiles.columns, y=cluster_profiles.iloc[i], mode='lines', name=f'Cluster {i}',
-                   marker_color=palette[i % len(palette)], showlegend=False))
-
-time_course_fig.update_layout(title='Cluster Profiles (Average Availability per Hour)', xaxis_title='Hour', yaxis_title='Average Relative Availability')
-time_course_plot = pn.pane.Plotly(time_course_fig)
+time_course_plot = pn.pane.Plotly(figures['time_course'])
 
 # Heatmap Visualization
-heatmap_fig = px.imshow(cluster_profiles, labels=dict(x="Hour", y="Cluster", color="Average Availability"), color_continuous_scale="YlGnBu", title="Heatmap of Average Availability by Cluster")
-heatmap_plot = pn.pane.Plotly(heatmap_fig)
+heatmap_plot = pn.pane.Plotly(figures['heatmap'])
 
 # Cluster Size Display
-cluster_sizes_pane = pn.pane.Markdown(f"Cluster Sizes:\n{cluster_sizes.to_markdown()}")
+cluster_sizes_pane = pn.pane.Markdown(f"Cluster Sizes:\n{bundle['cluster_sizes'].to_markdown()}")
 
 # t-SNE Visualization
-tsne_fig = go.Figure()
-
-for cluster_id in range(n_clusters): #enumerate(station_clusters['cluster'].unique().sort()):
-    cluster_data = station_clusters[station_clusters['cluster'] == cluster_id]
-    tsne_fig.add_trace(go.Scatter(
-        x=cluster_data['tsne_1'],
-        y=cluster_data['tsne_2'],
-        mode='markers',
-        marker_color=palette[cluster_id % len(palette)], #dict(color=palette[cluster_id % len(palette)]),
-        name=f'Cluster {cluster_id}',
-        showlegend=False
-    ))
+tsne_plot = pn.pane.Plotly(figures['tsne'])
 
-tsne_fig.update_layout(
-    title='t-SNE Visualization of Clusters',
-    xaxis_title='t-SNE Dimension 1',
-    yaxis_title='t-SNE Dimension 2'
+# Station Map: static asset of the bundle
+map_pane = pn.pane.HTML(
+    f'<iframe src="{BUNDLE_DIR}/{bundle["map_path"].name}" width="100%" height="800" style="border:none"></iframe>',
+    sizing_mode='stretch_both'
 )
 
-tsne_plot = pn.pane.Plotly(tsne_fig)
-
-
-# Station Map with data from station_clusters_with_info.csv
-
-center_lat = station_clusters_with_info['lat'].mean()
-center_lon = station_clusters_with_info['lon'].mean()
-m = folium.Map(location=[center_lat, center_lon], zoom_start=12)
-
-for index, row in station_clusters_with_info.iterrows():
-    station_lat = row['lat']
-    station_lon = row['lon']
-    cluster_id = row['cluster']
-    color = palette[int(cluster_id % len(palette))]
-    folium.CircleMarker(
-        location=[station_lat, station_lon],
-        radius=5,
-        color=color,
-        fill=True,
-        fill_color=color,
-        fill_opacity=0.7,
-        popup=f"Station ID: {row['station_id']}, Cluster: {cluster_id}"
-    ).add_to(m)
-
-
-# 5. Display the map
-
-map_pane = pn.pane.HTML(m._repr_html_())
-
 # %%
 # Dashboard Layout using Gridspec
 template = pn.GridSpec(width = 1200)
@@ -120,6 +47,12 @@ template[3:5, 2:4] = heatmap_plot
 template[5:7, :4] = tsne_plot
 template[1:8, 4:8] = map_pane
 
+# Live mode: current availability from the latest snapshot of the ingestion pipeline,
+# enabled with VELIB_LIVE_DIR=<snapshot dir of gbfs_pipeline.py>, patched every minute
+live = live_layer(bundle['stations'])
+if live is not None:
+    template[8:14, :8] = live.panel()
+
 dashboard = template
 dashboard.servable()
-# dashboard.show(port=38951, websocket_origin='localhost:8080')
\ No newline at end of file
+# dashboard.show(port=38951, websocket_origin='localhost:8080')
@@ -1,6 +1,9 @@
+import sys
+import os
 import pandas as pd
-df = pd.read_csv("./cluster_profiles.csv").set_index("cluster")
-wide = df.reset_index().melt(id_vars=['cluster'])
-wide['variable'] = wide.variable.str.replace("hour_", "")
-wide.columns = ['cluster', 'hour', 'avg_rel_avail']
-wide.to_csv('cluster_profiles_wide.csv')
\ No newline at end of file
+sys.path.append(os.path.abspath("../../.."))
+from analysis.paris.profile_matrix import ProfileMatrix, melt_group_means
+
+profile_matrix = ProfileMatrix.load("profile_matrix")
+labels = pd.read_csv("station_clusters.csv", usecols=['station_id', 'cluster']).set_index('station_id')['cluster']
+melt_group_means(profile_matrix.group_mean(labels)).to_csv('cluster_profiles_wide.csv')
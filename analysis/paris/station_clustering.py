@@ -0,0 +1,240 @@
+"""
+Clustering of stations by their hourly relative availability profile.
+
+Profiles for any set of day types are computed from a single pull of the
+`paris.bike_avail_hourly_stats` rollup, clustered and embedded in parallel, and
+written together with the station info to one directory per day type.
+
+Usage:
+    python station_clustering.py weekday weekend holiday weekday-10 --n_clusters 5
+"""
+import sys
+import argparse
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import holidays
+from sklearn.cluster import KMeans
+
+__here__ = Path(__file__).parent
+sys.path.append(str((__here__ / "../..").resolve()))
+from helpers.cloud.cache import QueryCache
+from helpers.paris.station_features import load_features
+from analysis.paris.k_selection import select_k
+from analysis.paris.profile_matrix import build_profile_matrix, melt_group_means
+from analysis.paris.embedding import embed_profiles
+
+# (para/o)lympic games
+EXCLUDED_DATES = [('2024-07-15', '2024-08-31')]
+
+# selection of the rollup rows making up each day type. '<day type>-<month>', e.g.
+# 'weekday-10', restricts a day type to one month, see `day_type_mask`
+DAY_TYPES = {
+    'weekday': lambda df: df.day_type.eq('weekday'),
+    'weekend': lambda df: df.day_type.eq('weekend'),
+    'holiday': lambda df: df.holiday.astype(bool),
+}
+
+# output directory per day type, defaults to rel_avail_<day type>
+OUTPUT_DIRS = {
+    'weekday': 'rel_avail_weekdays',
+    'weekend': 'rel_avail_weekend',
+}
+
+# relabel clusters to be coherent with the textual analysis (weekend: and with the weekday clusters)
+CLUSTER_MAPS = {
+    'weekday': {1: 5, 2: 4, 3: 2, 4: 3, 5: 1},
+    'weekend': {1: 3, 2: 1, 3: 2, 4: 4, 5: 5},
+}
+
+
+def public_holidays(start, end):
+    """
+    French public holidays between `start` and `end` (inclusive), as sorted dates.
+    """
+    start, end = pd.Timestamp(start).date(), pd.Timestamp(end).date()
+    calendar = holidays.France(years=range(start.year, end.year + 1))
+    return sorted(d for d in calendar if start <= d <= end)
+
+
+def load_rollup(cache):
+    """
+    Pulls the hourly sums per station, day type, month and holiday flag in one query.
+    """
+    exclusions = " AND ".join(
+        f"NOT snapshot_date BETWEEN DATE '{start}' AND DATE '{end}'" for start, end in EXCLUDED_DATES
+    )
+
+    # the holidays of every year covered by the rollup
+    first_date, last_date = cache.read_sql(
+        "SELECT MIN(snapshot_date) as first_date, MAX(snapshot_date) as last_date FROM paris.bike_avail_hourly_stats"
+    ).iloc[0]
+    dates = public_holidays(first_date, last_date) if pd.notna(first_date) else []
+    if dates:
+        holiday = "snapshot_date IN ({})".format(", ".join(f"DATE '{d}'" for d in dates))
+    else:
+        holiday = "false"
+
+    return cache.read_sql(
+        f"""SELECT
+        station_id, hour, day_type,
+        month(snapshot_date) as month,
+        {holiday} as holiday,
+        SUM(sum_rel_avail) as sum_rel_avail, SUM(n_rel_avail) as n_rel_avail
+        FROM paris.bike_avail_hourly_stats
+        WHERE {exclusions}
+        GROUP BY station_id, hour, day_type, month(snapshot_date), {holiday}""")
+
+
+def day_type_mask(rollup, day_type):
+    """
+    Boolean mask of the rollup rows belonging to `day_type`.
+    """
+    if day_type in DAY_TYPES:
+        return DAY_TYPES[day_type](rollup)
+
+    base, _, month = day_type.rpartition('-')
+    if base not in DAY_TYPES or not month.isdigit():
+        raise ValueError(f"Unknown day type '{day_type}', use one of {list(DAY_TYPES)} or '<day type>-<month>'")
+    return DAY_TYPES[base](rollup) & rollup.month.eq(int(month))
+
+
+def build_profile(rollup, mask):
+    """
+    Station x hour `ProfileMatrix` of the mean relative availability over the selected rows.
+    """
+    sums = rollup[mask].groupby(['station_id', 'hour'], as_index=False)[['sum_rel_avail', 'n_rel_avail']].sum()
+    sums = sums[sums.n_rel_avail > 0]
+
+    return build_profile_matrix(sums.station_id, sums.hour, sums.sum_rel_avail / sums.n_rel_avail)
+
+
+def cluster_profile(profile, n_clusters=5, max_k=10, cluster_map=None, random_state=0, k_workers=1,
+                    embedding_name=None):
+    """
+    Runs the elbow sweep, the final k-means and t-SNE on the stations of a `ProfileMatrix`
+    observed at every hour. The t-SNE embedding is updated incrementally under
+    `embedding_name`, see `embed_profiles`.
+
+    Returns:
+        dict: the `k_selection` sweep (see `select_k`), 1-based (optionally relabelled)
+        `labels` indexed by station id and the `tsne` coordinates.
+    """
+    complete = profile.complete()
+    X = np.asarray(complete.values)
+
+    k_selection = select_k(X, range(1, max_k + 1), workers=k_workers, random_state=random_state)
+
+    kmeans = KMeans(n_clusters=n_clusters, init='k-means++', max_iter=300, n_init=10, random_state=random_state)
+    labels = pd.Series(kmeans.fit_predict(X) + 1, index=pd.Index(complete.station_ids, name='station_id'))
+    if cluster_map:
+        labels = labels.map(cluster_map)
+
+    tsne_result = embed_profiles(X, complete.station_ids, name=embedding_name, random_state=random_state).to_numpy()
+
+    return {'k_selection': k_selection, 'labels': labels, 'tsne': tsne_result}
+
+
+def write_artifacts(profile, result, station_info, out_dir):
+    """
+    Writes the profile matrix and the csv files read by the dashboards for one day type.
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    profile.save(out_dir / 'profile_matrix')
+    labels = result['labels']
+
+    result['k_selection'].to_csv(out_dir / 'wcss_results.csv', index=False)
+
+    station_clusters = profile.select(labels.index).to_frame(prefix='hour_')
+    station_clusters['cluster'] = labels
+    station_clusters.to_csv(out_dir / 'station_clusters.csv', index=True)
+
+    cluster_means = profile.group_mean(labels)
+    cluster_profiles = cluster_means.set_axis([f"hour_{h}" for h in cluster_means.columns], axis=1)
+    cluster_profiles.to_csv(out_dir / 'cluster_profiles.csv', index=True)
+
+    melt_group_means(cluster_means).to_csv(out_dir / 'cluster_profiles_wide.csv')
+
+    cluster_sizes = station_clusters['cluster'].value_counts()
+    pd.DataFrame({'cluster': cluster_sizes.index, 'size': cluster_sizes.values})\
+        .to_csv(out_dir / 'cluster_sizes.csv', index=False)
+
+    tsne_df = pd.DataFrame(result['tsne'], columns=['tsne_1', 'tsne_2'], index=station_clusters.index)
+    station_clusters_with_info = pd.concat([station_clusters, tsne_df], axis=1).merge(
+        station_info, left_index=True, right_on='station_id', how='left'
+    ).dropna(subset=['lat', 'lon'])
+    station_clusters_with_info.to_csv(out_dir / 'station_clusters_with_info.csv', index=False)
+
+
+def with_station_features(station_info, version=None):
+    """
+    Adds the columns of a station feature store version (see `station_features.py`) that
+    `station_info` does not have yet.
+    """
+    features = load_features(version)
+    features = features[features.columns.difference(station_info.columns)]
+    return station_info.merge(features, left_on='station_id', right_index=True, how='left')
+
+
+def run(day_types, out_dir=__here__, n_clusters=5, max_k=10, workers=None, features_version=False):
+    """
+    Computes, clusters and writes the profiles of several day types from one data pull.
+
+    Args:
+        day_types: Names of the day types, see `DAY_TYPES`.
+        out_dir: Parent directory of the per day type output directories.
+        n_clusters: Number of clusters.
+        max_k: Largest k of the elbow sweep.
+        workers: Number of processes clustering day types in parallel (defaults to one per day type).
+        features_version: Station feature store version joined to the station info, None for
+                          the latest one, False to skip the features.
+    """
+    cache = QueryCache()
+    rollup = load_rollup(cache)
+    station_info = cache.read_sql("SELECT * FROM paris.historical_stations")
+    if features_version is not False:
+        station_info = with_station_features(station_info, features_version)
+
+    profiles = {day_type: build_profile(rollup, day_type_mask(rollup, day_type)) for day_type in day_types}
+
+    if len(day_types) == 1:
+        # a single day type is clustered here, with the k sweep spread over the cores instead
+        results = {
+            day_type: cluster_profile(profile, n_clusters, max_k, CLUSTER_MAPS.get(day_type), k_workers=None,
+                                      embedding_name=day_type)
+            for day_type, profile in profiles.items()
+        }
+    else:
+        with ProcessPoolExecutor(max_workers=workers or len(day_types)) as pool:
+            futures = {
+                day_type: pool.submit(cluster_profile, profile, n_clusters, max_k, CLUSTER_MAPS.get(day_type),
+                                      embedding_name=day_type)
+                for day_type, profile in profiles.items()
+            }
+            results = {day_type: f.result() for day_type, f in futures.items()}
+
+    for day_type in day_types:
+        write_artifacts(
+            profiles[day_type], results[day_type], station_info,
+            Path(out_dir) / OUTPUT_DIRS.get(day_type, f"rel_avail_{day_type}")
+        )
+        print(f"{day_type}: {len(results[day_type]['labels'])} stations")
+        print(results[day_type]['labels'].value_counts())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Cluster stations by hourly relative availability")
+    parser.add_argument("day_types", nargs="+", help=f"Day types to cluster ({', '.join(DAY_TYPES)} or '<day type>-<month>')")
+    parser.add_argument("--out_dir", default=__here__, help="Parent directory of the rel_avail_<day type> outputs")
+    parser.add_argument("--n_clusters", type=int, default=5, help="Number of clusters (default: 5)")
+    parser.add_argument("--max_k", type=int, default=10, help="Largest k of the elbow sweep (default: 10)")
+    parser.add_argument("--workers", type=int, default=None, help="Parallel processes (default: one per day type)")
+    parser.add_argument("--features", nargs="?", type=int, const=None, default=False, dest="features_version",
+                        help="Join the station features, optionally of a given store version (default: latest)")
+
+    args = parser.parse_args()
+
+    run(args.day_types, args.out_dir, args.n_clusters, args.max_k, args.workers, args.features_version)
@@ -0,0 +1,72 @@
+"""
+Station map of the clustering dashboards.
+
+All stations go into one GeoJSON feature collection styled by cluster, rendered as
+a single folium layer and written once to a static html file of the dashboard bundle
+(see dashboard_bundle.py). The dashboards only embed an iframe pointing to it, so the
+page size per session does not grow with the number of stations.
+"""
+from pathlib import Path
+import numpy as np
+import folium
+
+
+def stations_geojson(stations, palette, color_column='cluster', properties=('station_id', 'cluster')):
+    """
+    GeoJSON feature collection of point features, one per station.
+
+    Args:
+        stations: DataFrame with `lat`, `lon` and the `properties` columns.
+        palette: List of colors, indexed by the integer value of `color_column` (modulo its length).
+        color_column: Column deciding the color of a station.
+        properties: Columns copied into the feature properties.
+
+    Returns:
+        dict: The feature collection, with a `color` property per feature.
+    """
+    stations = stations.dropna(subset=['lat', 'lon'])
+    colors = np.asarray(palette, dtype=object)[stations[color_column].to_numpy().astype(int) % len(palette)]
+    coordinates = np.column_stack([stations.lon.to_numpy(), stations.lat.to_numpy()]).tolist()
+
+    props = stations[list(properties)].astype(object).where(stations[list(properties)].notna(), None)
+    props = props.assign(color=colors).to_dict('records')
+
+    return {
+        'type': 'FeatureCollection',
+        'features': [
+            {'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': c}, 'properties': p}
+            for c, p in zip(coordinates, props)
+        ],
+    }
+
+
+def build_station_map(stations, palette, out_path, zoom_start=12):
+    """
+    Renders the stations as one styled GeoJSON layer and saves the map as standalone html.
+
+    Args:
+        stations: DataFrame with `lat`, `lon`, `station_id` and `cluster`.
+        palette: List of cluster colors.
+        out_path: Path of the html file.
+        zoom_start: Initial zoom level.
+
+    Returns:
+        Path: `out_path`.
+    """
+    out_path = Path(out_path)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+
+    m = folium.Map(location=[stations['lat'].mean(), stations['lon'].mean()], zoom_start=zoom_start)
+    folium.GeoJson(
+        stations_geojson(stations, palette),
+        name='stations',
+        marker=folium.CircleMarker(radius=5, fill=True, fill_opacity=0.7),
+        style_function=lambda feature: {
+            'color': feature['properties']['color'],
+            'fillColor': feature['properties']['color'],
+        },
+        popup=folium.GeoJsonPopup(fields=['station_id', 'cluster'], aliases=['Station ID', 'Cluster']),
+    ).add_to(m)
+    m.save(str(out_path))
+
+    return out_path
@@ -0,0 +1,8 @@
+{% macro max_loaded_time(column='time') %}
+    {#- latest value of `column` already in the incremental model, as a literal so that
+        Athena can prune partitions of the source with it -#}
+    {%- if execute -%}
+        {%- set result = run_query("SELECT CAST(MAX(" ~ column ~ ") AS varchar) FROM " ~ this) -%}
+        {{ return(result.columns[0].values()[0]) }}
+    {%- endif -%}
+{% endmacro %}
@@ -0,0 +1,19 @@
+{#- snapshot_date and day_type of a station status row. historical_data only carries them
+    as partition columns once it has been reloaded with `--partition` (see README.md), until
+    then they are derived from `time` and the var `station_status_partitioned` stays false -#}
+
+{% macro snapshot_date_column() %}
+    {%- if var('station_status_partitioned', false) -%}
+        snapshot_date
+    {%- else -%}
+        CAST(time AS date)
+    {%- endif -%}
+{% endmacro %}
+
+{% macro day_type_column() %}
+    {%- if var('station_status_partitioned', false) -%}
+        day_type
+    {%- else -%}
+        CASE WHEN EXTRACT(day_of_week from time) IN (6, 7) THEN 'weekend' ELSE 'weekday' END
+    {%- endif -%}
+{% endmacro %}
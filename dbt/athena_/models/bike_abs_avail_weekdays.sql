@@ -2,4 +2,4 @@ SELECT station_id,
 num_bikes_available, 
 EXTRACT(hour from time) as hour
 FROM {{ source('paris', 'historical_data') }}
-WHERE EXTRACT(day_of_week from time) IN (1,2,3,4,5)
\ No newline at end of file
+WHERE {{ day_type_column() }} = 'weekday'
\ No newline at end of file
@@ -0,0 +1,46 @@
+{{
+    config(
+        materialized='incremental',
+        table_type='iceberg',
+        incremental_strategy='merge',
+        unique_key=['station_id', 'hour', 'day_type', 'snapshot_date'],
+        partitioned_by=['day_type'],
+        on_schema_change='append_new_columns'
+    )
+}}
+
+-- sufficient statistics per station, hour and day: means and variances over any
+-- date window are SUM(sum_x) / SUM(n) and SUM(sum_sq_x) / SUM(n) - mean^2
+WITH snapshots AS (
+    SELECT station_id,
+        EXTRACT(hour from time) as hour,
+        {{ day_type_column() }} as day_type,
+        {{ snapshot_date_column() }} as snapshot_date,
+        CAST(num_bikes_available AS DOUBLE) as num_bikes_available,
+        CAST(num_docks_available AS DOUBLE) as num_docks_available,
+        CASE WHEN num_bikes_available + num_docks_available != 0
+            THEN CAST(num_bikes_available AS DOUBLE) / (num_bikes_available + num_docks_available)
+        END as rel_avail
+    FROM {{ source('paris', 'historical_data') }}
+    {% if is_incremental() %}
+    {% set last_date = max_loaded_time('snapshot_date') %}
+    {% if last_date %}
+    -- the last loaded day may have been partial, it is recomputed and merged
+    WHERE {{ snapshot_date_column() }} >= DATE('{{ last_date }}')
+    {% endif %}
+    {% endif %}
+)
+SELECT station_id,
+    hour,
+    day_type,
+    snapshot_date,
+    COUNT(*) as n,
+    SUM(num_bikes_available) as sum_bikes,
+    SUM(num_bikes_available * num_bikes_available) as sum_sq_bikes,
+    SUM(num_docks_available) as sum_docks,
+    SUM(num_docks_available * num_docks_available) as sum_sq_docks,
+    COUNT(rel_avail) as n_rel_avail,
+    SUM(rel_avail) as sum_rel_avail,
+    SUM(rel_avail * rel_avail) as sum_sq_rel_avail
+FROM snapshots
+GROUP BY station_id, hour, day_type, snapshot_date
@@ -1,12 +1,32 @@
+{{
+    config(
+        materialized='incremental',
+        table_type='iceberg',
+        incremental_strategy='append',
+        partitioned_by=['snapshot_date'],
+        on_schema_change='append_new_columns'
+    )
+}}
+
 SELECT station_id, 
         CAST(num_bikes_available AS DECIMAL(10,3)) / (CAST(num_bikes_available AS DECIMAL(10,3)) + CAST(num_docks_available AS DECIMAL(10,3))) as rel_avail,  
-    EXTRACT(hour from time) as hour
+    EXTRACT(hour from time) as hour,
+    time,
+    {{ snapshot_date_column() }} as snapshot_date
 FROM {{ source('paris', 'historical_data') }}
-WHERE EXTRACT(day_of_week from time) IN (1,2,3,4,5) 
+WHERE {{ day_type_column() }} = 'weekday' 
 AND num_bikes_available+num_docks_available != 0
 --exclude (para/o)lympic games
 --exclude (para/o)lympic games
 AND (
-    CAST(time as date)  < DATE('2024-07-15') OR
-    CAST(time as date)  > DATE('2024-08-31')
-)
\ No newline at end of file
+    {{ snapshot_date_column() }} < DATE('2024-07-15') OR
+    {{ snapshot_date_column() }} > DATE('2024-08-31')
+)
+{% if is_incremental() %}
+{% set watermark = max_loaded_time() %}
+{% if watermark %}
+-- only snapshots newer than the last run, use --full-refresh after changing the exclusions
+AND {{ snapshot_date_column() }} >= DATE(TIMESTAMP '{{ watermark }}')
+AND time > TIMESTAMP '{{ watermark }}'
+{% endif %}
+{% endif %}
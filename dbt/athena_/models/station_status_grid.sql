@@ -0,0 +1,47 @@
+-- rebuilds the regular 5-minute snapshot grid from the change-only station_changes table:
+-- every station keeps its last emitted status until the next change
+WITH changes AS (
+    SELECT station_id,
+        num_bikes_available,
+        num_docks_available,
+        no_mechanical,
+        no_ebike,
+        last_reported,
+        time AS valid_from,
+        LEAD(time) OVER (PARTITION BY station_id ORDER BY time) AS valid_to
+    FROM {{ source('paris', 'station_changes') }}
+),
+-- polls without any change only show up in station_info, which is merged on every poll
+last_poll AS (
+    SELECT GREATEST(
+        (SELECT MAX(valid_from) FROM changes),
+        COALESCE((SELECT MAX(updated_at) FROM {{ source('paris', 'station_info') }}), TIMESTAMP '1970-01-01 00:00:00')
+    ) AS time
+),
+-- the 5-minute slots covered by every change: from valid_from rounded up to the next slot to
+-- the millisecond before the next change, or to the last poll for the current status
+spans AS (
+    SELECT c.*,
+        date_add('minute', 5 * CAST(ceiling(date_diff('millisecond', date_trunc('hour', c.valid_from), c.valid_from) / 300000.0) AS bigint),
+                 date_trunc('hour', c.valid_from)) AS first_slot,
+        COALESCE(date_add('millisecond', -1, c.valid_to), p.time) AS valid_until
+    FROM changes c
+    CROSS JOIN last_poll p
+),
+slotted AS (
+    SELECT *, date_diff('millisecond', first_slot, valid_until) / 300000 + 1 AS n_slots
+    FROM spans
+    WHERE first_slot <= valid_until
+)
+-- every change is expanded on its own, instead of range-joining it against a global grid.
+-- sequence() is capped at 10000 elements, so long-lived states are expanded in chunks
+SELECT s.station_id,
+    date_add('minute', 5 * slot, s.first_slot) AS time,
+    s.num_bikes_available,
+    s.num_docks_available,
+    s.no_mechanical,
+    s.no_ebike,
+    s.last_reported
+FROM slotted s
+CROSS JOIN UNNEST(sequence(0, (s.n_slots - 1) / 10000)) AS chunks(chunk)
+CROSS JOIN UNNEST(sequence(chunk * 10000, least(s.n_slots - 1, chunk * 10000 + 9999))) AS slots(slot)
@@ -1,9 +1,15 @@
 import os 
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from pyathena import connect 
 from pathlib import Path
 import boto3
 import awswrangler as wr
 import json 
+import pandas as pd
+import pyarrow as pa
+import pyarrow.fs as pafs
+import pyarrow.parquet as pq
 
 __here__ = Path(__file__).parent
 
@@ -60,6 +66,128 @@ def get_athena_conn():
     return db
 
 
+def get_s3_filesystem():
+    """
+    pyarrow filesystem for the bucket, using the same credentials as `get_athena_conn`.
+    """
+    creds = load_aws_credentials()
+    return pafs.S3FileSystem(
+        access_key=creds['aws_access_key_id'],
+        secret_key=creds['aws_secret_access_key'],
+        region='eu-central-1'
+    )
+
+
+UNLOAD_PREFIX = 's3://gbfsbikesbucket/athena_results/unload'
+
+# results estimated above this size are fetched through UNLOAD instead of the cursor
+UNLOAD_THRESHOLD_BYTES = 32 * 1024**2
+
+
+def estimate_result_bytes(sql, conn):
+    """
+    Estimated size of a query result from `EXPLAIN (TYPE IO)`.
+
+    Returns:
+        The estimated number of bytes, or None if the planner has no estimate
+        (e.g. tables without statistics).
+    """
+    cursor = conn.cursor()
+    cursor.execute(f"EXPLAIN (TYPE IO, FORMAT JSON) {sql}")
+    # the plan may be split over several rows
+    rows = cursor.fetchall()
+    try:
+        plan = json.loads("".join(row[0] for row in rows))
+        estimate = float(plan['estimate']['outputSizeInBytes'])
+    except (ValueError, KeyError, TypeError):
+        # unexpected plan format: let the caller fall back to UNLOAD
+        return None
+    return None if estimate != estimate else estimate  # NaN: no estimate
+
+
+def read_parquet_dir(location, filesystem=None, max_workers=8):
+    """
+    Reads all parquet files below `location` into one arrow table, downloading them in parallel.
+
+    Args:
+        location: Directory URI, e.g. `s3://bucket/prefix/` or a local path.
+        filesystem: pyarrow filesystem to read from. If None, it is derived from `location`,
+                    so a local directory can stand in for S3.
+        max_workers: Number of concurrent downloads.
+    """
+    if filesystem is None:
+        filesystem, location = pafs.FileSystem.from_uri(str(location))
+    elif '://' in str(location):
+        location = str(location).split('://', 1)[1]
+    location = str(location).rstrip('/')
+
+    files = sorted(
+        info.path for info in filesystem.get_file_info(pafs.FileSelector(location, recursive=True, allow_not_found=True))
+        if info.type == pafs.FileType.File
+    )
+    if not files:
+        return pa.table({})
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        tables = list(pool.map(lambda f: pq.read_table(f, filesystem=filesystem), files))
+
+    return pa.concat_tables(tables, promote_options="default")
+
+
+def unload_statement(sql, location, dialect='athena'):
+    """
+    Statement writing the result of `sql` as parquet files to `location`.
+
+    'duckdb' produces the equivalent `COPY` statement, to run the unload path locally.
+    """
+    if dialect == 'duckdb':
+        return f"COPY ({sql}) TO '{location}' (FORMAT PARQUET, PER_THREAD_OUTPUT TRUE)"
+    return f"UNLOAD ({sql}) TO '{location}' WITH (format = 'PARQUET', compression = 'SNAPPY')"
+
+
+def read_sql_arrow(sql, conn=None, method=None, unload_prefix=UNLOAD_PREFIX, filesystem=None,
+                   threshold_bytes=UNLOAD_THRESHOLD_BYTES, dialect='athena'):
+    """
+    Runs a query and returns the result as an arrow table.
+
+    Small results are fetched through the DB-API cursor. Large ones are written to parquet
+    with UNLOAD and read back in parallel, which avoids paging through the JSON result API.
+
+    Args:
+        sql: The query.
+        conn: DB-API connection. Defaults to `get_athena_conn()`.
+        method: 'cursor', 'unload' or None to choose by `estimate_result_bytes`.
+                Queries without an estimate are unloaded.
+        unload_prefix: Location below which every UNLOAD writes to a fresh directory.
+        filesystem: pyarrow filesystem of `unload_prefix`. Defaults to `get_s3_filesystem()`
+                    for s3 URIs, any local directory works as a stand-in.
+        threshold_bytes: Estimated result size above which UNLOAD is used.
+        dialect: 'athena' or 'duckdb', see `unload_statement`.
+    """
+    conn = conn or get_athena_conn()
+
+    if method is None:
+        estimate = estimate_result_bytes(sql, conn) if dialect == 'athena' else None
+        method = 'cursor' if estimate is not None and estimate < threshold_bytes else 'unload'
+
+    if method == 'cursor':
+        return pa.Table.from_pandas(pd.read_sql(sql, conn), preserve_index=False)
+
+    location = f"{str(unload_prefix).rstrip('/')}/{uuid.uuid4().hex}/"
+    if filesystem is None and str(unload_prefix).startswith('s3://'):
+        filesystem = get_s3_filesystem()
+
+    cursor = conn.cursor()
+    cursor.execute(unload_statement(sql, location, dialect))
+    table = read_parquet_dir(location, filesystem)
+
+    # unloaded files are only needed once
+    fs, path = (filesystem, location.split('://', 1)[-1]) if filesystem else pafs.FileSystem.from_uri(location)
+    fs.delete_dir(path.rstrip('/'))
+
+    return table
+
+
 def get_boto3_session():
     
     creds = load_aws_credentials()
@@ -0,0 +1,256 @@
+import os
+import re
+import sys
+import json
+import time
+import hashlib
+import argparse
+from pathlib import Path
+import pandas as pd
+
+__here__ = Path(__file__).parent
+
+CACHE_DIR = Path(os.getenv("VELIB_CACHE_DIR", __here__ / "../../data/query_cache"))
+
+
+def normalize_sql(sql):
+    """
+    Strips comments and collapses whitespace so that formatting does not change the cache key.
+    String literals are left untouched.
+    """
+    sql = re.sub(r"--[^\n]*", " ", sql)
+    sql = re.sub(r"/\*.*?\*/", " ", sql, flags=re.S)
+    return " ".join(sql.split()).rstrip(";")
+
+
+def referenced_tables(sql):
+    """
+    Returns the sorted `schema.table` names following FROM or JOIN in table position.
+
+    FROM inside function call parentheses, e.g. `EXTRACT(hour FROM t.time)`, is not a table
+    reference. Parentheses only keep table position if they open a subquery or follow
+    FROM/JOIN. String literals are ignored.
+    """
+    sql = re.sub(r"'(?:[^']|'')*'", "''", sql)
+    tokens = re.finditer(r"(\()|(\))|\b(from|join)\s+(\w+\.\w+)|\b(\w+)\b", sql, flags=re.I)
+
+    tables = set()
+    # one entry per open parenthesis: True if its content is in table position
+    stack = []
+    previous, pending = None, False
+    for match in tokens:
+        opening, closing, keyword, table, word = match.groups()
+        if pending:
+            # the first word after a parenthesis decides whether it opens a subquery
+            stack[-1] = stack[-1] or (word or keyword or "").lower() in ("select", "with")
+            pending = False
+        if opening:
+            stack.append(previous in ("from", "join"))
+            pending = True
+            previous = None
+        elif closing:
+            if stack:
+                stack.pop()
+            previous = None
+        elif keyword:
+            if not stack or stack[-1]:
+                tables.add(table.lower())
+            previous = None
+        else:
+            previous = word.lower()
+    return sorted(tables)
+
+
+def s3_prefix_version(s3, location):
+    """
+    Version marker of the objects under an S3 location: count, total size and latest
+    modification.
+    """
+    bucket, _, prefix = location.removeprefix("s3://").partition("/")
+    count, size, latest = 0, 0, ""
+    for page in s3.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            count += 1
+            size += obj["Size"]
+            latest = max(latest, obj["LastModified"].isoformat())
+    return f"{count}|{size}|{latest}"
+
+
+def glue_table_versions(tables):
+    """
+    Version markers of Athena tables from the Glue catalog, without running a query.
+
+    The update time changes with every schema change and, for iceberg tables, with every
+    commit (through `metadata_location`). Appends to other tables only add objects to their
+    S3 location and leave the catalog untouched, so their objects are listed instead.
+    Views only change when redefined.
+    """
+    from helpers.cloud.aws import get_boto3_session
+
+    session = get_boto3_session()
+    glue, s3 = session.client("glue"), session.client("s3")
+    versions = {}
+    for table in tables:
+        schema, name = table.split(".")
+        info = glue.get_table(DatabaseName=schema, Name=name)["Table"]
+        version = f"{info.get('UpdateTime')}|{info.get('Parameters', {}).get('metadata_location', '')}"
+
+        location = info.get("StorageDescriptor", {}).get("Location", "")
+        if "metadata_location" not in info.get("Parameters", {}) and location.startswith("s3://"):
+            version += "|" + s3_prefix_version(s3, location)
+        versions[table] = version
+    return versions
+
+
+def mirror_table_versions(tables):
+    """
+    Version markers of tables in the local parquet mirror: file count and latest modification.
+    """
+    from helpers.cloud.local import MIRROR_DIR
+
+    versions = {}
+    for table in tables:
+        files = list((MIRROR_DIR / Path(*table.split("."))).rglob("*.parquet"))
+        versions[table] = f"{len(files)}|{max((f.stat().st_mtime for f in files), default=0)}"
+    return versions
+
+
+class QueryCache:
+    """
+    Parquet-backed cache of query results, keyed on the normalized SQL and the versions of
+    the tables it reads.
+
+    The connection is only opened on a cache miss, so repeated runs against unchanged tables
+    do not query Athena at all. Entries expire after `ttl` seconds and the least recently used
+    ones are evicted once the cache grows beyond `max_bytes`.
+
+    Args:
+        backend: 'athena' or 'duckdb', see `helpers.cloud.local.get_conn`.
+        cache_dir: Directory holding the parquet files and the index.
+        ttl: Maximum age of an entry in seconds. None disables expiry.
+        max_bytes: Size limit of the cache directory.
+        versioned: If False, tables are not checked for changes and entries only expire by `ttl`.
+    """
+
+    def __init__(self, backend=None, cache_dir=CACHE_DIR, ttl=7 * 24 * 3600, max_bytes=2 * 1024**3, versioned=True):
+        self.backend = backend or os.getenv("VELIB_BACKEND", "athena")
+        self.cache_dir = Path(cache_dir)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.versioned = versioned
+        self._conn = None
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            from helpers.cloud.local import get_conn
+            self._conn = get_conn(self.backend)
+        return self._conn
+
+    @property
+    def _index_path(self):
+        return self.cache_dir / "index.json"
+
+    def _load_index(self):
+        if not self._index_path.exists():
+            return {}
+        return json.loads(self._index_path.read_text())
+
+    def _save_index(self, index):
+        tmp_path = self._index_path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(index, indent=1))
+        os.replace(tmp_path, self._index_path)
+
+    def _remove(self, index, key):
+        index.pop(key, None)
+        (self.cache_dir / f"{key}.parquet").unlink(missing_ok=True)
+
+    def key(self, sql):
+        """
+        Cache key of a query: hash of the normalized SQL and the versions of its tables.
+        """
+        sql = normalize_sql(sql)
+        versions = {}
+        if self.versioned:
+            tables = referenced_tables(sql)
+            versions = (mirror_table_versions if self.backend == "duckdb" else glue_table_versions)(tables)
+        payload = json.dumps({"backend": self.backend, "sql": sql, "versions": versions}, sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def read_sql(self, sql, refresh=False):
+        """
+        Returns the result of `sql` as a DataFrame, from the cache if possible.
+
+        Args:
+            sql: The query.
+            refresh: Run the query even if a cached result exists.
+        """
+        key = self.key(sql)
+        path = self.cache_dir / f"{key}.parquet"
+        index = self._load_index()
+        entry = index.get(key)
+        now = time.time()
+
+        if entry is not None and self.ttl is not None and now - entry["created"] > self.ttl:
+            self._remove(index, key)
+            entry = None
+
+        if entry is not None and path.exists() and not refresh:
+            entry["last_used"] = now
+            self._save_index(index)
+            return pd.read_parquet(path)
+
+        if self.backend == "athena":
+            # large results are unloaded to parquet instead of paged through the cursor
+            from helpers.cloud.aws import read_sql_arrow
+            df = read_sql_arrow(sql, self.conn).to_pandas()
+        else:
+            df = pd.read_sql(sql, self.conn)
+        df.to_parquet(path, index=False)
+        index[key] = {
+            "sql": normalize_sql(sql),
+            "tables": referenced_tables(sql),
+            "created": now,
+            "last_used": now,
+            "bytes": path.stat().st_size,
+        }
+        self._evict(index)
+        self._save_index(index)
+        return df
+
+    def _evict(self, index):
+        total = sum(e["bytes"] for e in index.values())
+        for key in sorted(index, key=lambda k: index[k]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            total -= index[key]["bytes"]
+            self._remove(index, key)
+
+    def invalidate(self, table=None):
+        """
+        Drops the cached results reading `table` (`schema.table`), or all results if None.
+
+        Returns:
+            The number of entries removed.
+        """
+        index = self._load_index()
+        keys = [k for k, e in index.items() if table is None or table.lower() in e["tables"]]
+        for key in keys:
+            self._remove(index, key)
+        self._save_index(index)
+        return len(keys)
+
+
+if __name__ == '__main__':
+    # make `helpers` importable when run as a script
+    sys.path.append(str((__here__ / "../..").resolve()))
+
+    parser = argparse.ArgumentParser(description="Local cache of Athena query results")
+    parser.add_argument("table", nargs="?", default=None, help="Invalidate results reading this schema.table (default: all)")
+    parser.add_argument("--cache_dir", default=CACHE_DIR, help="Directory of the cache")
+
+    args = parser.parse_args()
+
+    n = QueryCache(cache_dir=args.cache_dir).invalidate(args.table)
+    print(f"{n} cached result(s) removed")
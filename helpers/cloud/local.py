@@ -0,0 +1,173 @@
+import os
+import sys
+import argparse
+from pathlib import Path
+
+__here__ = Path(__file__).parent
+
+MIRROR_DIR = Path(os.getenv("VELIB_MIRROR_DIR", __here__ / "../../data/mirror"))
+
+# tables kept in the local mirror and their date partition column (None: copied as a whole)
+MIRROR_TABLES = {
+    'historical_data': 'snapshot_date',
+    'bike_avail_hourly_stats': 'snapshot_date',
+    'bike_rel_avail_weekdays': 'snapshot_date',
+    'bike_rel_avail_weekend': 'snapshot_date',
+    'historical_stations': None,
+    'station_info': None,
+}
+
+# partition columns derived from `time` for tables loaded before they were added, as the dbt
+# models do while the `station_status_partitioned` var is false
+DERIVED_PARTITION_COLUMNS = {
+    'snapshot_date': 'CAST(time AS date)',
+}
+
+
+def get_duckdb_conn(mirror_dir=MIRROR_DIR):
+    """
+    Opens an in-memory DuckDB connection serving the mirrored tables.
+
+    Every `<mirror_dir>/<schema>/<table>` directory is exposed as the view `<schema>.<table>`
+    over its parquet files, with hive partition directories (`snapshot_date=...`) read back
+    as columns, so queries written for Athena such as `SELECT ... FROM paris.historical_data`
+    run unchanged.
+    """
+    import duckdb
+
+    conn = duckdb.connect()
+
+    for schema_dir in sorted(Path(mirror_dir).glob("*")):
+        if not schema_dir.is_dir():
+            continue
+        conn.execute(f"CREATE SCHEMA IF NOT EXISTS {schema_dir.name}")
+        for table_dir in sorted(schema_dir.glob("*")):
+            if not any(table_dir.rglob("*.parquet")):
+                continue
+            conn.execute(
+                f"""CREATE VIEW {schema_dir.name}.{table_dir.name} AS
+                SELECT * FROM read_parquet('{table_dir.as_posix()}/**/*.parquet',
+                    hive_partitioning = true, union_by_name = true)"""
+            )
+
+    return conn
+
+
+def get_conn(backend=None):
+    """
+    Returns a DB-API connection for `pd.read_sql`, either to Athena or to the local mirror.
+
+    Args:
+        backend: 'athena' or 'duckdb'. Defaults to the `VELIB_BACKEND` environment variable,
+                 or 'athena' if it is not set.
+    """
+    backend = backend or os.getenv("VELIB_BACKEND", "athena")
+
+    if backend == "duckdb":
+        return get_duckdb_conn()
+
+    if backend == "athena":
+        # imported lazily, the aws helpers need credentials at import time
+        from helpers.cloud.aws import get_athena_conn
+        return get_athena_conn()
+
+    raise ValueError(f"Unknown query backend '{backend}', use 'athena' or 'duckdb'")
+
+
+def _write_parquet(df, path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".parquet.tmp")
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+
+def sync_table(table, partition_column=None, schema="paris", mirror_dir=MIRROR_DIR, conn=None):
+    """
+    Copies an Athena table into the local mirror.
+
+    Tables without a partition column are copied as a whole. For partitioned tables only
+    partitions missing locally are pulled, plus the most recent local one, which may have
+    been synced while that day was still being loaded. If the table lacks the partition
+    column, it is derived through `DERIVED_PARTITION_COLUMNS`.
+
+    Args:
+        table: Name of the table in `schema`.
+        partition_column: Date column to sync by, see `MIRROR_TABLES`.
+        schema: Athena database of the table.
+        mirror_dir: Root directory of the mirror.
+        conn: DB-API connection to query instead of Athena through awswrangler.
+
+    Returns:
+        The number of partitions (or whole-table copies) written.
+    """
+    table_dir = Path(mirror_dir) / schema / table
+
+    if conn is not None:
+        import pandas as pd
+
+        def query(sql):
+            return pd.read_sql(sql, conn)
+    else:
+        import awswrangler as wr
+        from helpers.cloud.aws import get_boto3_session
+
+        session = get_boto3_session()
+
+        def query(sql):
+            return wr.athena.read_sql_query(sql, database=schema, boto3_session=session)
+
+    if partition_column is None:
+        _write_parquet(query(f"SELECT * FROM {schema}.{table}"), table_dir / "data.parquet")
+        return 1
+
+    columns = query(f"SELECT * FROM {schema}.{table} LIMIT 0").columns
+    partition = partition_column if partition_column in columns else DERIVED_PARTITION_COLUMNS[partition_column]
+
+    local = sorted(p.name.split("=", 1)[1] for p in table_dir.glob(f"{partition_column}=*"))
+    remote = query(
+        f"SELECT DISTINCT CAST({partition} AS varchar) AS p FROM {schema}.{table}"
+    ).p.dropna()
+
+    todo = sorted(set(remote) - set(local)) + local[-1:]
+    for value in todo:
+        df = query(f"SELECT * FROM {schema}.{table} WHERE {partition} = DATE '{value}'")
+        # the partition value is restored from the directory name by get_duckdb_conn
+        _write_parquet(
+            df.drop(columns=partition_column, errors='ignore'),
+            table_dir / f"{partition_column}={value}" / "data.parquet"
+        )
+        print(f"{schema}.{table}: {partition_column}={value} ({len(df)} rows)")
+
+    return len(todo)
+
+
+def sync(tables=None, mirror_dir=MIRROR_DIR):
+    """
+    Brings the mirror up to date for `tables` (defaults to all of `MIRROR_TABLES`).
+    """
+    for table in tables or MIRROR_TABLES:
+        n = sync_table(table, MIRROR_TABLES.get(table), mirror_dir=mirror_dir)
+        print(f"paris.{table}: {n} file(s) synced")
+
+
+if __name__ == '__main__':
+    # make `helpers` importable when run as a script
+    sys.path.append(str((__here__ / "../..").resolve()))
+
+    parser = argparse.ArgumentParser(description="Local parquet mirror of the Athena tables")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    sync_parser = subparsers.add_parser("sync", help="Pull new partitions into the mirror")
+    sync_parser.add_argument("tables", nargs="*", help=f"Tables to sync (default: {', '.join(MIRROR_TABLES)})")
+    sync_parser.add_argument("--mirror_dir", default=MIRROR_DIR, help="Root directory of the mirror")
+
+    query_parser = subparsers.add_parser("query", help="Run a query against the mirror")
+    query_parser.add_argument("sql", help="SQL query")
+    query_parser.add_argument("--mirror_dir", default=MIRROR_DIR, help="Root directory of the mirror")
+
+    args = parser.parse_args()
+
+    if args.command == "sync":
+        sync(args.tables, args.mirror_dir)
+    else:
+        print(get_duckdb_conn(args.mirror_dir).execute(args.sql).df())
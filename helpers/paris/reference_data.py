@@ -0,0 +1,173 @@
+"""
+Local cache of the remote reference datasets used by the geo enrichment.
+
+Every dataset is downloaded once, parsed and stored as (Geo)Parquet under a name
+made of a hash of its source url and a hash of the downloaded content. An index
+maps every url to its current file. Datasets are only downloaded again when
+explicitly refreshed, and offline mode never touches the network.
+
+Usage:
+    python reference_data.py refresh [towns_population communes train_stations]
+    python reference_data.py list
+"""
+import os
+import io
+import json
+import time
+import hashlib
+import argparse
+import urllib.request
+from pathlib import Path
+import pandas as pd
+
+__here__ = Path(__file__).parent
+
+REFERENCE_DIR = Path(os.getenv("VELIB_REFERENCE_DIR", __here__ / "../../data/reference"))
+
+# set VELIB_OFFLINE=1 to only use cached datasets
+OFFLINE = os.getenv("VELIB_OFFLINE", "0") == "1"
+
+SOURCES = {
+    # legal population of the communes and arrondissements of Ile-de-France
+    'towns_population': {
+        'url': 'https://data.iledefrance.fr/api/explore/v2.1/catalog/datasets/populations-legales-communes-et-arrondissements-municipaux-millesime-ile-de-fran/exports/csv?lang=fr&timezone=Europe%2FBerlin&use_labels=true&delimiter=%3B',
+        'format': 'csv',
+        'read_kwargs': {'sep': ';'},
+    },
+    # communes and arrondissements of Ile-de-France
+    'communes': {
+        'url': 'https://www.data.gouv.fr/fr/datasets/r/5cd27d86-4859-40dc-b029-a215219eedf9',
+        'format': 'geo',
+        'read_kwargs': {},
+    },
+    # train and metro stations
+    'train_stations': {
+        'url': 'https://www.data.gouv.fr/fr/datasets/r/e2679f65-0321-403a-8fe6-e51dbcbce309',
+        'format': 'geo',
+        'read_kwargs': {},
+    },
+}
+
+
+def _sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def _index_path(reference_dir):
+    return Path(reference_dir) / "index.json"
+
+
+def load_index(reference_dir=REFERENCE_DIR):
+    """
+    The url -> cached file index, empty if nothing is cached yet.
+    """
+    path = _index_path(reference_dir)
+    return json.loads(path.read_text()) if path.exists() else {}
+
+
+def _save_index(index, reference_dir):
+    path = _index_path(reference_dir)
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(index, indent=2))
+    os.replace(tmp, path)
+
+
+def _parse(content, fmt, read_kwargs):
+    if fmt == 'csv':
+        return pd.read_csv(io.BytesIO(content), **read_kwargs)
+
+    import geopandas as gpd
+    return gpd.read_file(io.BytesIO(content), **read_kwargs)
+
+
+def _read(path, fmt):
+    if fmt == 'csv':
+        return pd.read_parquet(path)
+
+    import geopandas as gpd
+    return gpd.read_parquet(path)
+
+
+def download(name, reference_dir=REFERENCE_DIR):
+    """
+    Downloads a dataset and stores it in the cache, keeping the previous version if the
+    content did not change.
+
+    Returns:
+        Path: The cached file.
+    """
+    source = SOURCES[name]
+    reference_dir = Path(reference_dir)
+    reference_dir.mkdir(parents=True, exist_ok=True)
+
+    with urllib.request.urlopen(source['url']) as response:
+        content = response.read()
+
+    path = reference_dir / f"{name}-{_sha256(source['url'].encode())[:12]}-{_sha256(content)[:16]}.parquet"
+    if not path.exists():
+        data = _parse(content, source['format'], source['read_kwargs'])
+        tmp = path.with_suffix(".tmp")
+        data.to_parquet(tmp)
+        os.replace(tmp, path)
+
+    index = load_index(reference_dir)
+    index[source['url']] = {'name': name, 'file': path.name, 'sha256': _sha256(content), 'fetched_at': time.time()}
+    _save_index(index, reference_dir)
+
+    return path
+
+
+def fetch(name, refresh=False, offline=None, reference_dir=REFERENCE_DIR):
+    """
+    A reference dataset, from the cache if possible.
+
+    Args:
+        name: Name of the dataset, see `SOURCES`.
+        refresh: Download the dataset again even if it is cached.
+        offline: Never download, fail if the dataset is not cached. Defaults to `OFFLINE`.
+        reference_dir: Directory of the cache.
+
+    Returns:
+        pd.DataFrame or gpd.GeoDataFrame: The dataset.
+
+    Raises:
+        FileNotFoundError: In offline mode, if the dataset is not cached.
+    """
+    source = SOURCES[name]
+    offline = OFFLINE if offline is None else offline
+
+    entry = load_index(reference_dir).get(source['url'])
+    path = Path(reference_dir) / entry['file'] if entry else None
+    cached = path is not None and path.exists()
+
+    if offline:
+        if not cached:
+            raise FileNotFoundError(
+                f"Reference dataset '{name}' is not cached in {reference_dir}, "
+                f"run `python reference_data.py refresh {name}` with network access first"
+            )
+    elif refresh or not cached:
+        path = download(name, reference_dir)
+
+    return _read(path, source['format'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Local cache of the geo enrichment reference datasets")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    refresh_parser = subparsers.add_parser("refresh", help="Download datasets again")
+    refresh_parser.add_argument("names", nargs="*", help=f"Datasets to refresh (default: {', '.join(SOURCES)})")
+    refresh_parser.add_argument("--reference_dir", default=REFERENCE_DIR, help="Directory of the cache")
+
+    list_parser = subparsers.add_parser("list", help="Show the cached datasets")
+    list_parser.add_argument("--reference_dir", default=REFERENCE_DIR, help="Directory of the cache")
+
+    args = parser.parse_args()
+
+    if args.command == "refresh":
+        for name in args.names or SOURCES:
+            print(f"{name}: {download(name, args.reference_dir)}")
+    else:
+        for url, entry in load_index(args.reference_dir).items():
+            print(f"{entry['name']}: {entry['file']} ({time.ctime(entry['fetched_at'])})")
@@ -0,0 +1,191 @@
+"""
+Versioned station feature store.
+
+The geo features of `velib_geo_data` (commune, elevation, transit proximity) are
+kept in one parquet file per version. A refresh compares the current
+`station_info` table of the GBFS pipeline with the latest version and only
+recomputes the features of new stations and of stations whose coordinates or
+capacity changed. Stations missing from `station_info` are dropped from the new
+version. Earlier versions stay untouched, so an analysis can pin the version it
+joins against.
+
+Usage:
+    python station_features.py refresh [--offline]
+    python station_features.py list
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+import pandas as pd
+
+__here__ = Path(__file__).parent
+
+FEATURE_DIR = Path(os.getenv("VELIB_FEATURE_DIR", __here__ / "../../data/station_features"))
+
+# station_info columns whose change invalidates the features of a station
+CHANGE_COLUMNS = ['lat', 'lon', 'capacity']
+
+
+def _manifest_path(feature_dir):
+    return Path(feature_dir) / "manifest.json"
+
+
+def load_manifest(feature_dir=FEATURE_DIR):
+    """
+    The list of versions, oldest first, empty if the store does not exist yet.
+    """
+    path = _manifest_path(feature_dir)
+    return json.loads(path.read_text()) if path.exists() else {'versions': []}
+
+
+def load_features(version=None, feature_dir=FEATURE_DIR):
+    """
+    The station features of `version`, indexed by station id.
+
+    Args:
+        version: Version number, defaults to the latest one.
+        feature_dir: Directory of the store.
+
+    Raises:
+        FileNotFoundError: If the store or the version does not exist.
+    """
+    versions = load_manifest(feature_dir)['versions']
+    if not versions:
+        raise FileNotFoundError(f"No station features in {feature_dir}, run `python station_features.py refresh`")
+
+    if version is None:
+        entry = versions[-1]
+    else:
+        entry = next((v for v in versions if v['version'] == version), None)
+        if entry is None:
+            raise FileNotFoundError(f"Station features version {version} not found in {feature_dir}")
+
+    return pd.read_parquet(Path(feature_dir) / entry['file'])
+
+
+def changed_stations(station_info, features):
+    """
+    Ids of the stations whose features have to be (re)computed.
+
+    Args:
+        station_info: Current `station_info` table indexed by station id.
+        features: Features of the latest version, or None.
+
+    Returns:
+        pd.Index: New stations and stations with a changed value in `CHANGE_COLUMNS`.
+    """
+    if features is None:
+        return station_info.index
+
+    current = station_info[CHANGE_COLUMNS]
+    previous = features[CHANGE_COLUMNS].reindex(current.index)
+    differs = (current != previous) & ~(current.isna() & previous.isna())
+    return current.index[differs.any(axis=1).to_numpy()]
+
+
+def compute_features(station_info, refresh_reference=False, offline=None):
+    """
+    Geo features of the given stations, see `velib_geo_data`.
+
+    Returns:
+        pd.DataFrame: `station_info` with the feature columns, indexed by station id.
+    """
+    from helpers.paris.velib_geo_data import (
+        load_towns, load_bike_stations, load_train_stations, compute_nearest_train_station
+    )
+
+    towns = load_towns(refresh_reference, offline)
+    velo_stations = load_bike_stations(towns, station_info=station_info)
+    velo_stations, _ = compute_nearest_train_station(velo_stations, load_train_stations(refresh_reference, offline))
+
+    return pd.DataFrame(velo_stations.drop(columns='geometry'))
+
+
+def refresh(station_info=None, conn=None, offline=None, full=False, feature_dir=FEATURE_DIR):
+    """
+    Writes a new version with the features of new and changed stations recomputed.
+
+    Args:
+        station_info: `station_info` table indexed by station id, loaded through `conn` if None.
+        conn: Connection for `velib_geo_data.load_station_info`.
+        offline: Only use cached reference datasets.
+        full: Recompute every station, e.g. after refreshing the reference datasets.
+        feature_dir: Directory of the store.
+
+    Returns:
+        int: The new version, or the latest one if nothing changed.
+    """
+    if station_info is None:
+        from helpers.paris.velib_geo_data import load_station_info
+        station_info = load_station_info(conn)
+
+    manifest = load_manifest(feature_dir)
+    previous = load_features(feature_dir=feature_dir) if manifest['versions'] else None
+
+    changed = changed_stations(station_info, None if full else previous)
+    removed = previous.index.difference(station_info.index) if previous is not None else pd.Index([])
+
+    if previous is not None and len(changed) == 0 and len(removed) == 0:
+        print("station features up to date")
+        return manifest['versions'][-1]['version']
+
+    updated = compute_features(station_info.loc[changed], offline=offline) if len(changed) else None
+
+    if previous is None:
+        features = updated
+    else:
+        kept = previous.loc[previous.index.intersection(station_info.index).difference(changed)]
+        features = pd.concat([kept, updated]) if updated is not None else kept
+        # attributes other than the CHANGE_COLUMNS (e.g. the name) follow station_info
+        columns = station_info.columns.intersection(features.columns)
+        features.loc[:, columns] = station_info.loc[features.index, columns]
+    features = features.sort_index()
+
+    version = manifest['versions'][-1]['version'] + 1 if manifest['versions'] else 1
+    feature_dir = Path(feature_dir)
+    feature_dir.mkdir(parents=True, exist_ok=True)
+    file = f"v{version:04d}.parquet"
+    features.to_parquet(feature_dir / file)
+
+    manifest['versions'].append({
+        'version': version,
+        'file': file,
+        'created_at': time.time(),
+        'n_stations': len(features),
+        'n_computed': len(changed),
+        'n_removed': len(removed),
+    })
+    tmp = _manifest_path(feature_dir).with_suffix(".tmp")
+    tmp.write_text(json.dumps(manifest, indent=2))
+    os.replace(tmp, _manifest_path(feature_dir))
+
+    print(f"station features v{version}: {len(changed)} computed, {len(removed)} removed, {len(features)} stations")
+    return version
+
+
+if __name__ == '__main__':
+    # make `helpers` importable when run as a script
+    sys.path.append(str((__here__ / "../..").resolve()))
+
+    parser = argparse.ArgumentParser(description="Versioned station feature store")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    refresh_parser = subparsers.add_parser("refresh", help="Recompute the features of new and changed stations")
+    refresh_parser.add_argument("--offline", action="store_true", help="Only use cached reference datasets")
+    refresh_parser.add_argument("--full", action="store_true", help="Recompute every station")
+    refresh_parser.add_argument("--feature_dir", default=FEATURE_DIR, help="Directory of the store")
+
+    list_parser = subparsers.add_parser("list", help="Show the versions")
+    list_parser.add_argument("--feature_dir", default=FEATURE_DIR, help="Directory of the store")
+
+    args = parser.parse_args()
+
+    if args.command == "refresh":
+        refresh(offline=args.offline or None, full=args.full, feature_dir=args.feature_dir)
+    else:
+        for v in load_manifest(args.feature_dir)['versions']:
+            print(f"v{v['version']}: {v['n_stations']} stations, {v['n_computed']} computed, "
+                  f"{v['n_removed']} removed ({time.ctime(v['created_at'])})")
@@ -1,9 +1,316 @@
 import dlt
 import sqlite3
 import argparse
+import os
+import time
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from dlt.destinations.adapters import athena_adapter
 
+# partition columns of the station status tables, also used by the dbt models to prune
+PARTITION_COLUMNS = ['snapshot_date', 'day_type']
 
-def load_sqlite_to_destination(sqlite_file_path, table_name, destination, destination_table_name="default_table", destination_dataset="default", chunk_size=1000):
+# rows per `fetchmany` call: the row-by-row load yields dicts, the arrow paths build one
+# record batch per chunk and are only efficient with large chunks
+ROW_CHUNK_SIZE = 1000
+BULK_CHUNK_SIZE = 100_000
+
+
+def sqlite_arrow_schema(conn, table_name):
+    """
+    Derives a pyarrow schema from the declared column types of a SQLite table.
+
+    SQLite is dynamically typed, so inferring types chunk by chunk could yield
+    different arrow types for the same column (e.g. an all-NULL chunk). The declared
+    type affinity is used instead so every batch shares one schema.
+
+    Args:
+        conn (sqlite3.Connection): Open connection to the SQLite database.
+        table_name (str): Name of the table to describe.
+
+    Returns:
+        pa.Schema: Schema with one field per table column.
+    """
+    fields = []
+    for _, name, decl_type, *_ in conn.execute(f"PRAGMA table_info({table_name})"):
+        decl_type = (decl_type or "").upper()
+        if "INT" in decl_type:
+            arrow_type = pa.int64()
+        elif any(t in decl_type for t in ("REAL", "FLOA", "DOUB")):
+            arrow_type = pa.float64()
+        elif any(t in decl_type for t in ("TIMESTAMP", "DATETIME")):
+            arrow_type = pa.timestamp("us")
+        else:
+            arrow_type = pa.string()
+        fields.append(pa.field(name, arrow_type))
+    return pa.schema(fields)
+
+
+def rows_to_arrow(rows, schema):
+    """
+    Converts a list of row tuples into a pyarrow table column by column.
+
+    Args:
+        rows (list[tuple]): Rows as returned by `cursor.fetchmany`.
+        schema (pa.Schema): Target schema, see `sqlite_arrow_schema`.
+
+    Returns:
+        pa.Table: Typed table holding the rows.
+    """
+    arrays = []
+    for field, column in zip(schema, zip(*rows)):
+        if pa.types.is_timestamp(field.type):
+            # timestamps are stored as ISO strings by pandas.to_sql
+            arrays.append(pa.array(column, type=pa.string()).cast(field.type))
+        else:
+            arrays.append(pa.array(column, type=field.type))
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def read_sqlite_arrow_batches(sqlite_file_path, table_name, chunk_size=BULK_CHUNK_SIZE, where=None, params=()):
+    """
+    Reads a SQLite table in chunks and yields each chunk as a typed pyarrow table.
+
+    Only one chunk is held in memory at a time.
+
+    Args:
+        sqlite_file_path (str): Path to the SQLite database file.
+        table_name (str): Name of the table in the SQLite database to read.
+        chunk_size (int): Number of rows per yielded table (defaults to 100000).
+        where (str): Optional SQL condition restricting the rows read.
+        params (tuple): Parameters bound to the placeholders in `where`.
+
+    Yields:
+        pa.Table: Tables of at most `chunk_size` rows.
+    """
+    conn = sqlite3.connect(sqlite_file_path)
+    try:
+        schema = sqlite_arrow_schema(conn, table_name)
+        query = f"SELECT * FROM {table_name}"
+        if where:
+            query += f" WHERE {where}"
+        cursor = conn.execute(query, params)
+
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows_to_arrow(rows, schema)
+    finally:
+        conn.close()
+
+
+def rowid_ranges(sqlite_file_path, table_name, n_partitions):
+    """
+    Splits the rowid span of a SQLite table into contiguous, half-open ranges.
+
+    Args:
+        sqlite_file_path (str): Path to the SQLite database file.
+        table_name (str): Name of the table in the SQLite database.
+        n_partitions (int): Number of ranges to create.
+
+    Returns:
+        list[tuple[int, int]]: `(start, stop)` pairs covering `start <= rowid < stop`.
+    """
+    conn = sqlite3.connect(sqlite_file_path)
+    try:
+        lo, hi = conn.execute(f"SELECT MIN(rowid), MAX(rowid) FROM {table_name}").fetchone()
+    finally:
+        conn.close()
+
+    if lo is None:
+        return []
+
+    step = -(-(hi - lo + 1) // n_partitions)  # ceiling division
+    return [(start, min(start + step, hi + 1)) for start in range(lo, hi + 1, step)]
+
+
+def export_rowid_range(sqlite_file_path, table_name, start, stop, out_path, chunk_size=BULK_CHUNK_SIZE, partition=False):
+    """
+    Reads one rowid range of a SQLite table and writes it to a parquet file.
+
+    Runs in a worker process, so it opens its own SQLite connection.
+
+    Args:
+        sqlite_file_path (str): Path to the SQLite database file.
+        table_name (str): Name of the table in the SQLite database.
+        start (int): First rowid of the range (inclusive).
+        stop (int): Last rowid of the range (exclusive).
+        out_path (str): Path of the parquet file to write.
+        chunk_size (int): Number of rows read per `fetchmany` call.
+        partition (bool): If True, the partition columns of `add_partition_columns` are
+            added before writing.
+
+    Returns:
+        dict: Row count, elapsed seconds and rows/s of the range, and the pid of the worker.
+    """
+    t0 = time.perf_counter()
+    n_rows = 0
+    writer = None
+    batches = read_sqlite_arrow_batches(
+        sqlite_file_path, table_name, chunk_size,
+        where="rowid >= ? AND rowid < ?", params=(start, stop)
+    )
+    try:
+        for batch in batches:
+            if partition:
+                batch = add_partition_columns(batch)
+            if writer is None:
+                writer = pq.ParquetWriter(out_path, batch.schema)
+            writer.write_table(batch)
+            n_rows += batch.num_rows
+    finally:
+        if writer is not None:
+            writer.close()
+
+    elapsed = time.perf_counter() - t0
+    return {
+        'start': start,
+        'stop': stop,
+        'path': out_path if writer is not None else None,
+        'rows': n_rows,
+        'seconds': elapsed,
+        'rows_per_second': n_rows / elapsed if elapsed > 0 else float('nan'),
+        'worker': os.getpid(),
+    }
+
+
+def summarize_export(stats, elapsed):
+    """
+    Aggregates the per-range statistics of a parallel export.
+
+    Args:
+        stats (list[dict]): Per-range statistics as returned by `export_rowid_range`.
+        elapsed (float): Wall clock seconds of the whole export.
+
+    Returns:
+        dict: Total `rows`, wall clock `seconds` and `rows_per_second` of the export, and
+        `workers`, the rows, busy seconds and rows/s of every worker process.
+    """
+    workers = {}
+    for s in stats:
+        w = workers.setdefault(s['worker'], {'ranges': 0, 'rows': 0, 'seconds': 0.0})
+        w['ranges'] += 1
+        w['rows'] += s['rows']
+        w['seconds'] += s['seconds']
+    for w in workers.values():
+        w['rows_per_second'] = w['rows'] / w['seconds'] if w['seconds'] > 0 else float('nan')
+
+    rows = sum(s['rows'] for s in stats)
+    return {
+        'rows': rows,
+        'seconds': elapsed,
+        'rows_per_second': rows / elapsed if elapsed > 0 else float('nan'),
+        'workers': workers,
+    }
+
+
+def export_sqlite_parallel(sqlite_file_path, table_name, staging_dir, workers=None, chunk_size=BULK_CHUNK_SIZE, partition=False):
+    """
+    Exports a SQLite table to parquet files in parallel, one rowid range per task.
+
+    Args:
+        sqlite_file_path (str): Path to the SQLite database file.
+        table_name (str): Name of the table in the SQLite database.
+        staging_dir (str): Directory receiving one parquet file per range.
+        workers (int): Number of worker processes (defaults to `os.cpu_count()`).
+        chunk_size (int): Number of rows read per `fetchmany` call.
+        partition (bool): If True, the workers add the partition columns, see `add_partition_columns`.
+
+    Returns:
+        list[dict]: Per-range statistics as returned by `export_rowid_range`, in rowid order.
+    """
+    workers = workers or os.cpu_count()
+    # a few more ranges than workers so that uneven ranges do not leave cores idle
+    ranges = rowid_ranges(sqlite_file_path, table_name, workers * 4)
+
+    t0 = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(
+                export_rowid_range, sqlite_file_path, table_name, start, stop,
+                os.path.join(staging_dir, f"{table_name}_{start:012d}.parquet"), chunk_size, partition
+            )
+            for start, stop in ranges
+        ]
+        stats = [f.result() for f in futures]
+
+    summary = summarize_export(stats, time.perf_counter() - t0)
+    for pid, w in summary['workers'].items():
+        print(f"worker {pid}: {w['rows']} rows in {w['ranges']} ranges, {w['seconds']:.1f}s busy ({w['rows_per_second']:.0f} rows/s)")
+    print(f"exported {summary['rows']} rows with {len(summary['workers'])} workers in {summary['seconds']:.1f}s ({summary['rows_per_second']:.0f} rows/s)")
+
+    return stats
+
+
+def add_partition_columns(batch, time_column='time'):
+    """
+    Adds the `snapshot_date` and `day_type` ('weekday'/'weekend') partition columns.
+
+    Args:
+        batch (pa.Table | pa.RecordBatch): Station status rows.
+        time_column (str): Name of the snapshot timestamp column.
+
+    Returns:
+        pa.Table: `batch` with the two partition columns appended.
+    """
+    table = pa.Table.from_batches([batch]) if isinstance(batch, pa.RecordBatch) else batch
+    ts = table.column(time_column)
+    # arrow counts days from monday = 0
+    weekend = pc.greater_equal(pc.day_of_week(ts), 5)
+    return table\
+        .append_column('snapshot_date', pc.cast(ts, pa.date32()))\
+        .append_column('day_type', pc.if_else(weekend, 'weekend', 'weekday'))
+
+
+def partition_hints(resource):
+    """
+    Marks a resource to load into an iceberg table partitioned by `PARTITION_COLUMNS`.
+
+    The resource must already yield the partition columns, see `partition_by_day`.
+    """
+    resource.apply_hints(table_format="iceberg")
+    return athena_adapter(resource, partition=PARTITION_COLUMNS)
+
+
+def partition_by_day(resource):
+    """
+    Makes a resource load into an iceberg table partitioned by `PARTITION_COLUMNS`.
+
+    Args:
+        resource (dlt.DltResource): Resource yielding arrow tables with a `time` column.
+
+    Returns:
+        dlt.DltResource: The same resource with the partition columns and hints added.
+    """
+    # dlt passes the item meta as second positional argument to functions taking two
+    resource.add_map(lambda batch: add_partition_columns(batch))
+    return partition_hints(resource)
+
+
+def staged_parquet_files(stats):
+    """
+    Hands the parquet files of a parallel export to dlt as they are, one load job per file.
+
+    Args:
+        stats (list[dict]): Per-range statistics as returned by `export_sqlite_parallel`.
+    """
+    schema = None
+    for s in stats:
+        if s['path'] is None:
+            continue
+        # the schema is taken from the first file only, all ranges share it
+        hints = None
+        if schema is None:
+            schema = pq.read_schema(s['path'])
+            hints = schema.empty_table()
+        yield dlt.mark.with_file_import(s['path'], "parquet", s['rows'], hints=hints)
+
+
+def load_sqlite_to_destination(sqlite_file_path, table_name, destination, destination_table_name="default_table", destination_dataset="default", chunk_size=None, bulk=False, workers=1, partition=False):
     """
     Loads a SQLite table to a specified destination (Athena, BigQuery, etc.) using dlt.
     Data is fetched from SQLite in chunks/iteratively using `fetchmany` to ensure memory efficiency.
@@ -13,7 +320,15 @@ def load_sqlite_to_destination(sqlite_file_path, table_name, destination, destin
         destination (str):  Name of the destination (e.g., 'athena', 'bigquery').
         destination_table_name (str): Name of the destination table to create (defaults to "default_table").
         destination_dataset (str): Name of the destination dataset/database (defaults to "default").
-        chunk_size (int): Size of the chunks to load from SQLite in each iteration (defaults to 1000).
+        chunk_size (int): Size of the chunks to load from SQLite in each iteration (defaults to
+            `BULK_CHUNK_SIZE` for the bulk, parallel and partitioned loads, else `ROW_CHUNK_SIZE`).
+        bulk (bool): If True, chunks are handed to dlt as arrow tables and written straight to
+            parquet, skipping the per-row normalizer (defaults to False).
+        workers (int): If greater than 1, the table is split into rowid ranges that are exported
+            to parquet by a pool of worker processes, then loaded in a single run with one load
+            job per range and `workers` load threads (implies `bulk`).
+        partition (bool): If True, the destination table is partitioned by snapshot date and
+            day type, see `partition_by_day` (implies `bulk`, Athena only).
     """
 
     # Create a dlt pipeline to load data to the specified destination
@@ -23,6 +338,9 @@ def load_sqlite_to_destination(sqlite_file_path, table_name, destination, destin
         dataset_name=destination_dataset  # Name of the destination dataset/database
     )
 
+    if chunk_size is None:
+        chunk_size = BULK_CHUNK_SIZE if bulk or workers > 1 or partition else ROW_CHUNK_SIZE
+
     # Function to read data from SQLite in chunks
     def load_data_from_sqlite():
         
@@ -33,31 +351,188 @@ def load_sqlite_to_destination(sqlite_file_path, table_name, destination, destin
         cursor.execute(f"SELECT * FROM {table_name} LIMIT 1")
         column_names = [description[0] for description in cursor.description]
         
-        
-        for row in cursor.execute(f"SELECT * FROM {table_name}"):
-            yield dict(zip(column_names, row))
-            
-        # while True:
-        #     rows = cursor.fetchmany(chunk_size)
-        #     if not rows:
-        #         break  # No more data
-
-        #     # Yield data as dictionaries
-        #     for row in rows:
-        #         yield dict(zip(column_names, row))
+        cursor.execute(f"SELECT * FROM {table_name}")
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break  # No more data
+
+            # Yield data as dictionaries
+            for row in rows:
+                yield dict(zip(column_names, row))
 
         conn.close()
 
+    if workers > 1:
+        with tempfile.TemporaryDirectory() as staging_dir:
+            stats = export_sqlite_parallel(sqlite_file_path, table_name, staging_dir, workers, chunk_size, partition)
+
+            data = dlt.resource(staged_parquet_files(stats), name=destination_table_name)
+            if partition:
+                partition_hints(data)
+
+            # every range is its own load job, loaded by `workers` threads in a single run,
+            # so all ranges are committed as a single load
+            t0 = time.perf_counter()
+            pipeline.extract(data, table_name=destination_table_name, write_disposition="replace")
+            pipeline.normalize()
+            info = pipeline.load(workers=workers)
+            elapsed = time.perf_counter() - t0
+        print(info)
+        rows = sum(s['rows'] for s in stats)
+        print(f"loaded {rows} rows in {elapsed:.1f}s ({rows / elapsed:.0f} rows/s)")
+        return
+
+    if partition:
+        data = partition_by_day(dlt.resource(
+            read_sqlite_arrow_batches(sqlite_file_path, table_name, chunk_size), name=destination_table_name
+        ))
+        bulk = True
+    elif bulk:
+        data = read_sqlite_arrow_batches(sqlite_file_path, table_name, chunk_size)
+    else:
+        data = load_data_from_sqlite()
+
     # Run the pipeline
     info = pipeline.run(
-        load_data_from_sqlite(),
+        data,
         table_name=destination_table_name,
-        write_disposition="replace"  # Or "append", "merge", etc.
+        write_disposition="replace",  # Or "append", "merge", etc.
+        loader_file_format="parquet" if bulk else None
     )
 
     print(info) # Print information about the load
 
 
+def backfill_sqlite_to_destination(sqlite_file_path, table_name, destination, destination_table_name="default_table", destination_dataset="default", chunk_size=BULK_CHUNK_SIZE, checkpoint_rows=5_000_000, partition=False):
+    """
+    Appends a SQLite table to a destination in checkpointed rowid chunks.
+
+    Every chunk of `checkpoint_rows` rowids is loaded in its own pipeline run. The rowid
+    watermark and the number of rows of each chunk are kept in the dlt resource state,
+    which is committed together with the data, so an interrupted backfill resumes after
+    the last committed chunk and a finished one only performs an empty run.
+    At the end, the row count of each chunk is verified against the SQLite table and the
+    total against the destination table.
+
+    Args:
+        sqlite_file_path (str): Path to the SQLite database file.
+        table_name (str): Name of the table in the SQLite database to load.
+        destination (str):  Name of the destination (e.g., 'athena', 'bigquery').
+        destination_table_name (str): Name of the destination table to append to (defaults to "default_table").
+        destination_dataset (str): Name of the destination dataset/database (defaults to "default").
+        chunk_size (int): Number of rows read per `fetchmany` call (defaults to 100000).
+        checkpoint_rows (int): Rowid span loaded per checkpoint (defaults to 5000000).
+        partition (bool): If True, the destination table is partitioned by snapshot date and
+            day type, see `partition_by_day` (Athena only).
+
+    Returns:
+        bool: True if all chunk counts match.
+    """
+    pipeline = dlt.pipeline(
+        pipeline_name='sqlite_backfill',
+        destination=destination,
+        dataset_name=destination_dataset
+    )
+
+    conn = sqlite3.connect(sqlite_file_path)
+    try:
+        lo, hi = conn.execute(f"SELECT MIN(rowid), MAX(rowid) FROM {table_name}").fetchone()
+    finally:
+        conn.close()
+
+    if lo is None:
+        print(f"{table_name} is empty, nothing to backfill")
+        return True
+
+    # filled by the resource, the persisted copy lives in the resource state
+    progress = {}
+
+    @dlt.resource(name=f"{table_name}_backfill", table_name=destination_table_name, write_disposition="append")
+    def backfill_chunk():
+        state = dlt.current.resource_state()
+        chunks = state.setdefault('chunks', {})
+        start = state.get('watermark', lo)
+        progress['chunks'] = dict(chunks)
+        progress['watermark'] = start
+
+        if start > hi:
+            progress['done'] = True
+            return
+
+        stop = min(start + checkpoint_rows, hi + 1)
+        n_rows = 0
+        for batch in read_sqlite_arrow_batches(
+            sqlite_file_path, table_name, chunk_size,
+            where="rowid >= ? AND rowid < ?", params=(start, stop)
+        ):
+            n_rows += batch.num_rows
+            yield batch
+
+        chunks[str(start)] = {'stop': stop, 'rows': n_rows}
+        state['watermark'] = stop
+        progress['chunks'] = dict(chunks)
+        progress['watermark'] = stop
+        progress['done'] = stop > hi
+
+    while not progress.get('done'):
+        t0 = time.perf_counter()
+        resource = backfill_chunk()
+        if partition:
+            partition_by_day(resource)
+        info = pipeline.run(resource, loader_file_format="parquet")
+        print(info)
+        print(f"checkpoint done in {time.perf_counter() - t0:.1f}s, watermark at rowid {progress['watermark']}")
+
+    return verify_backfill(pipeline, sqlite_file_path, table_name, destination_table_name, progress['chunks'])
+
+
+def verify_backfill(pipeline, sqlite_file_path, table_name, destination_table_name, chunks):
+    """
+    Compares the row counts recorded per backfill chunk with the source and destination.
+
+    The destination rows carry no rowid, so it is checked by its total only, which catches
+    missing and duplicated rows. The counts per chunk were read from the source when the
+    chunk was loaded, comparing them with the source again catches rows that changed since.
+
+    Args:
+        pipeline (dlt.Pipeline): Pipeline the backfill was run with.
+        sqlite_file_path (str): Path to the SQLite database file.
+        table_name (str): Name of the table in the SQLite database.
+        destination_table_name (str): Name of the destination table.
+        chunks (dict): Chunk records `{start: {'stop': ..., 'rows': ...}}` from the resource state.
+
+    Returns:
+        bool: True if every chunk and the destination total match.
+    """
+    ok = True
+    conn = sqlite3.connect(sqlite_file_path)
+    try:
+        for start, chunk in sorted(chunks.items(), key=lambda kv: int(kv[0])):
+            expected = conn.execute(
+                f"SELECT COUNT(*) FROM {table_name} WHERE rowid >= ? AND rowid < ?",
+                (int(start), chunk['stop'])
+            ).fetchone()[0]
+            if expected != chunk['rows']:
+                ok = False
+                print(f"rowid [{start}, {chunk['stop']}): loaded {chunk['rows']} rows, source has {expected}")
+    finally:
+        conn.close()
+
+    loaded = sum(chunk['rows'] for chunk in chunks.values())
+    with pipeline.sql_client() as client:
+        qualified_name = client.make_qualified_table_name(destination_table_name)
+        with client.execute_query(f"SELECT COUNT(*) FROM {qualified_name}") as cursor:
+            in_destination = cursor.fetchone()[0]
+
+    if in_destination != loaded:
+        ok = False
+        print(f"{destination_table_name}: {in_destination} rows in destination, {loaded} recorded in checkpoints")
+
+    print(f"verified {len(chunks)} chunks, {loaded} rows: {'OK' if ok else 'MISMATCH'}")
+    return ok
+
+
 def main():
     parser = argparse.ArgumentParser(description='Load a SQLite table to a specified destination.')
     parser.add_argument('sqlite_file_path', help='Path to the SQLite database file.')
@@ -65,12 +540,24 @@ def main():
     parser.add_argument('destination', help='Name of the destination (e.g., "athena", "bigquery").')
     parser.add_argument('--destination_table_name', default='default_table', help='Name of the destination table to create (default: default_table)')
     parser.add_argument('--destination_dataset', default='default', help='Name of the destination dataset/database where to load (default: default)')
-    parser.add_argument('--chunk_size', type=int, default=1000, help='Size of the chunks to load from SQLite (default: 1000)')
+    parser.add_argument('--chunk_size', type=int, default=None, help=f'Size of the chunks to load from SQLite (default: {BULK_CHUNK_SIZE} with --bulk, --workers, --checkpoint_rows or --partition, else {ROW_CHUNK_SIZE})')
+    parser.add_argument('--bulk', action='store_true', help='Read chunks as arrow tables and load them as parquet')
+    parser.add_argument('--workers', type=int, default=1, help='Export rowid ranges with this many processes before loading (default: 1)')
+    parser.add_argument('--checkpoint_rows', type=int, default=None, help='Append in resumable checkpoints of this many rowids instead of replacing the table')
+    parser.add_argument('--partition', action='store_true', help='Partition the destination table by snapshot date and day type (athena only)')
 
 
     args = parser.parse_args()
 
-    load_sqlite_to_destination(args.sqlite_file_path, args.table_name, args.destination, args.destination_table_name, args.destination_dataset, args.chunk_size)
+    if args.chunk_size is None:
+        bulk = args.bulk or args.workers > 1 or args.checkpoint_rows or args.partition
+        args.chunk_size = BULK_CHUNK_SIZE if bulk else ROW_CHUNK_SIZE
+
+    if args.checkpoint_rows:
+        backfill_sqlite_to_destination(args.sqlite_file_path, args.table_name, args.destination, args.destination_table_name, args.destination_dataset, args.chunk_size, args.checkpoint_rows, args.partition)
+        return
+
+    load_sqlite_to_destination(args.sqlite_file_path, args.table_name, args.destination, args.destination_table_name, args.destination_dataset, args.chunk_size, args.bulk, args.workers, args.partition)
 
 if __name__ == '__main__':
     main()
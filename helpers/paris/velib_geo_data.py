@@ -4,73 +4,239 @@
 import geopandas as gpd
 import os
 import pyproj
-pyproj.datadir.set_data_dir("/home/kantundpeterpan/miniconda3/envs/velib/share/proj")
-import sqlite3
+PROJ_DIR = "/home/kantundpeterpan/miniconda3/envs/velib/share/proj"
+if os.path.isdir(PROJ_DIR):
+    pyproj.datadir.set_data_dir(PROJ_DIR)
+import numpy as np
 import pandas as pd
+from scipy.spatial import cKDTree
 import rasterio
 from pathlib import Path
-from rasterstats import point_query
-from pyathena import connect 
-import json
+from rasterio.windows import Window
+from rasterio.warp import transform as warp_transform
+import sys
+import argparse
 # from gbfs
 
 __here__ = Path(__file__).parent
+sys.path.append(str((__here__ / "../..").resolve()))
+from helpers.paris.reference_data import fetch
 
-import os 
-
-aws_access_key_id = os.getenv("aws_access_key_id".upper())
-aws_secret_access_key = os.getenv("aws_secret_access_key".upper())
-
-if aws_access_key_id is None or aws_secret_access_key is None:
+dataset_name = "Paris"
 
-    with open("./.creds/key.json", "r") as f:
-        creds = json.loads(f.read())
-        
-    db = connect(
-        s3_staging_dir='s3://gbfsbikesbucket', 
-        region_name = 'eu-central-1',
-        **creds
-    )
-    
-else:
-    db = connect(
-        s3_staging_dir='s3://gbfsbikesbucket', 
-        region_name = 'eu-central-1',
-        aws_access_key_id = aws_access_key_id,
-        aws_secret_access_key =aws_secret_access_key
-    )
+DEM_PATH = __here__ / '../../data/elevation_data/paris/idf.tif'
 
-dataset_name = "Paris"
+# sampled elevation features per station coordinate
+ELEVATION_CACHE = __here__ / '../../data/elevation_data/paris/station_elevation.parquet'
 
 # Pull town info for Ile-de-France
 ## Population data
 
-def load_towns():
+def load_towns(refresh=False, offline=None):
+    """
+    Communes of Ile-de-France with their 2018 population, in EPSG:2154.
+
+    Args:
+        refresh: Download the reference datasets again, see `reference_data.fetch`.
+        offline: Only use cached reference datasets.
+    """
     #load from IDF data repo, keep only most recent data
-    town_pop_idf = pd.read_csv('https://data.iledefrance.fr/api/explore/v2.1/catalog/datasets/populations-legales-communes-et-arrondissements-municipaux-millesime-ile-de-fran/exports/csv?lang=fr&timezone=Europe%2FBerlin&use_labels=true&delimiter=%3B', sep = ';').query("`Année de recensement` == 2018")
+    town_pop_idf = fetch('towns_population', refresh, offline).query("`Année de recensement` == 2018")
     
     col_map = {col:'_' + str(i) for col, i in zip(town_pop_idf, range(town_pop_idf.shape[-1]))}
     town_pop_idf.columns = town_pop_idf.columns.map(col_map)
     
     ## Town and district data
-    towns = gpd.read_file('https://www.data.gouv.fr/fr/datasets/r/5cd27d86-4859-40dc-b029-a215219eedf9',
-                encoding = 'utf-1').to_crs('EPSG:2154')
+    towns = fetch('communes', refresh, offline).to_crs('EPSG:2154')
     
     towns['insee'] = towns['insee'].astype(int)
     towns = towns.merge(town_pop_idf[['_2', '_6']], left_on = 'insee', right_on = '_2', how = 'inner').rename({'_2':'insee_town_pop', '_6':'pop_tot'}, axis = 1)
 
     return towns
 
-def load_bike_stations():
-    global towns
+def assign_towns(stations, towns):
+    """
+    Assigns the commune of every station with one spatial join.
 
-    ###
+    The join is backed by the STRtree index of `towns`, so every station is only tested
+    against the communes whose bounding box contains it. A station on the border of two
+    communes (intersecting both, but within neither) keeps the first one.
 
-    
-    
-    ###
-    s = pd.read_sql(f'SELECT * from {dataset_name.lower()}.station_info', db)\
+    Args:
+        stations: GeoDataFrame of station points, in the CRS of `towns`.
+        towns: GeoDataFrame of communes, see `load_towns`.
+
+    Returns:
+        GeoDataFrame: `stations` with `town_id` (index in `towns`), `town`, `insee`, `pop_tot`
+        and `in_town`. Stations outside every commune have `in_town` False and missing town columns.
+    """
+    joined = gpd.sjoin(
+        stations[['geometry']], towns[['nomcom', 'insee', 'pop_tot', 'geometry']],
+        how='left', predicate='intersects'
+    )
+    joined = joined[~joined.index.duplicated(keep='first')]
+
+    stations = stations.copy()
+    stations['town_id'] = joined['index_right'].astype('Int64')
+    stations['town'] = joined['nomcom'].str.replace(' Arrondissement', '')
+    stations['insee'] = joined['insee'].astype('Int64')
+    stations['pop_tot'] = joined['pop_tot']
+    stations['in_town'] = joined['index_right'].notna()
+
+    return stations
+
+def sample_elevation(lon, lat, dem_path=DEM_PATH, bilinear=True, crs='EPSG:4326'):
+    """
+    Samples the DEM and its gradient at many points in one call.
+
+    The raster is opened once and only its internal blocks containing points are read,
+    each with a one pixel halo for interpolation and gradients. All points of a block are
+    sampled at once.
+
+    Args:
+        lon: x coordinates of the points.
+        lat: y coordinates of the points.
+        dem_path: Path of the DEM.
+        bilinear: Interpolate bilinearly between pixel centers, like `rasterstats.point_query`
+                  did before, instead of taking the containing pixel.
+        crs: CRS of the coordinates.
+
+    Returns:
+        pd.DataFrame: One row per point with `elevation` (m), `slope` (degrees) and the
+        gradient components `dz_dx`, `dz_dy` (m per m, towards east and north).
+        NaN outside the raster or on nodata pixels.
+    """
+    lon, lat = np.asarray(lon, dtype=float), np.asarray(lat, dtype=float)
+    n = len(lon)
+    out = {c: np.full(n, np.nan) for c in ('elevation', 'dz_dx', 'dz_dy')}
+
+    with rasterio.open(dem_path) as dem:
+        xs, ys = (lon, lat) if dem.crs == crs else map(np.asarray, warp_transform(crs, dem.crs, lon, lat))
+        # fractional pixel coordinates, pixel centers at .5
+        cols, rows = ~dem.transform * (xs, ys)
+        inside = (rows >= 0) & (rows < dem.height) & (cols >= 0) & (cols < dem.width)
+
+        # pixel size in meters, converted at the latitude of every point for geographic DEMs
+        px_x, px_y = abs(dem.transform.a), abs(dem.transform.e)
+        if dem.crs.is_geographic:
+            lat_dem = np.radians(ys)
+            px_x, px_y = px_x * 111_320 * np.cos(lat_dem), np.full(n, px_y * 110_574)
+
+        block_h, block_w = dem.block_shapes[0]
+        point_ids = np.flatnonzero(inside)
+        blocks = (rows[point_ids] // block_h).astype(int) * dem.width + (cols[point_ids] // block_w).astype(int)
+
+        for block in np.unique(blocks):
+            ids = point_ids[blocks == block]
+            row0, col0 = (block // dem.width) * block_h - 1, (block % dem.width) * block_w - 1
+            window = Window(col0, row0, block_w + 2, block_h + 2)
+            z = dem.read(1, window=window, boundless=True, fill_value=dem.nodata, masked=True)
+            z = z.astype(float).filled(np.nan)
+
+            # np.gradient is in elevation per pixel along rows (south) and columns (east)
+            dz_drow, dz_dcol = np.gradient(z)
+
+            r, c = rows[ids] - row0, cols[ids] - col0
+            if bilinear:
+                r0 = np.clip(np.floor(r - 0.5).astype(int), 0, z.shape[0] - 2)
+                c0 = np.clip(np.floor(c - 0.5).astype(int), 0, z.shape[1] - 2)
+                fr, fc = r - 0.5 - r0, c - 0.5 - c0
+
+                def sample(a):
+                    return (a[r0, c0] * (1 - fr) * (1 - fc) + a[r0 + 1, c0] * fr * (1 - fc)
+                            + a[r0, c0 + 1] * (1 - fr) * fc + a[r0 + 1, c0 + 1] * fr * fc)
+            else:
+                ri, ci = r.astype(int), c.astype(int)
+
+                def sample(a):
+                    return a[ri, ci]
+
+            out['elevation'][ids] = sample(z)
+            out['dz_dx'][ids] = sample(dz_dcol) / np.broadcast_to(px_x, n)[ids]
+            out['dz_dy'][ids] = -sample(dz_drow) / np.broadcast_to(px_y, n)[ids]
+
+    out['slope'] = np.degrees(np.arctan(np.hypot(out['dz_dx'], out['dz_dy'])))
+    return pd.DataFrame(out)[['elevation', 'slope', 'dz_dx', 'dz_dy']]
+
+def dem_version(dem_path):
+    """
+    Identity of a DEM file, its resolved path with its size and modification time.
+    """
+    path = Path(dem_path).resolve()
+    stat = path.stat()
+    return f"{path}:{stat.st_size}:{stat.st_mtime_ns}"
+
+def station_elevation(stations, dem_path=DEM_PATH, bilinear=True, cache_path=ELEVATION_CACHE):
+    """
+    Elevation features of the stations, cached per station coordinate and DEM version.
+
+    Only coordinates missing from the cache are sampled, see `sample_elevation`. Replacing
+    the DEM file, or passing another one, does not reuse earlier samples.
+
+    Args:
+        stations: GeoDataFrame of station points.
+        dem_path: Path of the DEM.
+        bilinear: Interpolate bilinearly.
+        cache_path: Parquet file of the sampled coordinates, None disables caching.
+
+    Returns:
+        pd.DataFrame: The `sample_elevation` columns, indexed like `stations`.
+    """
+    points = stations.geometry.to_crs('EPSG:4326')
+    keys = pd.DataFrame({
+        'lon': points.x.round(7).to_numpy(), 'lat': points.y.round(7).to_numpy(), 'bilinear': bilinear,
+        'dem': dem_version(dem_path)
+    })
+    key_columns = list(keys.columns)
+
+    cached = pd.read_parquet(cache_path) if cache_path and Path(cache_path).exists() else None
+    if cached is not None and 'dem' not in cached.columns:
+        # written before samples were keyed on the DEM
+        cached = None
+    if cached is not None:
+        missing = keys.merge(cached[key_columns], how='left', indicator=True)['_merge'].eq('left_only')
+    else:
+        missing = pd.Series(True, index=keys.index)
+
+    todo = keys[missing.to_numpy()].drop_duplicates()
+    if len(todo):
+        sampled = pd.concat([
+            todo.reset_index(drop=True),
+            sample_elevation(todo.lon, todo.lat, dem_path, bilinear)
+        ], axis=1)
+        cached = sampled if cached is None else pd.concat([cached, sampled], ignore_index=True)
+        if cache_path:
+            Path(cache_path).parent.mkdir(parents=True, exist_ok=True)
+            cached.to_parquet(cache_path, index=False)
+
+    features = keys.merge(cached, on=key_columns, how='left')
+    return features.drop(columns=key_columns).set_index(stations.index)
+
+def load_station_info(conn=None):
+    """
+    The `station_info` table of the GBFS pipeline, indexed by station id.
+
+    Args:
+        conn: DB-API connection, defaults to `helpers.cloud.local.get_conn()`, i.e. Athena or
+              the local mirror depending on VELIB_BACKEND.
+    """
+    if conn is None:
+        from helpers.cloud.local import get_conn
+        conn = get_conn()
+
+    return pd.read_sql(f'SELECT * from {dataset_name.lower()}.station_info', conn)\
             .set_index('station_id', drop = True).sort_index()
+
+def load_bike_stations(towns, station_info=None, conn=None):
+    """
+    Bike stations with their commune and elevation features, in EPSG:2154.
+
+    Args:
+        towns: Communes, see `load_towns`.
+        station_info: `station_info` table indexed by station id, loaded through `conn` if None.
+        conn: Connection for `load_station_info`.
+    """
+    s = load_station_info(conn) if station_info is None else station_info
     
     velo_stations = gpd.GeoDataFrame(
         s, 
@@ -80,63 +246,109 @@ def load_bike_stations():
         )
     ).to_crs('EPSG:2154')
 
-    # find town_id for given station
-    velo_stations['town_id'] = velo_stations.geometry\
-            .apply(lambda s: towns.geometry.contains(s).idxmax())
-
-    # get town name for each town id
-    velo_stations['town'] = velo_stations.town_id\
-            .apply(lambda s:towns.loc[s].nomcom.replace(' Arrondissement', ''))
-
-    # dem_data = rasterio.open(__here__ / '../../data/elevation_data/paris/idf.tif')
-    # dem_array = dem_data.read(1)
-
-    # velo_stations_geocoord = velo_stations[['geometry']].to_crs('EPSG:4326')
-    
-    # velo_stations['elevation'] = dem_array[
-    # dem_data.index(
-    #     velo_stations_geocoord.geometry.x.values,
-    #     velo_stations_geocoord.geometry.y.values
-    # )
-    # ]
-
+    # find town, insee code and population for every station
+    velo_stations = assign_towns(velo_stations, towns)
 
-    velo_stations_geocoord = velo_stations[['geometry']].to_crs('EPSG:4326')
-
-    # Use point_query from rasterstats to get elevation values
-    velo_stations['elevation'] = point_query(
-        velo_stations_geocoord.geometry,
-        __here__ / '../../data/elevation_data/paris/idf.tif'
-    )
+    # elevation and slope at every station, from the DEM tiles covering the stations
+    velo_stations = velo_stations.join(station_elevation(velo_stations))
 
     velo_stations['zero_cap'] = velo_stations.capacity.eq(0)
     
     return velo_stations
     
-def load_train_stations():
-    train_stations = gpd.read_file('https://www.data.gouv.fr/fr/datasets/r/e2679f65-0321-403a-8fe6-e51dbcbce309')\
+def load_train_stations(refresh=False, offline=None):
+    """
+    Train and metro stations of Ile-de-France, in EPSG:2154.
+    """
+    train_stations = fetch('train_stations', refresh, offline)\
         .drop(["picto", "geo_point_2d", "x", "y"], axis = 1)\
         .query("idf == 1").to_crs('EPSG:2154')
 
     return train_stations
 
-def compute_nearest_train_station():
-    global train_stations, velo_stations #BAD BAD BAD
+def transit_proximity(stations, transit_stations, k=3, radii=(250, 500, 1000), crs='EPSG:2154'):
+    """
+    Nearest, k nearest and within-radius transit stations of every station, from one
+    KD-tree query over projected coordinates.
 
-    distmat = velo_stations.geometry.apply(lambda g:train_stations.geometry.distance(g))
-    
-    #get index of nearest train station, references train_stations table
-    velo_stations['nearest_train'] = distmat.apply(lambda r: r.idxmin(), axis = 1)
+    Args:
+        stations: GeoDataFrame of bike station points.
+        transit_stations: GeoDataFrame of transit station points.
+        k: Number of nearest transit stations to return.
+        radii: Radii in meters for which the transit stations in range are counted.
+        crs: Metric CRS the distances are computed in.
 
+    Returns:
+        pd.DataFrame: Indexed like `stations`, with `nearest_train` (index label in
+        `transit_stations`), `min_dist_train`, `nearest_k_train` and `nearest_k_dist`
+        (lists of length k, nearest first) and one `n_train_<r>m` count per radius.
+    """
+    def coords(gdf):
+        points = gdf.geometry.to_crs(crs)
+        return np.column_stack([points.x.to_numpy(), points.y.to_numpy()])
+
+    X = coords(stations)
+    tree = cKDTree(coords(transit_stations))
+    labels = transit_stations.index.to_numpy()
+
+    k = min(k, len(transit_stations))
+    dist, idx = tree.query(X, k=k, workers=-1)
+    dist, idx = dist.reshape(len(X), k), idx.reshape(len(X), k)
+
+    result = pd.DataFrame({
+        'nearest_train': labels[idx[:, 0]],
+        'min_dist_train': dist[:, 0],
+        'nearest_k_train': list(labels[idx]),
+        'nearest_k_dist': list(dist),
+    }, index=stations.index)
+
+    for r in radii:
+        result[f'n_train_{r}m'] = tree.query_ball_point(X, r, return_length=True, workers=-1)
+
+    return result
+
+def compute_nearest_train_station(velo_stations, train_stations, k=3, radii=(250, 500, 1000)):
+    """
+    Adds the transit proximity features to the bike stations, see `transit_proximity`.
+
+    Returns:
+        tuple: `velo_stations` with the features, and the train stations that are the nearest
+        one of at least one bike station.
+    """
+    velo_stations = velo_stations.join(transit_proximity(velo_stations, train_stations, k, radii))
 
-    #get distance to nearest train station
-    velo_stations['min_dist_train'] = distmat.apply(lambda r: r.loc[r.idxmin()], axis = 1)
-    
     #remove train stations that are further away than the maxmial minimum distance
-    train_stations = train_stations.loc[velo_stations.nearest_train.values]
+    train_stations = train_stations.loc[velo_stations.nearest_train.unique()]
+
+    return velo_stations, train_stations
+
+def enrich(refresh=False, offline=None, conn=None):
+    """
+    Loads the reference data and the bike stations and computes all station features.
+    Nothing is loaded or computed on import.
+
+    Args:
+        refresh: Download the reference datasets again.
+        offline: Only use cached reference datasets.
+        conn: Connection for `load_station_info`.
+
+    Returns:
+        tuple: `towns`, `velo_stations` and the nearest `train_stations`.
+    """
+    towns = load_towns(refresh, offline)
+    velo_stations = load_bike_stations(towns, conn=conn)
+    train_stations = load_train_stations(refresh, offline)
+    velo_stations, train_stations = compute_nearest_train_station(velo_stations, train_stations)
+
+    return towns, velo_stations, train_stations
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Geo enrichment of the bike stations")
+    parser.add_argument("--refresh", action="store_true", help="Download the reference datasets again")
+    parser.add_argument("--offline", action="store_true", help="Only use cached reference datasets")
+
+    args = parser.parse_args()
 
-towns = load_towns()
-velo_stations = load_bike_stations()
-train_stations = load_train_stations()
-compute_nearest_train_station()
+    towns, velo_stations, train_stations = enrich(args.refresh, args.offline or None)
+    print(velo_stations.drop(columns='geometry').describe())
 
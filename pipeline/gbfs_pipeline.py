@@ -2,13 +2,37 @@
 import dlt
 import gbfs
 import gbfs.services
+import os
+import glob
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from dlt.destinations.adapters import athena_adapter
 import datetime as dt
 import time
 import argparse
-from typing import Iterator, Dict, Any
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, Dict, Any, List, Optional
 import datetime as dt
 
+# column names of the unnested vehicle type counts, kept from the sqlite archive schema
+VEHICLE_TYPE_COLUMNS = {
+    'mechanical': 'no_mechanical',
+    'ebike': 'no_ebike',
+}
+
+# partition columns of station_data, used by the dbt models to prune whole days
+PARTITION_COLUMNS = ['snapshot_date', 'day_type']
+
+# columns compared between two polls in delta mode, in addition to the no_<type> counts
+DELTA_COLUMNS = ['last_reported', 'num_bikes_available', 'num_docks_available']
+
+# file name of the most recent poll in a snapshot directory, read by the live dashboards
+LATEST_SNAPSHOT = "latest.parquet"
+
 
 def create_gbfs_client(city: str):
     """
@@ -32,21 +56,198 @@ def create_gbfs_client(city: str):
         raise ValueError(f"City '{city}' not found in GBFS discovery service. Available cities: {ds.available_systems}") from e
 
 
+def normalize_station_status(stations: List[Dict[str, Any]], now: dt.datetime) -> pa.Table:
+    """
+    Converts the stations of a `station_status` feed into a flat arrow table.
+
+    `num_bikes_available_types` is a list of single-key dicts per station, e.g.
+    `[{"mechanical": 3}, {"ebike": 1}]`. It is converted once to an arrow list of structs
+    and each vehicle type is summed per station by name, so neither the order of the
+    entries nor missing types matter. The `VEHICLE_TYPE_COLUMNS` are always present, with
+    zero counts if no station reports the type.
+
+    Args:
+        stations: The `data.stations` records of the feed.
+        now: Timestamp of the poll, stored in the `time` column.
+
+    Returns:
+        A table with one row per station and one `no_<type>` column per vehicle type,
+        plus the `PARTITION_COLUMNS` derived from `now`.
+    """
+    # stations may lack optional fields or carry extra ones, so the columns are the union
+    # of all keys (from_pylist would only keep the keys of the first record)
+    keys = list(dict.fromkeys(key for station in stations for key in station))
+    table = pa.table({key: [station.get(key) for station in stations] for key in keys})
+    n = table.num_rows
+
+    if 'num_bikes_available_types' in table.column_names:
+        types = table.column('num_bikes_available_types').combine_chunks()
+        table = table.drop_columns(['num_bikes_available_types'])
+
+        # without a single entry in the poll, the type is inferred as null or list<null>
+        if pa.types.is_list(types.type) and pa.types.is_struct(types.type.value_type):
+            # one entry per (station, vehicle type) pair, parents points back to the station row
+            parents = pc.list_parent_indices(types).to_numpy()
+            entries = pc.list_flatten(types)
+
+            for field, values in zip(entries.type, entries.flatten()):
+                counts = pc.fill_null(values, 0).to_numpy(zero_copy_only=False)
+                per_station = np.bincount(parents, weights=counts, minlength=n).astype(np.int64)
+                column = VEHICLE_TYPE_COLUMNS.get(field.name, f'no_{field.name}')
+                table = table.append_column(column, pa.array(per_station))
+
+        for column in VEHICLE_TYPE_COLUMNS.values():
+            if column not in table.column_names:
+                table = table.append_column(column, pa.array(np.zeros(n, dtype=np.int64)))
+
+    day_type = 'weekend' if now.weekday() >= 5 else 'weekday'
+    return table\
+        .append_column('time', pa.array([now] * n, type=pa.timestamp('us')))\
+        .append_column('snapshot_date', pa.array([now.date()] * n, type=pa.date32()))\
+        .append_column('day_type', pa.array([day_type] * n, type=pa.string()))
+
+
+def filter_changed_stations(table: pa.Table, last_seen: Dict[str, List[Any]]) -> pa.Table:
+    """
+    Keeps only the stations whose status changed since they were last emitted.
+
+    Args:
+        table: Normalized station status, see `normalize_station_status`.
+        last_seen: Last emitted values of `DELTA_COLUMNS` and the vehicle type counts per
+                   station id. Updated in place with the emitted stations.
+
+    Returns:
+        The rows of `table` for new or changed stations.
+    """
+    columns = [c for c in DELTA_COLUMNS if c in table.column_names]
+    columns += [c for c in table.column_names if c.startswith('no_')]
+
+    if table.num_rows == 0:
+        return table
+
+    # state is stored as json, so keys are strings and tuples become lists
+    station_ids = pc.cast(table.column('station_id'), pa.string()).to_pandas()
+    current = table.select(columns).to_pandas().set_axis(station_ids, axis=0)
+
+    # signatures of another length were recorded with other vehicle types and count as changed
+    seen = {k: v for k, v in last_seen.items() if len(v) == len(columns)}
+    previous = pd.DataFrame.from_dict(seen, orient='index', columns=columns).reindex(current.index)
+
+    differs = (current != previous) & ~(current.isna() & previous.isna())
+    mask = differs.any(axis=1).to_numpy() | ~current.index.isin(list(seen))
+
+    changed = table.filter(pa.array(mask, type=pa.bool_()))
+    for station_id, signature in zip(station_ids[mask], zip(*(changed.column(c).to_pylist() for c in columns))):
+        last_seen[station_id] = list(signature)
+
+    return changed
+
+
+def write_parquet_atomic(table: pa.Table, path: str):
+    """
+    Writes `table` under a temporary name, syncs and renames it, so readers only ever
+    see complete files.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        pq.write_table(table, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def publish_snapshot(table: pa.Table, snapshot_dir: str) -> str:
+    """
+    Replaces the latest snapshot of `snapshot_dir` with a normalized poll.
+
+    Returns:
+        The path of the snapshot.
+    """
+    path = os.path.join(snapshot_dir, LATEST_SNAPSHOT)
+    write_parquet_atomic(table, path)
+    return path
+
+
+def spool_station_status(client, spool_dir: str, snapshot_dir: Optional[str] = None) -> Optional[str]:
+    """
+    Polls `station_status` once and writes the normalized snapshot to the local spool.
+
+    The file is written atomically, so the spool only ever contains complete snapshots.
+
+    Args:
+        client: The GBFS client of the city.
+        spool_dir: Directory of the spool.
+        snapshot_dir: If given, the poll is also published as the latest snapshot there.
+
+    Returns:
+        The path of the spooled file, or None if the feed was empty.
+    """
+    feed = client.request_feed('station_status')
+    if not (feed and feed.get('data') and feed.get('data').get('stations')):
+        return None
+
+    now = dt.datetime.now()
+    table = normalize_station_status(feed.get('data').get('stations'), now)
+
+    path = os.path.join(spool_dir, f"{time.time_ns()}.parquet")
+    write_parquet_atomic(table, path)
+    if snapshot_dir:
+        publish_snapshot(table, snapshot_dir)
+    return path
+
+
+def list_spool(spool_dir: str) -> List[str]:
+    """
+    Returns the complete snapshots in the spool, oldest first.
+    """
+    return sorted(glob.glob(os.path.join(spool_dir, "*.parquet")))
+
+
+def spool_due(files: List[str], flush_polls: int, flush_minutes: float) -> bool:
+    """
+    Checks whether the spool holds enough polls, or old enough ones, to be flushed.
+
+    Args:
+        files: Spooled snapshots, oldest first.
+        flush_polls: Flush once this many polls are spooled.
+        flush_minutes: Flush once the oldest spooled poll is this many minutes old.
+    """
+    if not files:
+        return False
+    oldest_age = time.time() - os.path.getmtime(files[0])
+    return len(files) >= flush_polls or oldest_age >= flush_minutes * 60
+
+
 @dlt.source(name="gbfs_feed")
-def gbfs_source(city: str):
+def gbfs_source(city: str, client=None, delta: bool = False, spool_files: Optional[List[str]] = None,
+                partition: bool = False, snapshot_dir: Optional[str] = None):
     """
     A dlt source that pulls data from a GBFS feed.
 
     Args:
         city: The name of the city to pull data for.
               This must be a city supported by the GBFS System Discovery Service.
+        client: An existing GBFS client for the city. If None, one is created
+                through the discovery service.
+        delta: If True, station status is only emitted for stations that changed since
+               the previous poll and is written to the `station_changes` table.
+        spool_files: Spooled snapshots to load as station status instead of polling the
+                     feed, see `spool_station_status`.
+        partition: If True, station status is loaded into an iceberg table partitioned
+                   by `PARTITION_COLUMNS` (Athena only).
+        snapshot_dir: If given, every poll is also published as the latest snapshot there,
+                      see `publish_snapshot`.
 
     Returns:
         A dlt source that yields data from the GBFS feed.
     """
-    client = create_gbfs_client(city)
+    client = client or create_gbfs_client(city)
 
-    @dlt.resource(name="station_info", write_disposition="merge", primary_key = "station_id")
+    # station_info is fetched in a worker thread while station_data is extracted. station_data
+    # keeps its delta and spool bookkeeping in the resource state, which dlt does not provide
+    # to parallelized resources, so it stays in the extraction thread
+    @dlt.resource(name="station_info", write_disposition="merge", primary_key = "station_id", parallelized=True)
     def get_stations():
         """
         A dlt resource that pulls station information from the GBFS feed.
@@ -58,48 +259,111 @@ def gbfs_source(city: str):
                 yield station
 
     @dlt.resource(name="station_data", write_disposition="append")
-    def get_station_data() -> Iterator[Dict[str, Any]]:
+    def get_station_data() -> Iterator[pa.Table]:
         """
-        A dlt resource that pulls station status data from the GBFS feed, incrementally.
+        A dlt resource that pulls station status data from the GBFS feed.
 
-        Args:
-            last_updated: An incremental object that keeps track of the last updated timestamp.
+        In delta mode, the last emitted `last_reported` and counts of every station are
+        kept in the resource state and only changed stations are yielded.
+
+        With `spool_files`, all spooled snapshots are yielded as one table. Their paths are
+        recorded in the resource state, which is committed with the load, so files left
+        behind by a crash after a successful load are removed instead of loaded twice.
 
         Yields:
-            A dictionary of station status data.
+            An arrow table of station status data.
         """
-        feed = client.request_feed('station_status')
-        if feed and feed.get('data') and feed.get('data').get('stations'):
+        state = dlt.current.resource_state()
+
+        if spool_files is None:
+            feed = client.request_feed('station_status')
+            if not (feed and feed.get('data') and feed.get('data').get('stations')):
+                return
             stations = feed.get('data').get('stations')
-            
-            df = pd.DataFrame.from_records(stations)
-            # print(df)
-            df['time'] = dt.datetime.now()
-            no_bikes = pd.DataFrame.from_records(df.num_bikes_available_types).map(lambda x:x[list(x.keys())[0]])
-            no_bikes.columns = ['no_mechanical', 'no_ebike']
-
-            df = pd.merge(df.drop('num_bikes_available_types', axis = 1),
-                  no_bikes, right_index = True, left_index = True)
-            # if not df.empty:
-            #     # Ensure 'last_reported' column exists in the DataFrame
-            #     if 'last_reported' not in df.columns:
-            #         print("Warning: 'last_reported' column not found in station data.  Skipping incremental filtering.")
-            #         filtered_df = df
-            #     else:
-            #       # apply a filter based on last_updated to fetch just the new records
-            #         filtered_df = df[df['last_reported'] > last_updated.last_value]
-
-            #     # yield only if the dataframe has new records
-            #     if not filtered_df.empty:
-            #       yield filtered_df.to_dict("records")
-            #     else:
-            #        print("no new records")
-
-            yield df.to_dict("records")
+            tables = [normalize_station_status(stations, dt.datetime.now())]
+            if snapshot_dir:
+                publish_snapshot(tables[0], snapshot_dir)
+        else:
+            for path in state.get('flushed', []):
+                if os.path.exists(path):
+                    os.remove(path)
+            files = [f for f in spool_files if os.path.exists(f)]
+            tables = [pq.read_table(f) for f in files]
+            state['flushed'] = files
+
+        if delta:
+            last_seen = state.setdefault('last_seen', {})
+            # snapshots are compared in poll order
+            tables = [filter_changed_stations(t, last_seen) for t in tables]
+
+        tables = [t for t in tables if t.num_rows > 0]
+        if not tables:
+            print("no station status to load")
+            return
+
+        yield pa.concat_tables(tables, promote_options="default")
+
+    if delta:
+        get_station_data.apply_hints(table_name="station_changes")
+
+    if partition:
+        get_station_data.apply_hints(table_format="iceberg")
+        athena_adapter(get_station_data, partition=PARTITION_COLUMNS)
 
     return get_stations, get_station_data
 
-def main(city: str, dataset_name: str, destination: str = "athena"):
+def run_cycle(pipeline: dlt.Pipeline, city: str, client=None, delta: bool = False,
+              spool_dir: Optional[str] = None, flush_polls: int = 12, flush_minutes: float = 60,
+              snapshot_dir: Optional[str] = None, partition: bool = False):
+    """
+    Runs one poll of a city, either loading it directly or through the local spool.
+
+    With a spool, the poll is only written to `spool_dir`; the spool is loaded as a single
+    parquet file once `flush_polls` polls are collected or the oldest one is
+    `flush_minutes` old. Loaded files are removed afterwards.
+
+    Args:
+        pipeline: The dlt pipeline to load with.
+        city: The name of the city to pull data for.
+        client: An existing GBFS client for the city.
+        delta: Only load stations whose status changed.
+        spool_dir: Directory of the local spool. If None, every poll is loaded.
+        flush_polls: Number of spooled polls that triggers a load.
+        flush_minutes: Age in minutes of the oldest spooled poll that triggers a load.
+        snapshot_dir: Directory where every poll is published as the latest snapshot.
+        partition: Load station status into an iceberg table partitioned by
+                   `PARTITION_COLUMNS`, see `gbfs_source`.
+    """
+    if spool_dir is None:
+        info = pipeline.run(
+            gbfs_source(city=city, client=client, delta=delta, partition=partition, snapshot_dir=snapshot_dir),
+            write_disposition="append"
+        )
+        print(info)
+        return
+
+    client = client or create_gbfs_client(city)
+    spool_station_status(client, spool_dir, snapshot_dir)
+
+    files = list_spool(spool_dir)
+    if not spool_due(files, flush_polls, flush_minutes):
+        print(f"[{city}] {len(files)} poll(s) spooled")
+        return
+
+    info = pipeline.run(
+        gbfs_source(city=city, client=client, delta=delta, spool_files=files, partition=partition),
+        write_disposition="append",
+        loader_file_format="parquet",
+    )
+    print(info)
+    for f in files:
+        if os.path.exists(f):
+            os.remove(f)
+
+
+def main(city: str, dataset_name: str, destination: str = "athena", delta: bool = False,
+         spool_dir: Optional[str] = None, flush_polls: int = 12, flush_minutes: float = 60,
+         snapshot_dir: Optional[str] = None, partition: bool = False):
     """
     Runs the data ingestion pipeline.
 
@@ -107,29 +371,190 @@ def main(city: str, dataset_name: str, destination: str = "athena"):
         city: The name of the city to pull data for.
         dataset_name: The name of the dlt dataset.
         destination: The dlt destination to use.  Defaults to "athena".
+        delta: Only load stations whose status changed. Defaults to False.
+        spool_dir: Collect polls in this local directory and load them in batches,
+                   see `run_cycle`. Defaults to None (load every poll).
+        flush_polls: Number of spooled polls that triggers a load. Defaults to 12.
+        flush_minutes: Age in minutes of the oldest spooled poll that triggers a load. Defaults to 60.
+        snapshot_dir: Publish every poll as the latest snapshot in this directory. Defaults to None.
+        partition: Load station status into a partitioned iceberg table (Athena only). An existing
+                   station status table has to be dropped first. Defaults to False.
     """
     pipeline = dlt.pipeline(
         pipeline_name="gbfs_pipeline",
         destination=destination,
         dataset_name=dataset_name.lower(),
     )
-    data = gbfs_source(city=city)
 
-    info = pipeline.run(data, write_disposition="append")
+    run_cycle(pipeline, city, delta=delta, spool_dir=spool_dir, flush_polls=flush_polls, flush_minutes=flush_minutes,
+              snapshot_dir=snapshot_dir, partition=partition)
 
-    print(info)
+
+def run_city_loop(city: str, dataset_name: str, destination: str, interval: float, stop: threading.Event, delta: bool = False,
+                  spool_dir: Optional[str] = None, flush_polls: int = 12, flush_minutes: float = 60,
+                  snapshot_dir: Optional[str] = None, partition: bool = False):
+    """
+    Polls one city on a fixed schedule until `stop` is set.
+
+    The GBFS client and the dlt pipeline are created once and reused for every cycle.
+    Failures, including creating them (e.g. for an unreachable discovery service), are
+    logged and retried on the next cycle, so the thread only ends when `stop` is set.
+    If a cycle takes longer than `interval`, the missed polls are skipped rather than
+    queued, so a slow feed only delays its own city.
+
+    Args:
+        city: The name of the city to pull data for.
+        dataset_name: The name of the dlt dataset.
+        destination: The dlt destination to use.
+        interval: Seconds between the start of two polls.
+        stop: Event that ends the loop.
+        delta: Only load stations whose status changed.
+        spool_dir: Spool directory of the city, see `run_cycle`.
+        flush_polls: Number of spooled polls that triggers a load.
+        flush_minutes: Age in minutes of the oldest spooled poll that triggers a load.
+        snapshot_dir: Snapshot directory of the city, see `run_cycle`.
+        partition: Load station status into a partitioned iceberg table, see `run_cycle`.
+    """
+    pipeline, client = None, None
+
+    next_run = time.monotonic()
+    while not stop.is_set():
+        started = time.monotonic()
+        try:
+            pipeline = pipeline or dlt.pipeline(
+                pipeline_name=f"gbfs_pipeline_{city.lower()}",
+                destination=destination,
+                dataset_name=dataset_name.lower(),
+            )
+            client = client or create_gbfs_client(city)
+            run_cycle(pipeline, city, client, delta, spool_dir, flush_polls, flush_minutes, snapshot_dir, partition)
+            print(f"[{city}] cycle done in {time.monotonic() - started:.1f}s")
+        except Exception as e:
+            print(f"[{city}] cycle failed: {e}")
+
+        next_run += interval
+        if next_run < time.monotonic():
+            missed = int((time.monotonic() - next_run) // interval) + 1
+            next_run += missed * interval
+            print(f"[{city}] cycle overran, skipping {missed} poll(s)")
+        stop.wait(max(next_run - time.monotonic(), 0))
+
+
+def run_daemon(cities: List[str], dataset_name: str, destination: str = "athena", interval: float = 300, delta: bool = False,
+               spool_dir: Optional[str] = None, flush_polls: int = 12, flush_minutes: float = 60,
+               snapshot_dir: Optional[str] = None, partition: bool = False):
+    """
+    Runs the ingestion pipeline for several cities in one long-running process.
+
+    Every city is polled in its own thread on its own schedule.
+
+    Args:
+        cities: The names of the cities to pull data for.
+        dataset_name: The name of the dlt dataset. Must contain a `{city}` placeholder, filled
+                      with the lower-cased city name, when polling several cities: the tables
+                      have no city column and station ids are only unique within a system.
+        destination: The dlt destination to use.  Defaults to "athena".
+        interval: Seconds between two polls of the same city. Defaults to 300.
+        delta: Only load stations whose status changed. Defaults to False.
+        spool_dir: Root of the local spools, one subdirectory per city. Defaults to None
+                   (load every poll).
+        flush_polls: Number of spooled polls that triggers a load. Defaults to 12.
+        flush_minutes: Age in minutes of the oldest spooled poll that triggers a load. Defaults to 60.
+        snapshot_dir: Root of the latest snapshots, one subdirectory per city. Defaults to None.
+        partition: Load station status into partitioned iceberg tables (Athena only). Defaults to False.
+
+    Raises:
+        ValueError: If several cities would load into the same dataset.
+    """
+    if len(cities) > 1 and "{city}" not in dataset_name:
+        raise ValueError(
+            f"Dataset name '{dataset_name}' has no {{city}} placeholder, several cities would load into the same tables"
+        )
+
+    stop = threading.Event()
+    with ThreadPoolExecutor(max_workers=len(cities), thread_name_prefix="gbfs") as pool:
+        futures = [
+            pool.submit(
+                run_city_loop, city, dataset_name.format(city=city.lower()), destination, interval, stop, delta,
+                os.path.join(spool_dir, city.lower()) if spool_dir else None, flush_polls, flush_minutes,
+                os.path.join(snapshot_dir, city.lower()) if snapshot_dir else None, partition
+            )
+            for city in cities
+        ]
+        try:
+            while not all(f.done() for f in futures):
+                time.sleep(1)
+        except KeyboardInterrupt:
+            print("stopping ...")
+            stop.set()
+
+    # a city loop only ends early on an unexpected error, which is raised here
+    for future in futures:
+        future.result()
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="GBFS Data Ingestion Pipeline")
-    parser.add_argument("city", help="The city to pull GBFS data for")
-    parser.add_argument("dataset_name", help="The name of the dlt dataset")
+    parser.add_argument("city", help="The city to pull GBFS data for (comma separated list in daemon mode)")
+    parser.add_argument("dataset_name", help="The name of the dlt dataset (must contain {city} in daemon mode with several cities)")
     parser.add_argument(
         "--destination",
         default="athena",
         help="The dlt destination to use (e.g., athena, duckdb)",
     )
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="Keep running and poll every city on its own schedule",
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=300,
+        help="Seconds between two polls of a city in daemon mode (default: 300)",
+    )
+
+    parser.add_argument(
+        "--delta",
+        action="store_true",
+        help="Only load stations whose status changed since the previous poll",
+    )
+
+    parser.add_argument(
+        "--spool_dir",
+        default=None,
+        help="Collect polls in this local directory and load them in batches",
+    )
+    parser.add_argument(
+        "--flush_polls",
+        type=int,
+        default=12,
+        help="Load the spool once it holds this many polls (default: 12)",
+    )
+    parser.add_argument(
+        "--flush_minutes",
+        type=float,
+        default=60,
+        help="Load the spool once its oldest poll is this many minutes old (default: 60)",
+    )
+    parser.add_argument(
+        "--snapshot_dir",
+        default=None,
+        help="Publish every poll as latest.parquet in this directory, e.g. for the live dashboard",
+    )
+
+    parser.add_argument(
+        "--partition",
+        action="store_true",
+        help="Load station status into an iceberg table partitioned by snapshot date and day type (athena only, "
+             "an existing non-partitioned table has to be dropped first)",
+    )
 
     args = parser.parse_args()
+    spool = dict(spool_dir=args.spool_dir, flush_polls=args.flush_polls, flush_minutes=args.flush_minutes,
+                 snapshot_dir=args.snapshot_dir, partition=args.partition)
 
-    main(city=args.city, dataset_name=args.dataset_name, destination=args.destination)
+    if args.daemon:
+        run_daemon(cities=args.city.split(","), dataset_name=args.dataset_name, destination=args.destination, interval=args.interval, delta=args.delta, **spool)
+    else:
+        main(city=args.city, dataset_name=args.dataset_name, destination=args.destination, delta=args.delta, **spool)
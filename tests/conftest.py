@@ -0,0 +1,14 @@
+import os
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# the modules are scripts rather than an installed package: make `helpers`, `analysis`
+# and the pipeline modules importable the way the scripts do it themselves
+for path in (ROOT, ROOT / "pipeline"):
+    if str(path) not in sys.path:
+        sys.path.insert(0, str(path))
+
+# dlt would otherwise send anonymous usage events from the test pipelines
+os.environ.setdefault("RUNTIME__DLTHUB_TELEMETRY", "false")
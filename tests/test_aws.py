@@ -0,0 +1,118 @@
+import json
+import os
+
+import pytest
+
+pytest.importorskip("boto3")
+pytest.importorskip("pyathena")
+pytest.importorskip("awswrangler")
+duckdb = pytest.importorskip("duckdb")
+pa = pytest.importorskip("pyarrow")
+import pyarrow.fs as pafs
+import pyarrow.parquet as pq
+
+# the module builds a boto3 session at import time
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "test")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "test")
+from helpers.cloud import aws
+
+
+class ExplainConn:
+    """DB-API connection stand-in returning a fixed EXPLAIN result."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.executed = []
+
+    def cursor(self):
+        return self
+
+    def execute(self, sql):
+        self.executed.append(sql)
+
+    def fetchall(self):
+        return self.rows
+
+
+def plan(size):
+    return json.dumps({"inputTableColumnInfos": [], "estimate": {"outputRowCount": 10.0, "outputSizeInBytes": size}})
+
+
+def test_estimate_result_bytes_joins_rows():
+    text = plan(1234.0)
+    conn = ExplainConn([(text[:20],), (text[20:],)])
+
+    assert aws.estimate_result_bytes("SELECT 1", conn) == 1234.0
+    assert conn.executed == ["EXPLAIN (TYPE IO, FORMAT JSON) SELECT 1"]
+
+
+@pytest.mark.parametrize("rows", [
+    [],
+    [("not json",)],
+    [(json.dumps({"inputTableColumnInfos": []}),)],
+    [(json.dumps([1, 2]),)],
+    [(plan("NaN"),)],
+    [(plan(None),)],
+])
+def test_estimate_result_bytes_without_usable_estimate(rows):
+    assert aws.estimate_result_bytes("SELECT 1", ExplainConn(rows)) is None
+
+
+@pytest.fixture
+def unload_prefix(tmp_path):
+    # duckdb only creates the last level of the COPY directory
+    (tmp_path / "unload").mkdir()
+    return tmp_path / "unload"
+
+
+@pytest.fixture
+def conn():
+    conn = duckdb.connect()
+    conn.execute("CREATE TABLE status AS SELECT range AS station_id, range % 7 AS bikes FROM range(5000)")
+    return conn
+
+
+def test_unload_statement():
+    assert aws.unload_statement("SELECT 1", "s3://b/p/").startswith("UNLOAD (SELECT 1) TO 's3://b/p/'")
+    assert aws.unload_statement("SELECT 1", "/tmp/p/", dialect="duckdb").startswith("COPY (SELECT 1) TO '/tmp/p/'")
+
+
+def test_read_parquet_dir_with_local_stand_in_for_s3(tmp_path):
+    (tmp_path / "bucket" / "unload" / "sub").mkdir(parents=True)
+    pq.write_table(pa.table({"x": [1, 2]}), tmp_path / "bucket" / "unload" / "a.parquet")
+    pq.write_table(pa.table({"x": [3]}), tmp_path / "bucket" / "unload" / "sub" / "b.parquet")
+    filesystem = pafs.SubTreeFileSystem(str(tmp_path), pafs.LocalFileSystem())
+
+    table = aws.read_parquet_dir("s3://bucket/unload/", filesystem)
+
+    assert sorted(table.column("x").to_pylist()) == [1, 2, 3]
+    assert aws.read_parquet_dir("s3://bucket/missing/", filesystem).num_rows == 0
+
+
+def test_read_sql_arrow_unload_path(conn, unload_prefix):
+    sql = "SELECT station_id, bikes FROM status WHERE bikes > 2"
+
+    table = aws.read_sql_arrow(sql, conn, method="unload", unload_prefix=str(unload_prefix), dialect="duckdb")
+
+    expected = conn.execute(sql).df()
+    assert table.num_rows == len(expected)
+    assert sorted(table.column("station_id").to_pylist()) == sorted(expected.station_id.tolist())
+    # the unloaded files are removed once read
+    assert list(unload_prefix.iterdir()) == []
+
+
+def test_read_sql_arrow_falls_back_to_unload_without_estimate(monkeypatch, conn, unload_prefix):
+    monkeypatch.setattr(aws, "estimate_result_bytes", lambda sql, conn: None)
+    unloaded = []
+    statement = aws.unload_statement
+
+    def duckdb_unload(sql, location, dialect):
+        unloaded.append(location)
+        return statement(sql, location, "duckdb")
+
+    monkeypatch.setattr(aws, "unload_statement", duckdb_unload)
+
+    table = aws.read_sql_arrow("SELECT * FROM status", conn, unload_prefix=str(unload_prefix))
+
+    assert table.num_rows == 5000
+    assert len(unloaded) == 1
@@ -0,0 +1,189 @@
+import datetime as dt
+import json
+
+import pytest
+
+pd = pytest.importorskip("pandas")
+
+from helpers.cloud import local
+from helpers.cloud.cache import QueryCache, normalize_sql, referenced_tables, s3_prefix_version
+
+
+def test_normalize_sql_ignores_comments_and_whitespace():
+    a = "SELECT *\n  FROM paris.station_info -- all stations\nWHERE capacity > 0;"
+    b = "/* stations */ SELECT * FROM paris.station_info WHERE capacity > 0"
+
+    assert normalize_sql(a) == normalize_sql(b) == "SELECT * FROM paris.station_info WHERE capacity > 0"
+
+
+def test_referenced_tables_from_and_join():
+    sql = """
+        SELECT s.station_id, i.name
+        FROM paris.historical_data s
+        LEFT JOIN Paris.Station_Info i ON i.station_id = s.station_id
+    """
+
+    assert referenced_tables(sql) == ["paris.historical_data", "paris.station_info"]
+
+
+def test_referenced_tables_skips_function_arguments():
+    sql = """
+        SELECT EXTRACT(hour FROM t.time) AS hour, SUBSTRING(t.name FROM 2) AS name,
+            TRIM(BOTH ' ' FROM t.label) AS label
+        FROM paris.historical_data t
+        WHERE t.comment != 'copied from paris.station_info'
+    """
+
+    assert referenced_tables(sql) == ["paris.historical_data"]
+
+
+def test_referenced_tables_in_subqueries():
+    sql = """
+        WITH recent AS (SELECT * FROM paris.station_changes WHERE time > now() - interval '1' day)
+        SELECT * FROM (SELECT station_id FROM paris.station_info) i
+        JOIN recent r ON r.station_id = i.station_id
+        WHERE i.station_id IN (SELECT station_id FROM paris.historcial_stations)
+    """
+
+    assert referenced_tables(sql) == ["paris.historcial_stations", "paris.station_changes", "paris.station_info"]
+
+
+class FakeS3:
+    def __init__(self, objects):
+        self.objects = objects
+
+    def get_paginator(self, name):
+        assert name == "list_objects_v2"
+        return self
+
+    def paginate(self, Bucket, Prefix):
+        contents = [o for key, o in self.objects.items() if key.startswith(f"{Bucket}/{Prefix}")]
+        yield {"Contents": contents[:1]}
+        yield {"Contents": contents[1:]}
+
+
+def test_s3_prefix_version_changes_on_append():
+    t0 = dt.datetime(2024, 5, 1, tzinfo=dt.timezone.utc)
+    objects = {"bucket/paris/historical_data/a.parquet": {"Size": 10, "LastModified": t0}}
+    s3 = FakeS3(objects)
+    before = s3_prefix_version(s3, "s3://bucket/paris/historical_data/")
+
+    objects["bucket/paris/historical_data/b.parquet"] = {"Size": 5, "LastModified": t0 + dt.timedelta(hours=1)}
+    after = s3_prefix_version(s3, "s3://bucket/paris/historical_data/")
+
+    assert before != after
+    assert after.startswith("2|15|")
+
+
+@pytest.fixture
+def mirror(tmp_path, monkeypatch):
+    """Local mirror with two tables, served by a counting `get_conn`."""
+    pytest.importorskip("duckdb")
+    mirror_dir = tmp_path / "mirror"
+    write_partition(mirror_dir, "historical_data", "2024-05-01", [1, 2, 3])
+    (mirror_dir / "paris" / "station_info").mkdir(parents=True)
+    pd.DataFrame({"station_id": [1, 2, 3], "capacity": [10, 20, 30]})\
+        .to_parquet(mirror_dir / "paris" / "station_info" / "data.parquet")
+
+    opened = []
+
+    def get_conn(backend=None):
+        opened.append(backend)
+        return local.get_duckdb_conn(mirror_dir)
+
+    monkeypatch.setattr(local, "MIRROR_DIR", mirror_dir)
+    monkeypatch.setattr(local, "get_conn", get_conn)
+    return opened
+
+
+def write_partition(mirror_dir, table, day, station_ids):
+    path = mirror_dir / "paris" / table / f"snapshot_date={day}" / "data.parquet"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    pd.DataFrame({"station_id": station_ids, "num_bikes_available": [5] * len(station_ids)}).to_parquet(path)
+
+
+COUNT_SQL = "SELECT COUNT(*) AS n FROM paris.historical_data"
+STATIONS_SQL = "SELECT * FROM paris.station_info ORDER BY station_id"
+
+
+def age(cache, seconds, field="created"):
+    index = json.loads(cache._index_path.read_text())
+    for entry in index.values():
+        entry[field] -= seconds
+    cache._index_path.write_text(json.dumps(index))
+
+
+def test_query_cache_repeat_runs_do_not_connect(mirror, tmp_path):
+    assert QueryCache("duckdb", tmp_path / "cache").read_sql(COUNT_SQL).n[0] == 3
+    assert mirror == ["duckdb"]
+
+    # a new process, with the query formatted differently
+    again = QueryCache("duckdb", tmp_path / "cache").read_sql("SELECT COUNT(*) AS n\n  FROM paris.historical_data;")
+    assert again.n[0] == 3
+    assert mirror == ["duckdb"]
+
+
+def test_query_cache_misses_when_a_table_changes(mirror, tmp_path):
+    cache = QueryCache("duckdb", tmp_path / "cache")
+    cache.read_sql(COUNT_SQL)
+    cache.read_sql(STATIONS_SQL)
+
+    write_partition(local.MIRROR_DIR, "historical_data", "2024-05-02", [1, 2])
+
+    assert QueryCache("duckdb", tmp_path / "cache").read_sql(COUNT_SQL).n[0] == 5
+    assert len(mirror) == 2
+    # results of other tables stay valid
+    QueryCache("duckdb", tmp_path / "cache").read_sql(STATIONS_SQL)
+    assert len(mirror) == 2
+
+
+def test_query_cache_ttl_and_refresh(mirror, tmp_path):
+    cache = QueryCache("duckdb", tmp_path / "cache", ttl=3600)
+    cache.read_sql(COUNT_SQL)
+
+    age(cache, 1800)
+    QueryCache("duckdb", tmp_path / "cache", ttl=3600).read_sql(COUNT_SQL)
+    assert len(mirror) == 1
+
+    age(cache, 1801)
+    QueryCache("duckdb", tmp_path / "cache", ttl=3600).read_sql(COUNT_SQL)
+    assert len(mirror) == 2
+
+    QueryCache("duckdb", tmp_path / "cache", ttl=None).read_sql(COUNT_SQL, refresh=True)
+    assert len(mirror) == 3
+    assert len(list((tmp_path / "cache").glob("*.parquet"))) == 1
+
+
+def test_query_cache_evicts_least_recently_used(mirror, tmp_path):
+    cache = QueryCache("duckdb", tmp_path / "cache")
+    queries = [f"SELECT station_id FROM paris.station_info WHERE station_id > {i}" for i in range(3)]
+
+    cache.read_sql(queries[0])
+    size = next((tmp_path / "cache").glob("*.parquet")).stat().st_size
+    cache.max_bytes = 2 * size + size // 2
+
+    cache.read_sql(queries[1])
+    age(cache, 10, "last_used")
+    cache.read_sql(queries[0])
+    cache.read_sql(queries[2])
+
+    entries = {e["sql"] for e in json.loads(cache._index_path.read_text()).values()}
+    assert entries == {queries[0], queries[2]}
+    assert len(list((tmp_path / "cache").glob("*.parquet"))) == 2
+
+
+def test_query_cache_invalidate(mirror, tmp_path):
+    cache = QueryCache("duckdb", tmp_path / "cache")
+    cache.read_sql(COUNT_SQL)
+    cache.read_sql(STATIONS_SQL)
+    cache.read_sql("SELECT h.station_id, i.capacity FROM paris.historical_data h JOIN paris.station_info i "
+                   "ON h.station_id = i.station_id")
+
+    assert cache.invalidate("Paris.Station_Info") == 2
+    assert [e["sql"] for e in json.loads(cache._index_path.read_text()).values()] == [COUNT_SQL]
+
+    assert cache.invalidate() == 1
+    assert not list((tmp_path / "cache").glob("*.parquet"))
+
+    QueryCache("duckdb", tmp_path / "cache").read_sql(COUNT_SQL)
+    assert len(mirror) == 2
@@ -0,0 +1,69 @@
+import os
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pd = pytest.importorskip("pandas")
+pytest.importorskip("plotly")
+pytest.importorskip("folium")
+
+from analysis.paris import dashboard_bundle
+from analysis.paris.profile_matrix import build_profile_matrix
+
+
+@pytest.fixture
+def src_dir(tmp_path):
+    """Clustering outputs of 6 stations in clusters 2, 3 and 5, without cluster 1 and 4."""
+    station_ids = np.arange(100, 106)
+    clusters = np.array([5, 2, 3, 5, 2, 3])
+    hours = np.tile(np.arange(24), len(station_ids))
+    values = np.random.default_rng(0).uniform(size=len(hours))
+    build_profile_matrix(np.repeat(station_ids, 24), hours, values).save(tmp_path / 'profile_matrix')
+
+    pd.DataFrame({
+        'station_id': station_ids, 'cluster': clusters, 'lat': 48.85 + station_ids / 1e4, 'lon': 2.35,
+        'tsne_1': np.arange(6.0), 'tsne_2': np.arange(6.0),
+    }).to_csv(tmp_path / 'station_clusters_with_info.csv', index=False)
+    pd.DataFrame({'n_clusters': [1, 2, 3], 'wcss': [3.0, 2.0, 1.5]}).to_csv(tmp_path / 'wcss_results.csv', index=False)
+    pd.Series([2, 2, 2], index=pd.Index([2, 3, 5], name='cluster'), name='size').to_csv(tmp_path / 'cluster_sizes.csv')
+    return tmp_path
+
+
+def trace_colors(figure):
+    return {trace['name']: trace['marker']['color'] for trace in figure['data']}
+
+
+def test_figures_color_clusters_by_id(src_dir):
+    figures = dashboard_bundle.load_bundle(src_dir)['figures']
+
+    time_course, tsne = trace_colors(figures['time_course']), trace_colors(figures['tsne'])
+    assert time_course == tsne
+    palette = dashboard_bundle.PALETTE
+    assert time_course['Cluster 5'] == palette[5 % len(palette)]
+
+
+def test_overwritten_profile_matrix_makes_bundle_stale(src_dir):
+    dashboard_bundle.build_bundle(src_dir)
+    assert not dashboard_bundle.is_stale(src_dir)
+
+    # np.save overwrites the files in place, the directory mtime does not change
+    built = (src_dir / dashboard_bundle.BUNDLE_DIR / 'figures.json').stat().st_mtime_ns
+    values = src_dir / 'profile_matrix' / 'values.npy'
+    os.utime(values, ns=(built + 10**9, built + 10**9))
+
+    assert dashboard_bundle.is_stale(src_dir)
+
+
+def test_cached_bundle_key_follows_inputs(src_dir, monkeypatch):
+    pn = pytest.importorskip("panel")
+    keys = []
+    monkeypatch.setattr(pn.state, "as_cached", lambda key, fn, **kwargs: keys.append(key))
+
+    dashboard_bundle.cached_bundle(src_dir)
+    dashboard_bundle.cached_bundle(src_dir)
+    stations = src_dir / 'station_clusters_with_info.csv'
+    mtime = stations.stat().st_mtime_ns + 10**9
+    os.utime(stations, ns=(mtime, mtime))
+    dashboard_bundle.cached_bundle(src_dir)
+
+    assert keys[0] == keys[1] != keys[2]
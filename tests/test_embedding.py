@@ -0,0 +1,69 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("sklearn")
+
+from analysis.paris import embedding
+
+
+@pytest.fixture
+def X():
+    rng = np.random.default_rng(0)
+    centers = rng.uniform(0.2, 0.8, size=(4, 24))
+    return np.vstack([c + rng.normal(0, 0.05, size=(40, 24)) for c in centers])
+
+
+@pytest.fixture
+def station_ids(X):
+    return np.array([f"s{i}" for i in range(len(X))])
+
+
+def test_small_update_of_every_profile_keeps_the_layout(X, station_ids, tmp_path):
+    first = embedding.embed_profiles(X, station_ids, name='weekday', cache_dir=tmp_path)
+
+    # a week of new data moves every mean profile a little
+    Y = X + np.random.default_rng(1).uniform(-0.005, 0.005, size=X.shape)
+    second = embedding.embed_profiles(Y, station_ids, name='weekday', cache_dir=tmp_path)
+
+    np.testing.assert_array_equal(second.to_numpy(), first.to_numpy())
+    assert len(list(tmp_path.glob("*.npz"))) == 2
+
+
+def test_new_station_is_placed_next_to_its_neighbours(X, station_ids, tmp_path):
+    first = embedding.embed_profiles(X, station_ids, name='weekday', cache_dir=tmp_path)
+
+    # a copy of the first station under a new id
+    Y = np.vstack([X, X[:1]])
+    second = embedding.embed_profiles(Y, np.append(station_ids, 'new'), name='weekday', cache_dir=tmp_path)
+
+    np.testing.assert_array_equal(second.iloc[:-1].to_numpy(), first.to_numpy())
+    np.testing.assert_allclose(second.loc['new'], first.loc['s0'], atol=1e-3)
+
+
+def test_large_update_refits_from_the_previous_layout(X, station_ids, tmp_path, monkeypatch):
+    first = embedding.embed_profiles(X, station_ids, name='weekday', cache_dir=tmp_path)
+
+    inits = []
+    fit_embedding = embedding.fit_embedding
+
+    def recording_fit(X, init='pca', *args):
+        inits.append(init)
+        return fit_embedding(X, init, *args)
+
+    monkeypatch.setattr(embedding, 'fit_embedding', recording_fit)
+
+    Y = np.vstack([X + 0.05, X[:1] + 0.05])
+    embedding.embed_profiles(Y, np.append(station_ids, 'new'), name='weekday', cache_dir=tmp_path)
+
+    assert len(inits) == 1 and isinstance(inits[0], np.ndarray)
+    np.testing.assert_array_equal(inits[0][:-1], first.to_numpy())
+    np.testing.assert_allclose(inits[0][-1], first.loc['s0'], atol=1e-3)
+
+
+def test_cache_hit_and_unnamed_embeddings(X, station_ids, tmp_path):
+    first = embedding.embed_profiles(X, station_ids, cache_dir=tmp_path)
+    again = embedding.embed_profiles(X, station_ids, cache_dir=tmp_path)
+
+    np.testing.assert_array_equal(again.to_numpy(), first.to_numpy())
+    assert list(first.index) == list(station_ids)
+    assert not list(tmp_path.glob("latest_*.txt"))
@@ -0,0 +1,209 @@
+import datetime as dt
+import threading
+
+import pytest
+
+pytest.importorskip("dlt")
+pytest.importorskip("gbfs")
+pa = pytest.importorskip("pyarrow")
+
+import gbfs_pipeline
+
+NOW = dt.datetime(2024, 5, 4, 10, 30)  # a saturday
+
+
+def station(station_id, types, **fields):
+    record = {
+        'station_id': station_id,
+        'num_bikes_available': sum(count for entry in types or [] for count in entry.values()),
+        'num_docks_available': 10,
+        'last_reported': 1714815000,
+        'num_bikes_available_types': types,
+    }
+    record.update(fields)
+    return record
+
+
+def test_normalize_sums_vehicle_types_by_name():
+    table = gbfs_pipeline.normalize_station_status([
+        station(1, [{'mechanical': 3}, {'ebike': 1}]),
+        station(2, [{'ebike': 2}, {'mechanical': 0}, {'ebike': 1}]),
+        station(3, []),
+    ], NOW)
+
+    assert table.column('no_mechanical').to_pylist() == [3, 0, 0]
+    assert table.column('no_ebike').to_pylist() == [1, 3, 0]
+    assert 'num_bikes_available_types' not in table.column_names
+    assert table.column('day_type').to_pylist() == ['weekend'] * 3
+    assert table.column('snapshot_date').to_pylist() == [NOW.date()] * 3
+
+
+def test_normalize_keeps_keys_missing_from_first_record():
+    first = station(1, [{'mechanical': 1}])
+    second = station(2, [{'ebike': 1}], is_installed=True, extra='x')
+
+    table = gbfs_pipeline.normalize_station_status([first, second], NOW)
+
+    assert table.column('is_installed').to_pylist() == [None, True]
+    assert table.column('extra').to_pylist() == [None, 'x']
+
+
+@pytest.mark.parametrize('types', [[[], []], [None, None], [None, []]])
+def test_normalize_without_any_vehicle_type_entry(types):
+    table = gbfs_pipeline.normalize_station_status([station(i, t) for i, t in enumerate(types)], NOW)
+
+    assert table.column('no_mechanical').to_pylist() == [0, 0]
+    assert table.column('no_ebike').to_pylist() == [0, 0]
+
+
+class FakeClient:
+    """Serves fixed `station_information` and `station_status` feeds."""
+
+    def __init__(self, stations):
+        self.stations = stations
+
+    def request_feed(self, name):
+        if name == 'station_information':
+            return {'data': {'stations': [{'station_id': s['station_id'], 'name': f"s{s['station_id']}"} for s in self.stations]}}
+        return {'data': {'stations': [dict(s) for s in self.stations]}}
+
+
+@pytest.fixture
+def pipeline(tmp_path):
+    duckdb = pytest.importorskip("duckdb")
+    import dlt
+
+    return dlt.pipeline(
+        pipeline_name="gbfs_test",
+        pipelines_dir=str(tmp_path / "pipelines"),
+        destination=dlt.destinations.duckdb(duckdb.connect(str(tmp_path / "test.duckdb"))),
+        dataset_name="gbfs",
+    )
+
+
+def loaded_rows(pipeline, table_name):
+    with pipeline.sql_client() as client:
+        return client.execute_sql(f"SELECT COUNT(*) FROM {client.make_qualified_table_name(table_name)}")[0][0]
+
+
+def test_delta_state_survives_between_runs(pipeline):
+    client = FakeClient([station(1, [{'mechanical': 1}]), station(2, [{'ebike': 2}])])
+
+    pipeline.run(gbfs_pipeline.gbfs_source("paris", client=client, delta=True))
+    assert loaded_rows(pipeline, "station_changes") == 2
+
+    # unchanged poll: nothing to load, the last seen values come from the committed state
+    pipeline.run(gbfs_pipeline.gbfs_source("paris", client=client, delta=True))
+    assert loaded_rows(pipeline, "station_changes") == 2
+
+    client.stations[1] = station(2, [{'ebike': 1}])
+    pipeline.run(gbfs_pipeline.gbfs_source("paris", client=client, delta=True))
+    assert loaded_rows(pipeline, "station_changes") == 3
+
+    state = pipeline.state['sources']['gbfs_feed']['resources']['station_data']
+    assert set(state['last_seen']) == {'1', '2'}
+
+
+def test_filter_changed_stations_emits_new_and_changed_only():
+    last_seen = {}
+    first = gbfs_pipeline.normalize_station_status(
+        [station(1, [{'mechanical': 1}]), station(2, [{'ebike': 2}]), station(3, [])], NOW
+    )
+    assert gbfs_pipeline.filter_changed_stations(first, last_seen).num_rows == 3
+    assert set(last_seen) == {'1', '2', '3'}
+
+    second = gbfs_pipeline.normalize_station_status([
+        station(1, [{'mechanical': 1}]),
+        station(2, [{'ebike': 1}, {'mechanical': 1}]),  # same total, other vehicle types
+        station(3, [], last_reported=1714815300),
+        station(4, []),
+    ], NOW)
+    changed = gbfs_pipeline.filter_changed_stations(second, last_seen)
+
+    assert changed.column('station_id').to_pylist() == [2, 3, 4]
+    columns = gbfs_pipeline.DELTA_COLUMNS + [c for c in second.column_names if c.startswith('no_')]
+    assert dict(zip(columns, last_seen['2'])) == {
+        'last_reported': 1714815000, 'num_bikes_available': 2, 'num_docks_available': 10,
+        'no_mechanical': 1, 'no_ebike': 1,
+    }
+    assert gbfs_pipeline.filter_changed_stations(second, last_seen).num_rows == 0
+
+
+def test_filter_changed_stations_with_nulls_and_other_vehicle_types():
+    table = gbfs_pipeline.normalize_station_status([station(1, [{'mechanical': 1}], last_reported=None)], NOW)
+    # recorded before a vehicle type was added to the feed
+    last_seen = {'1': [None, 1, 10, 1]}
+
+    assert gbfs_pipeline.filter_changed_stations(table, last_seen).num_rows == 1
+    assert gbfs_pipeline.filter_changed_stations(table, last_seen).num_rows == 0
+
+
+def test_spool_flush_is_not_loaded_twice_after_a_crash(pipeline, tmp_path):
+    spool_dir = tmp_path / "spool"
+    spool_dir.mkdir()
+    client = FakeClient([station(1, [{'mechanical': 1}]), station(2, [{'ebike': 2}])])
+
+    gbfs_pipeline.run_cycle(pipeline, "paris", client, spool_dir=str(spool_dir), flush_polls=2)
+    assert len(gbfs_pipeline.list_spool(str(spool_dir))) == 1
+    gbfs_pipeline.run_cycle(pipeline, "paris", client, spool_dir=str(spool_dir), flush_polls=2)
+    assert loaded_rows(pipeline, "station_data") == 4
+    assert gbfs_pipeline.list_spool(str(spool_dir)) == []
+
+    # loaded, but the process died before removing the spooled files
+    files = [gbfs_pipeline.spool_station_status(client, str(spool_dir)) for _ in range(2)]
+    pipeline.run(gbfs_pipeline.gbfs_source("paris", client=client, spool_files=files))
+    assert loaded_rows(pipeline, "station_data") == 8
+
+    state = pipeline.state['sources']['gbfs_feed']['resources']['station_data']
+    assert state['flushed'] == files
+
+    # the next flush drops the already loaded files instead of loading them again
+    gbfs_pipeline.run_cycle(pipeline, "paris", client, spool_dir=str(spool_dir), flush_polls=1)
+    assert loaded_rows(pipeline, "station_data") == 10
+    assert gbfs_pipeline.list_spool(str(spool_dir)) == []
+
+
+def test_city_loop_retries_when_the_client_cannot_be_created(monkeypatch):
+    stop = threading.Event()
+    attempts, cycles = [], []
+
+    def create_gbfs_client(city):
+        attempts.append(city)
+        if len(attempts) == 1:
+            raise ValueError(f"City '{city}' not found in GBFS discovery service")
+        return object()
+
+    def run_cycle(pipeline, city, client, *args):
+        cycles.append(client)
+        stop.set()
+
+    monkeypatch.setattr(gbfs_pipeline, 'create_gbfs_client', create_gbfs_client)
+    monkeypatch.setattr(gbfs_pipeline, 'run_cycle', run_cycle)
+
+    gbfs_pipeline.run_city_loop("Paris", "paris", "duckdb", interval=0.01, stop=stop)
+
+    assert attempts == ["Paris", "Paris"]
+    assert len(cycles) == 1 and cycles[0] is not None
+
+
+def test_daemon_raises_unexpected_city_loop_errors(monkeypatch):
+    def run_city_loop(city, *args):
+        raise KeyError(city)
+
+    monkeypatch.setattr(gbfs_pipeline, 'run_city_loop', run_city_loop)
+
+    with pytest.raises(KeyError):
+        gbfs_pipeline.run_daemon(["Paris"], "paris", "duckdb")
+
+
+def test_daemon_requires_a_dataset_per_city(monkeypatch):
+    datasets = []
+    monkeypatch.setattr(gbfs_pipeline, 'run_city_loop', lambda city, dataset_name, *args: datasets.append(dataset_name))
+
+    with pytest.raises(ValueError, match="placeholder"):
+        gbfs_pipeline.run_daemon(["Paris", "Lyon"], "bikes", "duckdb")
+    assert datasets == []
+
+    gbfs_pipeline.run_daemon(["Paris", "Lyon"], "bikes_{city}", "duckdb")
+    gbfs_pipeline.run_daemon(["Paris"], "bikes", "duckdb")
+    assert sorted(datasets) == ["bikes", "bikes_lyon", "bikes_paris"]
@@ -0,0 +1,43 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("sklearn")
+
+from analysis.paris import k_selection
+
+
+@pytest.fixture
+def X():
+    rng = np.random.default_rng(0)
+    centers = rng.uniform(0, 1, size=(4, 24))
+    return np.vstack([c + rng.normal(0, 0.02, size=(30, 24)) for c in centers])
+
+
+def test_select_k_cache_key_includes_workers(X, tmp_path):
+    sequential = k_selection.select_k(X, range(1, 9), workers=1, cache_dir=tmp_path)
+    parallel = k_selection.select_k(X, range(1, 9), workers=4, cache_dir=tmp_path)
+
+    assert len(list(tmp_path.glob("*.csv"))) == 2
+    # the parallel sweep fits whole batches of candidates before checking the curve
+    assert len(parallel) >= len(sequential)
+
+
+def test_select_k_warm_start_ignores_workers(X, tmp_path):
+    k_selection.select_k(X, range(1, 6), workers=1, warm_start=True, cache_dir=tmp_path)
+    k_selection.select_k(X, range(1, 6), workers=4, warm_start=True, cache_dir=tmp_path)
+
+    assert len(list(tmp_path.glob("*.csv"))) == 1
+
+
+def test_select_k_cache_key_differs_by_parameter(X, tmp_path):
+    for kwargs in ({}, {'tol': 0.05}, {'patience': 3}, {'random_state': 1}, {'minibatch': True}, {'warm_start': True}):
+        k_selection.select_k(X, range(1, 6), workers=1, cache_dir=tmp_path, **kwargs)
+
+    assert len(list(tmp_path.glob("*.csv"))) == 6
+
+
+def test_select_k_stops_once_flat(X):
+    sweep = k_selection.select_k(X, range(1, 11), workers=1, cache_dir=None)
+
+    assert sweep.n_clusters.tolist()[:4] == [1, 2, 3, 4]
+    assert len(sweep) < 10
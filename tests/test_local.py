@@ -0,0 +1,75 @@
+import datetime as dt
+
+import pytest
+
+pd = pytest.importorskip("pandas")
+duckdb = pytest.importorskip("duckdb")
+
+from helpers.cloud import local
+
+
+@pytest.fixture
+def source():
+    """DuckDB stand-in for Athena, with a historical_data table loaded before partitioning."""
+    conn = duckdb.connect()
+    conn.execute("CREATE SCHEMA paris")
+    conn.execute("""
+        CREATE TABLE paris.historical_data AS
+        SELECT 's' || (i % 3) AS station_id, i AS num_bikes_available,
+            TIMESTAMP '2024-03-01 00:00:00' + INTERVAL (i * 8) HOUR AS time
+        FROM range(9) t(i)
+    """)
+    conn.execute("CREATE TABLE paris.station_info AS SELECT 's' || i AS station_id, 20 + i AS capacity FROM range(3) t(i)")
+    return conn
+
+
+def test_sync_table_derives_snapshot_date_from_time(source, tmp_path):
+    assert local.sync_table('historical_data', 'snapshot_date', mirror_dir=tmp_path, conn=source) == 3
+    assert local.sync_table('station_info', mirror_dir=tmp_path, conn=source) == 1
+
+    partitions = sorted(p.name for p in (tmp_path / "paris" / "historical_data").iterdir())
+    assert partitions == ['snapshot_date=2024-03-01', 'snapshot_date=2024-03-02', 'snapshot_date=2024-03-03']
+
+    mirror = local.get_duckdb_conn(tmp_path)
+    rows = mirror.execute("""
+        SELECT snapshot_date, COUNT(*) AS n, SUM(num_bikes_available) AS bikes
+        FROM paris.historical_data h JOIN paris.station_info i USING (station_id)
+        GROUP BY snapshot_date ORDER BY snapshot_date
+    """).fetchall()
+    assert rows == [(dt.date(2024, 3, 1), 3, 3), (dt.date(2024, 3, 2), 3, 12), (dt.date(2024, 3, 3), 3, 21)]
+
+
+def test_sync_table_pulls_new_and_latest_partitions(source, tmp_path):
+    local.sync_table('historical_data', 'snapshot_date', mirror_dir=tmp_path, conn=source)
+
+    # the last day gets two more rows and a new day starts
+    source.execute("""
+        INSERT INTO paris.historical_data
+        SELECT 's0', 100 + i, TIMESTAMP '2024-03-03 20:00:00' + INTERVAL (i * 2) HOUR FROM range(3) t(i)
+    """)
+    first = (tmp_path / "paris" / "historical_data" / "snapshot_date=2024-03-01" / "data.parquet").stat().st_mtime_ns
+
+    assert local.sync_table('historical_data', 'snapshot_date', mirror_dir=tmp_path, conn=source) == 2
+
+    mirror = local.get_duckdb_conn(tmp_path)
+    assert mirror.execute("SELECT COUNT(*) FROM paris.historical_data").fetchone() == (12,)
+    assert mirror.execute("SELECT COUNT(*) FROM paris.historical_data WHERE snapshot_date = DATE '2024-03-04'").fetchone() == (1,)
+    assert (tmp_path / "paris" / "historical_data" / "snapshot_date=2024-03-01" / "data.parquet").stat().st_mtime_ns == first
+
+
+def test_sync_table_with_stored_partition_column(source, tmp_path):
+    source.execute("ALTER TABLE paris.historical_data ADD COLUMN snapshot_date DATE")
+    source.execute("UPDATE paris.historical_data SET snapshot_date = CAST(time AS date) - INTERVAL 1 DAY")
+
+    assert local.sync_table('historical_data', 'snapshot_date', mirror_dir=tmp_path, conn=source) == 3
+
+    mirror = local.get_duckdb_conn(tmp_path)
+    assert mirror.execute("SELECT MIN(snapshot_date) FROM paris.historical_data").fetchone() == (dt.date(2024, 2, 29),)
+    assert 'snapshot_date' not in pd.read_parquet(next((tmp_path / "paris" / "historical_data").rglob("*.parquet"))).columns
+
+
+def test_get_duckdb_conn_skips_empty_tables(tmp_path):
+    (tmp_path / "paris" / "empty").mkdir(parents=True)
+
+    mirror = local.get_duckdb_conn(tmp_path)
+    assert mirror.execute("SELECT COUNT(*) FROM information_schema.tables WHERE table_schema = 'paris'").fetchone() == (0,)
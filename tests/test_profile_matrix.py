@@ -0,0 +1,41 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pd = pytest.importorskip("pandas")
+
+from analysis.paris.profile_matrix import ProfileMatrix, build_profile_matrix
+
+
+def profile(station_ids):
+    station_ids = pd.Series(station_ids, dtype=object)
+    hours = np.tile(np.arange(24), len(station_ids))
+    values = np.linspace(0, 1, 24 * len(station_ids))
+    return build_profile_matrix(np.repeat(station_ids.to_numpy(), 24), hours, values)
+
+
+@pytest.mark.parametrize("station_ids, dtype_kind", [
+    (["16107", "1001", "213688169"], "U"),
+    ([16107, 1001, 213688169], "i"),
+])
+def test_save_load_memory_mapped_without_pickle(tmp_path, station_ids, dtype_kind):
+    matrix = profile(station_ids)
+    assert matrix.station_ids.dtype == object
+
+    matrix.save(tmp_path / "profile_matrix")
+    loaded = ProfileMatrix.load(tmp_path / "profile_matrix")
+
+    assert loaded.station_ids.dtype.kind == dtype_kind
+    assert isinstance(loaded.values, np.memmap) and isinstance(loaded.station_ids, np.memmap)
+    assert sorted(map(str, loaded.station_ids)) == sorted(map(str, station_ids))
+    np.testing.assert_array_equal(loaded.values, matrix.values)
+    np.testing.assert_array_equal(loaded.mask, matrix.mask)
+
+
+def test_loaded_matrix_selects_by_station_id(tmp_path):
+    profile(["a", "bb", "ccc"]).save(tmp_path / "profile_matrix")
+    loaded = ProfileMatrix.load(tmp_path / "profile_matrix")
+
+    selected = loaded.select(["ccc", "missing", "a"])
+
+    assert list(selected.station_ids) == ["ccc", "a"]
+    assert selected.to_frame().index.tolist() == ["ccc", "a"]
@@ -0,0 +1,48 @@
+import datetime as dt
+
+import pytest
+
+pd = pytest.importorskip("pandas")
+pytest.importorskip("sklearn")
+pytest.importorskip("holidays")
+
+from analysis.paris import station_clustering
+
+
+class RecordingCache:
+    """QueryCache stand-in answering the date range query of `load_rollup`."""
+
+    def __init__(self, first_date, last_date):
+        self.dates = pd.DataFrame({'first_date': [first_date], 'last_date': [last_date]})
+        self.queries = []
+
+    def read_sql(self, sql):
+        self.queries.append(sql)
+        return self.dates if "MIN(snapshot_date)" in sql else pd.DataFrame()
+
+
+def test_public_holidays_cover_the_data_range():
+    dates = station_clustering.public_holidays('2024-05-02', dt.date(2025, 1, 1))
+
+    assert dates[0] == dt.date(2024, 5, 8)
+    assert dates[-1] == dt.date(2025, 1, 1)
+    assert dt.date(2024, 7, 14) in dates and dt.date(2024, 12, 25) in dates
+    assert dt.date(2025, 5, 1) not in dates
+
+
+def test_load_rollup_flags_the_holidays_of_the_data():
+    cache = RecordingCache(dt.date(2025, 4, 1), dt.date(2025, 5, 31))
+
+    station_clustering.load_rollup(cache)
+
+    rollup_sql = cache.queries[-1]
+    assert "DATE '2025-04-21'" in rollup_sql and "DATE '2025-05-29'" in rollup_sql
+    assert "2024" not in rollup_sql.split("WHERE")[0]
+
+
+def test_load_rollup_without_data():
+    cache = RecordingCache(None, None)
+
+    station_clustering.load_rollup(cache)
+
+    assert "false as holiday" in cache.queries[-1]
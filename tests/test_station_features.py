@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from helpers.paris import station_features
+
+
+@pytest.fixture
+def computed(monkeypatch):
+    """Replaces the geo enrichment by a feature derived from the coordinates and records the computed ids."""
+    calls = []
+
+    def compute_features(station_info, refresh_reference=False, offline=None):
+        calls.append(list(station_info.index))
+        return station_info.assign(elevation=station_info.lat * 100)
+
+    monkeypatch.setattr(station_features, 'compute_features', compute_features)
+    return calls
+
+
+def info(**stations):
+    return pd.DataFrame(
+        [dict(station_id=k, name=k, lat=v[0], lon=v[1], capacity=v[2]) for k, v in stations.items()]
+    ).set_index('station_id')
+
+
+def test_refresh_versions_only_recompute_changes(tmp_path, computed):
+    first = info(a=(48.80, 2.30, 20), b=(48.85, 2.35, 30), c=(48.90, 2.40, 25))
+    assert station_features.refresh(station_info=first, feature_dir=tmp_path) == 1
+    assert computed == [['a', 'b', 'c']]
+
+    # unchanged stations, the latest version is returned as is
+    assert station_features.refresh(station_info=first, feature_dir=tmp_path) == 1
+    assert len(computed) == 1
+
+    # b moved, c removed, d added, a renamed (a rename alone does not invalidate the features)
+    second = info(a=(48.80, 2.30, 20), b=(48.86, 2.35, 30), d=(48.95, 2.45, 10))
+    second.loc['a', 'name'] = 'a renamed'
+    assert station_features.refresh(station_info=second, feature_dir=tmp_path) == 2
+    assert computed[-1] == ['b', 'd']
+
+    latest = station_features.load_features(feature_dir=tmp_path)
+    assert list(latest.index) == ['a', 'b', 'd']
+    np.testing.assert_allclose(latest.elevation, second.lat * 100)
+    assert latest.loc['a', 'name'] == 'a renamed'
+
+    entry = station_features.load_manifest(tmp_path)['versions'][-1]
+    assert (entry['n_stations'], entry['n_computed'], entry['n_removed']) == (3, 2, 1)
+
+    # earlier versions stay untouched
+    pd.testing.assert_frame_equal(station_features.load_features(1, feature_dir=tmp_path),
+                                  first.assign(elevation=first.lat * 100))
+
+
+def test_refresh_removal_only_and_full(tmp_path, computed):
+    station_features.refresh(station_info=info(a=(48.8, 2.3, 20), b=(48.9, 2.4, 30)), feature_dir=tmp_path)
+
+    assert station_features.refresh(station_info=info(a=(48.8, 2.3, 20)), feature_dir=tmp_path) == 2
+    assert len(computed) == 1
+    assert list(station_features.load_features(feature_dir=tmp_path).index) == ['a']
+
+    assert station_features.refresh(station_info=info(a=(48.8, 2.3, 20)), full=True, feature_dir=tmp_path) == 3
+    assert computed[-1] == ['a']
+
+
+def test_changed_stations_ignores_matching_nans():
+    features = info(a=(48.8, 2.3, np.nan), b=(48.9, 2.4, 30), c=(48.7, 2.2, 10))
+    current = info(a=(48.8, 2.3, np.nan), b=(48.9, 2.4, np.nan), c=(48.7, 2.2, 10), d=(48.6, 2.1, 5))
+
+    assert list(station_features.changed_stations(current, features)) == ['b', 'd']
+    assert list(station_features.changed_stations(current, None)) == ['a', 'b', 'c', 'd']
+
+
+def test_load_features_missing(tmp_path, computed):
+    with pytest.raises(FileNotFoundError):
+        station_features.load_features(feature_dir=tmp_path)
+
+    station_features.refresh(station_info=info(a=(48.8, 2.3, 20)), feature_dir=tmp_path)
+    with pytest.raises(FileNotFoundError):
+        station_features.load_features(2, feature_dir=tmp_path)
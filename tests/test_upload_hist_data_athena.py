@@ -0,0 +1,184 @@
+import sqlite3
+
+import pytest
+
+pytest.importorskip("dlt")
+pa = pytest.importorskip("pyarrow")
+pq = pytest.importorskip("pyarrow.parquet")
+
+from helpers.paris import upload_hist_data_athena as upload
+
+
+@pytest.fixture
+def status_db(tmp_path):
+    path = tmp_path / "status.db"
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE status (station_id INTEGER, num_bikes_available INTEGER, time TIMESTAMP)")
+    conn.executemany(
+        "INSERT INTO status VALUES (?, ?, ?)",
+        [(i % 7, i % 11, f"2024-05-{1 + i % 28:02d} 10:00:00") for i in range(103)]
+    )
+    conn.commit()
+    conn.close()
+    return str(path)
+
+
+def test_rowid_ranges_cover_table_without_overlap(status_db):
+    ranges = upload.rowid_ranges(status_db, "status", 4)
+
+    assert ranges[0][0] == 1 and ranges[-1][1] == 104
+    assert all(stop == next_start for (_, stop), (next_start, _) in zip(ranges, ranges[1:]))
+    assert len(ranges) <= 4
+
+
+def test_rowid_ranges_more_partitions_than_rows(status_db):
+    ranges = upload.rowid_ranges(status_db, "status", 500)
+
+    assert len(ranges) == 103
+    assert all(stop - start == 1 for start, stop in ranges)
+
+
+def test_rowid_ranges_empty_table(tmp_path):
+    path = str(tmp_path / "empty.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE status (station_id INTEGER)")
+    conn.close()
+
+    assert upload.rowid_ranges(path, "status", 4) == []
+
+
+def test_read_sqlite_arrow_batches_chunks_with_declared_schema(status_db):
+    batches = list(upload.read_sqlite_arrow_batches(status_db, "status", chunk_size=40))
+
+    assert [b.num_rows for b in batches] == [40, 40, 23]
+    assert all(b.schema == batches[0].schema for b in batches)
+    assert batches[0].schema.field("station_id").type == pa.int64()
+    assert batches[0].schema.field("time").type == pa.timestamp("us")
+
+
+def test_read_sqlite_arrow_batches_rowid_range(status_db):
+    batches = upload.read_sqlite_arrow_batches(
+        status_db, "status", chunk_size=10, where="rowid >= ? AND rowid < ?", params=(11, 36)
+    )
+
+    assert sum(b.num_rows for b in batches) == 25
+
+
+def test_export_sqlite_parallel_writes_every_row_once(status_db, tmp_path):
+    staging_dir = tmp_path / "staging"
+    staging_dir.mkdir()
+
+    stats = upload.export_sqlite_parallel(status_db, "status", str(staging_dir), workers=2, chunk_size=16, partition=True)
+    table = pa.concat_tables(pq.read_table(s['path']) for s in stats if s['path'])
+
+    assert table.num_rows == 103
+    assert sorted(table.column("station_id").to_pylist()) == sorted(i % 7 for i in range(103))
+    assert set(upload.PARTITION_COLUMNS) <= set(table.column_names)
+
+
+def test_summarize_export_per_worker():
+    stats = [
+        {'rows': 100, 'seconds': 1.0, 'worker': 1},
+        {'rows': 300, 'seconds': 1.0, 'worker': 1},
+        {'rows': 50, 'seconds': 0.5, 'worker': 2},
+    ]
+
+    summary = upload.summarize_export(stats, elapsed=2.0)
+
+    assert summary['rows'] == 450
+    assert summary['rows_per_second'] == 225
+    assert summary['workers'][1] == {'ranges': 2, 'rows': 400, 'seconds': 2.0, 'rows_per_second': 200}
+    assert summary['workers'][2]['rows_per_second'] == 100
+
+
+def weekend_and_weekday_batch():
+    import datetime as dt
+    times = [dt.datetime(2024, 5, 4, 23, 59), dt.datetime(2024, 5, 5, 0, 0), dt.datetime(2024, 5, 6, 8, 0)]
+    return pa.table({'station_id': [1, 2, 3], 'time': pa.array(times, type=pa.timestamp('us'))})
+
+
+def test_add_partition_columns():
+    import datetime as dt
+    table = upload.add_partition_columns(weekend_and_weekday_batch().to_batches()[0])
+
+    assert table.column('snapshot_date').to_pylist() == [dt.date(2024, 5, 4), dt.date(2024, 5, 5), dt.date(2024, 5, 6)]
+    assert table.column('day_type').to_pylist() == ['weekend', 'weekend', 'weekday']
+
+
+def test_partition_by_day_adds_columns_and_iceberg_hints():
+    import dlt
+
+    resource = upload.partition_by_day(dlt.resource(iter([weekend_and_weekday_batch()]), name="historical_data"))
+    table_schema = resource.compute_table_schema()
+
+    assert table_schema.get('table_format') == 'iceberg'
+    assert list(resource)[0].column_names[-2:] == upload.PARTITION_COLUMNS
+
+
+@pytest.fixture
+def backfill_destination(tmp_path, monkeypatch):
+    duckdb = pytest.importorskip("duckdb")
+    import dlt
+
+    # the backfill creates its pipeline by name, keep its state out of the home directory
+    monkeypatch.setenv("DLT_DATA_DIR", str(tmp_path / "dlt"))
+    return dlt.destinations.duckdb(str(tmp_path / "backfill.duckdb"))
+
+
+def backfill(status_db, destination):
+    return upload.backfill_sqlite_to_destination(
+        status_db, "status", destination, "historical_data", "paris", chunk_size=10, checkpoint_rows=30
+    )
+
+
+def loaded_station_ids(destination_path):
+    import duckdb
+
+    with duckdb.connect(destination_path, read_only=True) as conn:
+        return sorted(r[0] for r in conn.execute("SELECT station_id FROM paris.historical_data").fetchall())
+
+
+def test_backfill_resumes_after_a_crash_without_duplicates(status_db, backfill_destination, tmp_path, monkeypatch):
+    read_batches = upload.read_sqlite_arrow_batches
+    calls = []
+
+    def crash_in_second_checkpoint(*args, **kwargs):
+        calls.append(kwargs['params'])
+        for i, batch in enumerate(read_batches(*args, **kwargs)):
+            if len(calls) == 2 and i == 1:
+                raise RuntimeError("connection lost")
+            yield batch
+
+    monkeypatch.setattr(upload, "read_sqlite_arrow_batches", crash_in_second_checkpoint)
+    with pytest.raises(Exception):
+        backfill(status_db, backfill_destination)
+    assert calls == [(1, 31), (31, 61)]
+    assert len(loaded_station_ids(str(tmp_path / "backfill.duckdb"))) == 30
+
+    # the re-run starts at the watermark of the last committed checkpoint
+    monkeypatch.setattr(upload, "read_sqlite_arrow_batches", read_batches)
+    assert backfill(status_db, backfill_destination)
+    assert loaded_station_ids(str(tmp_path / "backfill.duckdb")) == sorted(i % 7 for i in range(103))
+
+    # once complete, a re-run loads nothing
+    monkeypatch.setattr(upload, "read_sqlite_arrow_batches", crash_in_second_checkpoint)
+    calls.clear()
+    assert backfill(status_db, backfill_destination)
+    assert calls == []
+    assert len(loaded_station_ids(str(tmp_path / "backfill.duckdb"))) == 103
+
+
+def test_verify_backfill_reports_missing_destination_rows(status_db, backfill_destination, tmp_path):
+    import dlt
+    import duckdb
+
+    assert backfill(status_db, backfill_destination)
+
+    with duckdb.connect(str(tmp_path / "backfill.duckdb")) as conn:
+        conn.execute("DELETE FROM paris.historical_data WHERE station_id = 3")
+
+    pipeline = dlt.pipeline(pipeline_name='sqlite_backfill', destination=backfill_destination, dataset_name='paris')
+    chunks = pipeline.state['sources']['sqlite_backfill']['resources']['status_backfill']['chunks']
+    assert sum(c['rows'] for c in chunks.values()) == 103
+
+    assert not upload.verify_backfill(pipeline, status_db, "status", "historical_data", chunks)
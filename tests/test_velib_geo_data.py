@@ -0,0 +1,197 @@
+import os
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pd = pytest.importorskip("pandas")
+gpd = pytest.importorskip("geopandas")
+pytest.importorskip("rasterio")
+pytest.importorskip("scipy")
+from shapely.geometry import box
+
+from helpers.paris import velib_geo_data
+
+
+def points(xy, crs='EPSG:2154', **columns):
+    xy = np.asarray(xy, dtype=float)
+    return gpd.GeoDataFrame(columns, geometry=gpd.points_from_xy(xy[:, 0], xy[:, 1]), crs=crs)
+
+
+@pytest.fixture
+def towns():
+    return gpd.GeoDataFrame({
+        'nomcom': ['Paris 1er Arrondissement', 'Montreuil', 'Vincennes'],
+        'insee': [75101, 93048, 94080],
+        'pop_tot': [16000, 111000, 49000],
+    }, geometry=[box(0, 0, 10, 10), box(10, 0, 20, 10), box(0, 10, 20, 20)], crs='EPSG:2154', index=[7, 8, 9])
+
+
+def test_assign_towns(towns):
+    stations = points([(5, 5), (15, 2), (3, 15), (50, 50)], station_id=[1, 2, 3, 4])
+    stations.index = ['a', 'b', 'c', 'd']
+
+    assigned = velib_geo_data.assign_towns(stations, towns)
+
+    assert assigned.index.tolist() == ['a', 'b', 'c', 'd']
+    assert assigned.town.tolist()[:3] == ['Paris 1er', 'Montreuil', 'Vincennes']
+    assert assigned.town_id.tolist()[:3] == [7, 8, 9]
+    assert assigned.insee.tolist()[:3] == [75101, 93048, 94080]
+    assert assigned.in_town.tolist() == [True, True, True, False]
+    # outside every commune: missing town columns, the station is kept
+    assert assigned.loc['d', ['town_id', 'town', 'insee', 'pop_tot']].isna().all()
+    assert assigned.station_id.tolist() == [1, 2, 3, 4]
+
+
+def test_assign_towns_keeps_one_commune_on_overlaps(towns):
+    overlapping = pd.concat([towns, towns.iloc[[0]].set_index(pd.Index([10]))])
+
+    assigned = velib_geo_data.assign_towns(points([(5, 5)]), overlapping)
+
+    assert len(assigned) == 1
+    assert assigned.town_id.iloc[0] in (7, 10)
+
+
+def test_assign_towns_station_on_a_border(towns):
+    assigned = velib_geo_data.assign_towns(points([(10, 5)]), towns)
+
+    assert assigned.in_town.iloc[0]
+    assert assigned.town_id.iloc[0] in (7, 8)
+
+
+def test_transit_proximity_matches_brute_force():
+    rng = np.random.default_rng(0)
+    bike_xy = rng.uniform(650_000, 655_000, size=(200, 2))
+    transit_xy = rng.uniform(650_000, 655_000, size=(40, 2))
+    transit = points(transit_xy)
+    transit.index = [f"t{i}" for i in range(40)]
+
+    result = velib_geo_data.transit_proximity(points(bike_xy), transit, k=3, radii=(250, 500))
+
+    dist = np.linalg.norm(bike_xy[:, None, :] - transit_xy[None, :, :], axis=2)
+    order = np.argsort(dist, axis=1)
+    np.testing.assert_allclose(result.min_dist_train, dist.min(axis=1))
+    assert result.nearest_train.tolist() == [f"t{i}" for i in order[:, 0]]
+    np.testing.assert_allclose(np.stack(result.nearest_k_dist), np.take_along_axis(dist, order[:, :3], axis=1))
+    assert result.n_train_250m.tolist() == (dist <= 250).sum(axis=1).tolist()
+    assert result.n_train_500m.tolist() == (dist <= 500).sum(axis=1).tolist()
+
+
+def test_transit_proximity_projects_and_caps_k():
+    # two stations 1 km apart, in geographic coordinates
+    transit = points([(652_000, 6_862_000), (653_000, 6_862_000)]).to_crs('EPSG:4326')
+    stations = points([(652_000, 6_862_100)]).to_crs('EPSG:4326')
+    stations.index = ['s']
+
+    result = velib_geo_data.transit_proximity(stations, transit, k=5, radii=(250,))
+
+    assert result.index.tolist() == ['s']
+    assert result.min_dist_train['s'] == pytest.approx(100, abs=0.5)
+    assert len(result.nearest_k_train['s']) == 2
+    assert result.n_train_250m['s'] == 1
+
+
+def write_dem(path, z, crs, transform):
+    """Writes `z` as a tiled GeoTIFF with 16 x 16 blocks."""
+    import rasterio
+
+    with rasterio.open(
+        path, 'w', driver='GTiff', width=z.shape[1], height=z.shape[0], count=1, dtype='float32', crs=crs,
+        transform=transform, tiled=True, blockxsize=16, blockysize=16, nodata=-9999,
+    ) as dst:
+        dst.write(z.astype('float32'), 1)
+    return path
+
+
+@pytest.fixture
+def dem(tmp_path):
+    """Tiled 64 x 64 geographic DEM over Paris."""
+    from rasterio.transform import from_origin
+
+    rng = np.random.default_rng(0)
+    z = 30 + np.cumsum(rng.normal(0, 1, size=(64, 64)), axis=1)
+    return write_dem(tmp_path / 'dem.tif', z, 'EPSG:4326', from_origin(2.25, 48.90, 0.002, 0.002))
+
+
+@pytest.fixture
+def planar_dem(tmp_path):
+    """Lambert-93 DEM of the plane z = 50 + 0.03 * east - 0.04 * north, with 25 m pixels."""
+    from rasterio.transform import from_origin
+
+    x0, y0, res = 650_000, 6_865_000, 25
+    east = x0 + res * (np.arange(64) + 0.5)
+    north = y0 - res * (np.arange(64) + 0.5)
+    z = 50 + 0.03 * (east[None, :] - x0) - 0.04 * (north[:, None] - y0)
+    return write_dem(tmp_path / 'planar.tif', z, 'EPSG:2154', from_origin(x0, y0, res, res))
+
+
+def test_station_elevation_matches_rasterstats_point_query(dem):
+    rasterstats = pytest.importorskip("rasterstats")
+    rng = np.random.default_rng(1)
+    # away from the raster edge, where point_query has no 2 x 2 neighbourhood
+    lonlat = np.column_stack([rng.uniform(2.253, 2.375, 300), rng.uniform(48.775, 48.897, 300)])
+    stations = points(lonlat, crs='EPSG:4326').to_crs('EPSG:2154')
+
+    features = velib_geo_data.station_elevation(stations, dem, cache_path=None)
+
+    expected = rasterstats.point_query(list(points(lonlat, crs='EPSG:4326').geometry), str(dem))
+    np.testing.assert_allclose(features.elevation, np.asarray(expected, dtype=float), atol=1e-3)
+    assert features.index.equals(stations.index)
+
+
+def test_sample_elevation_nearest_and_outside(dem):
+    import rasterio
+
+    with rasterio.open(dem) as src:
+        z = src.read(1)
+    # centers of two pixels, and a point outside the raster
+    lon = [2.25 + 0.002 * 10.5, 2.25 + 0.002 * 40.5, 3.0]
+    lat = [48.90 - 0.002 * 20.5, 48.90 - 0.002 * 33.5, 48.85]
+
+    nearest = velib_geo_data.sample_elevation(lon, lat, dem, bilinear=False)
+    bilinear = velib_geo_data.sample_elevation(lon, lat, dem)
+
+    np.testing.assert_allclose(nearest.elevation[:2], [z[20, 10], z[33, 40]], rtol=1e-6)
+    # at pixel centers, the interpolation returns the pixel value
+    np.testing.assert_allclose(bilinear.elevation[:2], nearest.elevation[:2], rtol=1e-6)
+    assert nearest.elevation[2:].isna().all() and bilinear.elevation[2:].isna().all()
+
+
+@pytest.mark.parametrize("bilinear", [True, False])
+def test_sample_elevation_slope_of_a_plane(planar_dem, bilinear):
+    rng = np.random.default_rng(2)
+    east, north = rng.uniform(650_100, 651_500, 50), rng.uniform(6_863_500, 6_864_900, 50)
+
+    features = velib_geo_data.sample_elevation(east, north, planar_dem, bilinear=bilinear, crs='EPSG:2154')
+
+    np.testing.assert_allclose(features.dz_dx, 0.03, rtol=1e-4)
+    np.testing.assert_allclose(features.dz_dy, -0.04, rtol=1e-4)
+    np.testing.assert_allclose(features.slope, np.degrees(np.arctan(0.05)), rtol=1e-4)
+    if bilinear:
+        np.testing.assert_allclose(features.elevation, 50 + 0.03 * (east - 650_000) - 0.04 * (north - 6_865_000),
+                                   rtol=1e-5)
+
+
+def test_station_elevation_cache_is_keyed_on_the_dem(dem, planar_dem, tmp_path):
+    stations = points([[651_000, 6_864_000], [650_500, 6_864_500]])
+    cache = tmp_path / 'elevation.parquet'
+
+    planar = velib_geo_data.station_elevation(stations, planar_dem, cache_path=cache)
+    np.testing.assert_allclose(planar.elevation, [50 + 30 + 40, 50 + 15 + 20], rtol=1e-5)
+
+    # same stations, another DEM sharing the cache
+    other = velib_geo_data.station_elevation(stations, dem, cache_path=cache)
+    pd.testing.assert_frame_equal(other, velib_geo_data.station_elevation(stations, dem, cache_path=None))
+    assert not np.allclose(other.elevation, planar.elevation)
+
+    # the planar DEM is replaced in place by a shifted one
+    import rasterio
+    from rasterio.transform import from_origin
+
+    with rasterio.open(planar_dem) as src:
+        z = src.read(1)
+    write_dem(planar_dem, z + 100, 'EPSG:2154', from_origin(650_000, 6_865_000, 25, 25))
+    os.utime(planar_dem, ns=(0, 10**18))
+
+    shifted = velib_geo_data.station_elevation(stations, planar_dem, cache_path=cache)
+    np.testing.assert_allclose(shifted.elevation, planar.elevation + 100, rtol=1e-5)
+    assert len(pd.read_parquet(cache)) == 6